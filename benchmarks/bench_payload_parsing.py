@@ -0,0 +1,108 @@
+"""Latency and memory of webhook body parsing on a large push payload.
+
+usage:
+    python benchmarks/bench_payload_parsing.py [--size-mb 5] [--repeat 20]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+os.environ.setdefault("PROJECT_A_PROJECT_ID", "15")
+os.environ.setdefault("PROJECT_B_PROJECT_ID", "16")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "functions", "issue_boards_maintainer"))
+
+from gitlab_payload import (  # noqa: E402
+    orjson,
+    json_loads,
+    peek_payload_fields
+)
+
+push_routing_keys = ["project", "ref", "total_commits_count"]
+
+
+def push_payload(size_mb: float) -> str:
+    # shaped after a GitLab push hook, commits make up the bulk of the body
+    commits = []
+    body = {
+        "object_kind": "push",
+        "event_name": "push",
+        "before": "95790bf891e76fee5e1747ab589903a6a1f80f22",
+        "after": "da1560886d4f094c3e6c9ef40349f7d38b5d27d7",
+        "ref": "refs/heads/kitty/feature/large-push",
+        "checkout_sha": "da1560886d4f094c3e6c9ef40349f7d38b5d27d7",
+        "user_id": 4,
+        "user_name": "kitty lin",
+        "project_id": 15,
+        "project": {
+            "id": 15,
+            "name": "project_a",
+            "web_url": "https://gitlab.com/engenius_cloud/project_a"
+        },
+        "commits": commits,
+        "total_commits_count": 0,
+        "push_options": {},
+        "repository": {
+            "name": "project_a",
+            "homepage": "https://gitlab.com/engenius_cloud/project_a"
+        }
+    }
+    commit_size = len(json.dumps(_commit(0)))
+    for index in range(int(size_mb * 1024 * 1024 / commit_size)):
+        commits.append(_commit(index))
+    body["total_commits_count"] = len(commits)
+    return json.dumps(body)
+
+
+def _commit(index: int) -> dict:
+    return {
+        "id": "{:040x}".format(index),
+        "message": "fix \"quoted\" {{braces}} and [brackets] in commit {}\n\nbody".format(index),
+        "timestamp": "2020-05-01T10:00:00+08:00",
+        "url": "https://gitlab.com/engenius_cloud/project_a/-/commit/{:040x}".format(index),
+        "author": {
+            "name": "kitty lin",
+            "email": "kitty@example.com"
+        },
+        "added": ["src/module_{}/file_{}.py".format(index % 17, n) for n in range(3)],
+        "modified": ["src/module_{}/file_{}.py".format(index % 13, n) for n in range(5)],
+        "removed": []
+    }
+
+
+def measure(name: str, parse, body: str, repeat: int) -> None:
+    parse(body)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(body)
+    latency = (time.perf_counter() - started) / repeat
+
+    tracemalloc.start()
+    parse(body)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:<28} {:>10.3f} ms {:>10.2f} MB peak".format(name, latency * 1000, peak / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    body = push_payload(args.size_mb)
+    assert peek_payload_fields(body, push_routing_keys) == {
+        key: value for (key, value) in json.loads(body).items() if key in push_routing_keys
+    }
+    print("push payload: {:.2f} MB, orjson: {}".format(len(body) / 1024 / 1024, orjson is not None))
+    measure("json.loads", json.loads, body, args.repeat)
+    if orjson is not None:
+        measure("orjson.loads", json_loads, body, args.repeat)
+    measure("peek_payload_fields", lambda b: peek_payload_fields(b, push_routing_keys), body, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Run webhook events concurrently in one process, by priority lane.
+
+Used by load_test.py --lanes to measure the per lane latency of event storms.
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Callable,
+    Optional
+)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "functions", "issue_boards_maintainer"))
+
+from gitlab_enum import EventLane  # noqa: E402
+from metrics import put_metric  # noqa: E402
+
+lane_concurrency = {
+    EventLane.PROMOTION.value: int(os.environ.get("LANE_CONCURRENCY_PROMOTION", "2")),
+    EventLane.MERGE.value: int(os.environ.get("LANE_CONCURRENCY_MERGE", "4")),
+    EventLane.OPEN.value: int(os.environ.get("LANE_CONCURRENCY_OPEN", "2")),
+    EventLane.PUSH.value: int(os.environ.get("LANE_CONCURRENCY_PUSH", "2"))
+}
+
+
+class LaneDispatcher:
+    """Run events on worker threads by priority lane, each lane with its own queue and concurrency budget.
+
+    A free worker takes the oldest event of the highest priority lane under its budget, so a flood
+    of pushes never holds more than the push budget while a promotion is waiting.
+
+    Args:
+        handler (Callable): Called with each event, eg. lambda event: issue_boards_maintainer(event, None).
+        concurrency (Dict[str, int], optional): lane => concurrent events, lane_concurrency by default.
+        emit_metrics (bool, optional): Emit the LaneWait and LaneLatency metrics of each event.
+
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Any],
+        concurrency: Optional[Dict[str, int]] = None,
+        emit_metrics: bool = True
+    ):
+        self.handler = handler
+        self.concurrency = dict(lane_concurrency, **(concurrency or {}))
+        self.emit_metrics = emit_metrics
+        self.queues = {lane: deque() for lane in EventLane.value_list()}
+        self.running = {lane: 0 for lane in EventLane.value_list()}
+        # lane => latency in seconds from submission to completion of each event
+        self.latencies = {lane: [] for lane in EventLane.value_list()}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.workers = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(sum(self.concurrency.values()))]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, event: Any, lane: str) -> Future:
+        future = Future()
+        with self.condition:
+            self.queues[lane].append((event, future, time.monotonic()))
+            self.condition.notify()
+        return future
+
+    def shutdown(self) -> None:
+        """Wait for the queued events, then stop the workers."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def _next_task(self) -> Optional[Tuple[str, Tuple[Any, Future, float]]]:
+        for lane in EventLane.value_list():
+            if len(self.queues[lane]) != 0 and self.running[lane] < self.concurrency[lane]:
+                self.running[lane] += 1
+                return lane, self.queues[lane].popleft()
+        return None
+
+    def _queued(self) -> List[str]:
+        return [lane for lane in EventLane.value_list() if len(self.queues[lane]) != 0]
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                task = self._next_task()
+                while task is None:
+                    if self.closed and len(self._queued()) == 0:
+                        return
+                    self.condition.wait()
+                    task = self._next_task()
+            lane, (event, future, submitted_at) = task
+
+            started_at = time.monotonic()
+            try:
+                future.set_result(self.handler(event))
+            except Exception as e:
+                future.set_exception(e)
+            finished_at = time.monotonic()
+
+            with self.condition:
+                self.running[lane] -= 1
+                self.latencies[lane].append(finished_at - submitted_at)
+                self.condition.notify_all()
+            if self.emit_metrics:
+                put_metric("LaneWait", (started_at - submitted_at) * 1000, "Milliseconds", {"Lane": lane})
+                put_metric("LaneLatency", (finished_at - submitted_at) * 1000, "Milliseconds", {"Lane": lane})
@@ -0,0 +1,340 @@
+"""Fire storms of webhook events concurrently at issue_boards_maintainer against a local mock GitLab.
+
+usage:
+    python benchmarks/load_test.py [--scenario rebase|cherry-pick|promotion|mixed] [--branches 500]
+                                   [--concurrency 50] [--latency-ms 50] [--jitter-ms 20]
+                                   [--rate-limit 2000] [--rate-window 60] [--lanes] [--json]
+
+Scenarios:
+    rebase       every feature branch is force-pushed at once, each push delivered --pushes-per-branch times
+    cherry-pick  the MRs of every branch in Dev are cherry-picked to staging at once
+    promotion    staging is merged to master while new branches are pushed
+    mixed        a random mix of pushes, MR opens, merges, cherry-picks and promotions
+
+The final board is compared with a sequential replay of the same events through the rules
+(see dry_run.py), which reports duplicate issues and lost label updates. In the mixed scenario
+the order of events on a branch matters, so differences there can also come from reordering.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import contextlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Dict,
+    List,
+    Tuple
+)
+
+project_a_id = int(os.environ.setdefault("PROJECT_A_PROJECT_ID", "15"))
+project_b_id = int(os.environ.setdefault("PROJECT_B_PROJECT_ID", "16"))
+secret_token = os.environ.setdefault("SECRET_TOKEN", "load-test")
+os.environ.setdefault("ACCESS_TOKEN", "load-test")
+work_dir = tempfile.mkdtemp(prefix="issue_boards_load_test_")
+os.environ["RETRY_QUEUE_SQLITE_PATH"] = os.path.join(work_dir, "retry_queue.sqlite3")
+os.environ["MR_CACHE_SQLITE_PATH"] = os.path.join(work_dir, "mr_cache.sqlite3")
+os.environ["CHECKPOINT_SQLITE_PATH"] = os.path.join(work_dir, "checkpoints.sqlite3")
+os.environ["LOCK_SQLITE_PATH"] = os.path.join(work_dir, "locks.sqlite3")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+mock_port = free_port()
+os.environ["GITLAB_API_BASE_URL"] = "http://127.0.0.1:{}/api/v4".format(mock_port)
+
+from mock_gitlab import (  # noqa: E402
+    MockGitLab,
+    start_mock_gitlab
+)
+from dry_run import dry_run_event  # noqa: E402
+from gitlab_enum import IssueLabel  # noqa: E402
+from issue_board import InMemoryBoard  # noqa: E402
+from lambda_function import issue_boards_maintainer  # noqa: E402
+from priority_lanes import classify_event  # noqa: E402
+from lane_dispatcher import (  # noqa: E402
+    LaneDispatcher,
+    lane_concurrency
+)
+from gitlab_payload import json_loads  # noqa: E402
+
+
+def webhook_event(gitlab_event: str, project_id: int, body: Dict) -> Dict:
+    body = dict(body, project={"id": project_id, "name": "project"})
+    return {
+        "headers": {
+            "X-Gitlab-Event": gitlab_event,
+            "X-Gitlab-Token": secret_token
+        },
+        "body": json.dumps(body)
+    }
+
+
+def push_event(project_id: int, branch: str) -> Dict:
+    return webhook_event("Push Hook", project_id, {
+        "ref": "refs/heads/" + branch,
+        "commits": [{"id": "{:040x}".format(random.getrandbits(160)), "message": "rebase"}],
+        "total_commits_count": 1
+    })
+
+
+def merge_request_event(project_id: int, mr_iid: int, action: str, source_branch: str, target_branch: str,
+                        description: str = "") -> Dict:
+    return webhook_event("Merge Request Hook", project_id, {
+        "object_attributes": {
+            "iid": mr_iid,
+            "action": action,
+            "source_branch": source_branch,
+            "target_branch": target_branch,
+            "description": description,
+            "url": "https://gitlab.com/project/-/merge_requests/{}".format(mr_iid)
+        }
+    })
+
+
+def feature_branch(index: int) -> str:
+    # fixed width names, so no branch name is a substring of another in the issue title search
+    return "kitty/{}/branch-{:05d}".format(("feature", "bugfix", "change")[index % 3], index)
+
+
+def branch_to_dev(project_id: int, index: int, mr_iid: int) -> List[Dict]:
+    return [
+        push_event(project_id, feature_branch(index)),
+        merge_request_event(project_id, mr_iid, "open", feature_branch(index), "dev"),
+        merge_request_event(project_id, mr_iid, "merge", feature_branch(index), "dev")
+    ]
+
+
+def rebase_scenario(branches: int, pushes_per_branch: int) -> Tuple[List[Dict], List[Dict]]:
+    storm = [push_event(project_a_id, feature_branch(index))
+             for index in range(branches) for _ in range(pushes_per_branch)]
+    random.shuffle(storm)
+    return [], storm
+
+
+def cherry_pick_scenario(branches: int) -> Tuple[List[Dict], List[Dict]]:
+    setup = []
+    storm = []
+    for index in range(branches):
+        project_id = (project_a_id, project_b_id)[index % 2]
+        setup += branch_to_dev(project_id, index, index + 1)
+        storm.append(merge_request_event(project_id, 100000 + index, "merge",
+                                         "cherry-pick-{:08x}".format(index), "staging",
+                                         "See merge request group/project!{}\n\n(cherry picked from commit {:08x})".format(index + 1, index)))
+    random.shuffle(storm)
+    return setup, storm
+
+
+def promotion_scenario(branches: int) -> Tuple[List[Dict], List[Dict]]:
+    setup = []
+    for index in range(branches):
+        setup += branch_to_dev(project_a_id, index, index + 1)
+        setup.append(merge_request_event(project_a_id, index + 1, "merge", feature_branch(index), "staging"))
+    storm = [push_event(project_a_id, feature_branch(branches + index)) for index in range(branches)]
+    storm.insert(random.randrange(len(storm) // 2 + 1),
+                 merge_request_event(project_a_id, 200000, "merge", "staging", "master"))
+    return setup, storm
+
+
+def mixed_scenario(branches: int) -> Tuple[List[Dict], List[Dict]]:
+    setup = []
+    for index in range(branches):
+        setup += branch_to_dev(project_a_id, index, index + 1)
+    storm = []
+    for number in range(branches * 4):
+        index = random.randrange(branches * 2)
+        project_id = random.choice([project_a_id, project_b_id])
+        choice = random.random()
+        if choice < 0.4:
+            storm.append(push_event(project_id, feature_branch(index)))
+        elif choice < 0.6:
+            storm.append(merge_request_event(project_id, 300000 + number, "open", feature_branch(index), "dev"))
+        elif choice < 0.85:
+            storm.append(merge_request_event(project_id, 300000 + number, "merge", feature_branch(index),
+                                             random.choice(["dev", "staging", "topic/release-{}".format(index % 5)])))
+        elif choice < 0.99:
+            storm.append(merge_request_event(project_id, 300000 + number, "merge", "cherry-pick-{:08x}".format(number),
+                                             "staging", "See merge request group/project!{}".format(index % branches + 1)))
+        else:
+            storm.append(merge_request_event(project_a_id, 300000 + number, "merge", "staging", "master"))
+    return setup, storm
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def issue_key(issue: Dict) -> Tuple[str, Tuple[str, ...]]:
+    stage_labels = IssueLabel.stage_values()
+    return issue["title"], tuple(sorted(label for label in issue["labels"] if label not in stage_labels))
+
+
+def find_anomalies(board: InMemoryBoard, expected_board: InMemoryBoard, responses: List[Dict]) -> Dict:
+    """Compare the board after the storm with the board of a sequential replay.
+
+    Returns:
+        Dict: counts and examples of each kind of anomaly.
+
+    """
+    stage_labels = IssueLabel.stage_values()
+    issues_by_key = {}
+    for issue in board.issues.values():
+        issues_by_key.setdefault(issue_key(issue), []).append(issue)
+    expected_by_key = {}
+    for issue in expected_board.issues.values():
+        expected_by_key.setdefault(issue_key(issue), []).append(issue)
+
+    duplicate_issues = [key for (key, issues) in issues_by_key.items() if len(issues) > 1]
+    conflicting_stages = [issue["iid"] for issue in board.issues.values()
+                          if len([label for label in issue["labels"] if label in stage_labels]) > 1]
+    missing_issues = [key for key in expected_by_key if key not in issues_by_key]
+    unexpected_issues = [key for key in issues_by_key if key not in expected_by_key]
+    lost_updates = []
+    for (key, expected_issues) in expected_by_key.items():
+        expected = expected_issues[0]
+        for issue in issues_by_key.get(key, []):
+            expected_stages = sorted(label for label in expected["labels"] if label in stage_labels)
+            stages = sorted(label for label in issue["labels"] if label in stage_labels)
+            if stages != expected_stages or issue["state"] != expected["state"]:
+                lost_updates.append({"issue": key[0], "expected": expected_stages + [expected["state"]],
+                                     "actual": stages + [issue["state"]]})
+                break
+
+    return {
+        "duplicate_issues": {"count": len(duplicate_issues), "examples": [key[0] for key in duplicate_issues[:5]]},
+        "multiple_issues_responses": sum(1 for response in responses
+                                         if json_loads(response.get("body", "{}")).get("message") == "Multiple Issues"),
+        "conflicting_stage_labels": {"count": len(conflicting_stages), "examples": conflicting_stages[:5]},
+        "missing_issues": {"count": len(missing_issues), "examples": [key[0] for key in missing_issues[:5]]},
+        "unexpected_issues": {"count": len(unexpected_issues), "examples": [key[0] for key in unexpected_issues[:5]]},
+        "lost_label_updates": {"count": len(lost_updates), "examples": lost_updates[:5]}
+    }
+
+
+def run_storm(events: List[Dict], concurrency: int, lanes: bool) -> Tuple[List[Dict], List[float], Dict[str, List[float]]]:
+    """Fire the events concurrently, returning the responses, latencies and latencies by lane."""
+    def handle(event: Dict) -> Tuple[Dict, float]:
+        started_at = time.perf_counter()
+        response = issue_boards_maintainer(event, None)
+        return response, time.perf_counter() - started_at
+
+    if lanes:
+        # scale the lane budgets to the concurrency, keeping their proportions
+        scale = max(1, concurrency // sum(lane_concurrency.values()))
+        dispatcher = LaneDispatcher(handle, {lane: budget * scale for (lane, budget) in lane_concurrency.items()},
+                                    emit_metrics=False)
+        futures = []
+        for event in events:
+            body_json = json_loads(event["body"])
+            futures.append(dispatcher.submit(event, classify_event(event["headers"]["X-Gitlab-Event"], body_json)))
+        results = [future.result() for future in futures]
+        dispatcher.shutdown()
+        lane_latencies = dispatcher.latencies
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(handle, events))
+        lane_latencies = {}
+    return [response for (response, _) in results], [latency for (_, latency) in results], lane_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test issue_boards_maintainer against a mock GitLab.")
+    parser.add_argument("--scenario", choices=["rebase", "cherry-pick", "promotion", "mixed"], default="rebase")
+    parser.add_argument("--branches", type=int, default=500)
+    parser.add_argument("--pushes-per-branch", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--rate-limit", type=int, default=None, help="calls per rate limit window, unlimited by default")
+    parser.add_argument("--rate-window", type=float, default=60)
+    parser.add_argument("--lanes", action="store_true", help="dispatch through lane_dispatcher.LaneDispatcher")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.scenario == "rebase":
+        setup, storm = rebase_scenario(args.branches, args.pushes_per_branch)
+    elif args.scenario == "cherry-pick":
+        setup, storm = cherry_pick_scenario(args.branches)
+    elif args.scenario == "promotion":
+        setup, storm = promotion_scenario(args.branches)
+    else:
+        setup, storm = mixed_scenario(args.branches)
+
+    gitlab = MockGitLab()
+    start_mock_gitlab(gitlab, mock_port)
+
+    # the function logs metrics and errors to stdout, keep it for the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for event in setup:
+            issue_boards_maintainer(event, None)
+        gitlab.calls = []
+        gitlab.latency = args.latency_ms / 1000
+        gitlab.jitter = args.jitter_ms / 1000
+        gitlab.rate_limit = args.rate_limit
+        gitlab.rate_window = args.rate_window
+        gitlab.window_started_at = time.time()
+
+        started_at = time.perf_counter()
+        responses, latencies, lane_latencies = run_storm(storm, args.concurrency, args.lanes)
+        elapsed = time.perf_counter() - started_at
+
+        expected_board = InMemoryBoard({"milestones": gitlab.milestones})
+        for event in setup + storm:
+            dry_run_event(event, expected_board)
+
+    endpoint_calls = Counter(endpoint for (_, endpoint) in gitlab.calls)
+    report = {
+        "scenario": args.scenario,
+        "events": len(storm),
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_events_per_second": round(len(storm) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 1),
+            "p90": round(percentile(latencies, 0.9) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "max": round(max(latencies, default=0) * 1000, 1)
+        },
+        "lane_latency_p99_ms": {lane: round(percentile(values, 0.99) * 1000, 1)
+                                for (lane, values) in lane_latencies.items() if len(values) != 0},
+        "status_codes": dict(Counter(response.get("statusCode") for response in responses)),
+        "api_calls": len(gitlab.calls),
+        "api_calls_per_event": round(len(gitlab.calls) / len(storm), 2) if storm else 0,
+        "api_calls_by_endpoint": dict(endpoint_calls.most_common()),
+        "rate_limited_calls": gitlab.rate_limited,
+        "anomalies": find_anomalies(gitlab.board, expected_board, responses)
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print("{scenario}: {events} events, concurrency {concurrency}".format(**report))
+    print("  throughput  {throughput_events_per_second} events/s in {elapsed_seconds} s".format(**report))
+    print("  latency     p50 {p50} ms, p90 {p90} ms, p99 {p99} ms, max {max} ms".format(**report["latency_ms"]))
+    for (lane, value) in report["lane_latency_p99_ms"].items():
+        print("  lane        {} p99 {} ms".format(lane, value))
+    print("  status      {}".format(report["status_codes"]))
+    print("  api calls   {api_calls} ({api_calls_per_event} per event), {rate_limited_calls} rate limited".format(**report))
+    for (endpoint, count) in report["api_calls_by_endpoint"].items():
+        print("              {:<40} {}".format(endpoint, count))
+    print("  anomalies")
+    for (name, value) in report["anomalies"].items():
+        print("              {:<28} {}".format(name, json.dumps(value)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""A local GitLab API stand-in backed by an in-memory board, with latency and a rate limit.
+
+Serves the endpoints used by the lambda functions:
+    GET  /projects/:id/issues                 labels, search, state, sort, created_after, page, per_page (20 by default)
+    POST /projects/:id/issues
+    PUT  /projects/:id/issues/:iid
+    GET  /projects/:id/milestones             state, page, per_page
+    GET  /projects/:id/merge_requests         state, updated_after, updated_before, order_by, sort, page, per_page
+    GET  /projects/:id/merge_requests/:iid
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+from http.server import (
+    ThreadingHTTPServer,
+    BaseHTTPRequestHandler
+)
+from urllib.parse import (
+    urlparse,
+    parse_qs
+)
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Optional
+)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "functions", "issue_boards_maintainer"))
+
+from issue_board import InMemoryBoard  # noqa: E402
+from issue_planner import Mutation  # noqa: E402
+
+gitlab_default_per_page = 20
+
+
+class MockGitLab:
+    """The state of the mock: the board, the merge requests, the rate limit and the call log.
+
+    Args:
+        latency (float, optional): The mean latency of a call in seconds.
+        jitter (float, optional): The maximum deviation from the mean latency in seconds.
+        rate_limit (int, optional): Calls allowed per rate limit window, unlimited if None.
+        rate_window (float, optional): The rate limit window in seconds.
+        milestones (List[Dict], optional): The milestones of every project.
+
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit: Optional[int] = None,
+        rate_window: float = 60.0,
+        milestones: Optional[List[Dict]] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.milestones = milestones or [{"id": 7, "iid": 1, "state": "active", "start_date": "2020-05-01"}]
+        self.board = InMemoryBoard({"milestones": self.milestones})
+        # project id => merge requests
+        self.merge_requests = {}
+        self.calls = []
+        self.rate_limited = 0
+        self.window_started_at = time.time()
+        self.window_calls = 0
+        self.lock = threading.Lock()
+
+    def add_merge_request(self, project_id: int, merge_request: Dict) -> None:
+        with self.lock:
+            self.merge_requests.setdefault(project_id, {})[merge_request["iid"]] = merge_request
+
+    def take_rate_limit(self) -> Tuple[bool, Dict[str, str]]:
+        """Count a call against the rate limit window.
+
+        Returns:
+            Tuple[bool, Dict[str, str]]: (allowed, RateLimit-* headers)
+
+        """
+        if self.rate_limit is None:
+            return True, {}
+        with self.lock:
+            now = time.time()
+            if now - self.window_started_at >= self.rate_window:
+                self.window_started_at = now
+                self.window_calls = 0
+            allowed = self.window_calls < self.rate_limit
+            if allowed:
+                self.window_calls += 1
+            else:
+                self.rate_limited += 1
+            headers = {
+                "RateLimit-Limit": str(self.rate_limit),
+                "RateLimit-Remaining": str(max(self.rate_limit - self.window_calls, 0)),
+                "RateLimit-Reset": str(int(self.window_started_at + self.rate_window))
+            }
+        return allowed, headers
+
+    def search_issues(self, query: Dict[str, str]) -> List[Dict]:
+        labels = query["labels"].split(",") if query.get("labels") else None
+        with self.lock:
+            issues, _ = self.board.search_issues(labels, query.get("search"))
+        if query.get("state"):
+            issues = [issue for issue in issues if issue["state"] == query["state"]]
+        if query.get("sort") == "asc":
+            issues.reverse()
+        issues = [self.issue_json(issue) for issue in issues]
+        if query.get("created_after"):
+            issues = [issue for issue in issues if issue["created_at"] >= query["created_after"]]
+        return paginate(issues, query)
+
+    def create_issue(self, query: Dict[str, str]) -> Dict:
+        arguments = {
+            "labels": query["labels"].split(",") if query.get("labels") else [],
+            "title": query.get("title", ""),
+            "description": query.get("description", ""),
+            "milestone_id": int(query["milestone_id"]) if query.get("milestone_id") else None
+        }
+        with self.lock:
+            issue, _ = self.board.apply_mutation(Mutation("create_project_issue", arguments, ""))
+        return self.issue_json(issue)
+
+    def update_issue(self, issue_iid: int, query: Dict[str, str]) -> Optional[Dict]:
+        arguments = {"issue_iid": issue_iid}
+        for key in ("labels", "add_labels", "remove_labels"):
+            if key in query:
+                arguments[key] = query[key].split(",") if query[key] else []
+        for key in ("description", "state_event"):
+            if key in query:
+                arguments[key] = query[key]
+        if query.get("milestone_id"):
+            arguments["milestone_id"] = int(query["milestone_id"])
+        with self.lock:
+            _, error = self.board.apply_mutation(Mutation("update_project_issue", arguments, ""))
+            if error is not None:
+                return None
+            return self.issue_json(self.board.issues[issue_iid])
+
+    def search_merge_requests(self, project_id: int, query: Dict[str, str]) -> List[Dict]:
+        with self.lock:
+            merge_requests = list(self.merge_requests.get(project_id, {}).values())
+        if query.get("state") and query["state"] != "all":
+            merge_requests = [mr for mr in merge_requests if mr.get("state") == query["state"]]
+        if query.get("updated_after"):
+            merge_requests = [mr for mr in merge_requests if mr.get("updated_at", "") >= query["updated_after"]]
+        if query.get("updated_before"):
+            merge_requests = [mr for mr in merge_requests if mr.get("updated_at", "") < query["updated_before"]]
+        order_by = query.get("order_by", "created_at")
+        merge_requests.sort(key=lambda mr: (mr.get(order_by) or "", mr["iid"]), reverse=query.get("sort", "desc") == "desc")
+        return paginate(merge_requests, query)
+
+    def issue_json(self, issue: Dict) -> Dict:
+        issue_json = dict(issue, labels=list(issue["labels"]))
+        milestone_id = issue_json.pop("milestone_id", None)
+        issue_json["milestone"] = {"id": milestone_id} if milestone_id is not None else None
+        # issues are created in iid order, a second apart
+        issue_json["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1577836800 + issue["iid"]))
+        return issue_json
+
+
+def paginate(items: List, query: Dict[str, str]) -> List:
+    page = int(query.get("page", 1))
+    per_page = min(int(query.get("per_page", gitlab_default_per_page)), 100)
+    return items[(page - 1) * per_page:page * per_page]
+
+
+def make_handler(gitlab: MockGitLab):
+
+    class MockGitLabHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.handle_call("GET")
+
+        def do_POST(self):
+            self.handle_call("POST")
+
+        def do_PUT(self):
+            self.handle_call("PUT")
+
+        def handle_call(self, method: str) -> None:
+            url = urlparse(self.path)
+            query = {key: values[-1] for (key, values) in parse_qs(url.query, keep_blank_values=True).items()}
+            if int(self.headers.get("Content-Length") or 0) > 0:
+                self.rfile.read(int(self.headers["Content-Length"]))
+            parts = [part for part in url.path.split("/") if part != ""]
+            # strip the /api/v4 prefix
+            while len(parts) != 0 and parts[0] != "projects":
+                parts.pop(0)
+            endpoint = "{} /{}".format(method, "/".join(":id" if part.isdigit() else part for part in parts))
+
+            started_at = time.time()
+            allowed, headers = gitlab.take_rate_limit()
+            with gitlab.lock:
+                gitlab.calls.append((started_at, endpoint))
+            if gitlab.latency > 0 or gitlab.jitter > 0:
+                time.sleep(max(0.0, gitlab.latency + random.uniform(-gitlab.jitter, gitlab.jitter)))
+            if not allowed:
+                return self.send_json(429, {"message": "429 Too Many Requests"}, headers)
+
+            status, body = self.route(method, parts, query)
+            self.send_json(status, body, headers)
+
+        def route(self, method: str, parts: List[str], query: Dict[str, str]) -> Tuple[int, object]:
+            if len(parts) < 3 or parts[0] != "projects" or not parts[1].isdigit():
+                return 404, {"message": "404 Not Found"}
+            project_id = int(parts[1])
+            resource = parts[2:]
+            if resource == ["issues"] and method == "GET":
+                return 200, gitlab.search_issues(query)
+            if resource == ["issues"] and method == "POST":
+                return 201, gitlab.create_issue(query)
+            if len(resource) == 2 and resource[0] == "issues" and method == "PUT":
+                issue = gitlab.update_issue(int(resource[1]), query)
+                return (200, issue) if issue is not None else (404, {"message": "404 Not found"})
+            if resource == ["milestones"] and method == "GET":
+                state = query.get("state")
+                return 200, paginate([milestone for milestone in gitlab.milestones
+                                              if state is None or milestone["state"] == state], query)
+            if resource == ["merge_requests"] and method == "GET":
+                return 200, gitlab.search_merge_requests(project_id, query)
+            if len(resource) == 2 and resource[0] == "merge_requests" and method == "GET":
+                merge_request = gitlab.merge_requests.get(project_id, {}).get(int(resource[1]))
+                return (200, merge_request) if merge_request is not None else (404, {"message": "404 Not found"})
+            return 404, {"message": "404 Not Found"}
+
+        def send_json(self, status: int, body: object, headers: Dict[str, str]) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for (key, value) in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return MockGitLabHandler
+
+
+class MockGitLabServer(ThreadingHTTPServer):
+    # a storm opens many connections at once, the default backlog of 5 would delay them by SYN retries
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start_mock_gitlab(gitlab: MockGitLab, port: int = 0) -> ThreadingHTTPServer:
+    """Serve the mock on a background thread.
+
+    Args:
+        gitlab (MockGitLab): The state of the mock.
+        port (int, optional): The port to listen on, any free port by default.
+
+    Returns:
+        ThreadingHTTPServer: server.server_port is the port listened on.
+
+    """
+    server = MockGitLabServer(("127.0.0.1", port), make_handler(gitlab))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,8 +1,12 @@
 import os
 from aws_cdk import (
     core,
+    aws_s3,
     aws_lambda,
-    aws_apigateway
+    aws_events,
+    aws_dynamodb,
+    aws_apigateway,
+    aws_events_targets
 )
 
 
@@ -11,6 +15,64 @@ class CDKStack(core.Stack):
     def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        # retry queue of failed issue updates
+        retry_queue_table = aws_dynamodb.Table(
+            self, "retry_queue",
+            partition_key=aws_dynamodb.Attribute(name="item_id", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+        retry_queue_table.add_global_secondary_index(
+            index_name="status-next_attempt_at",
+            partition_key=aws_dynamodb.Attribute(name="status", type=aws_dynamodb.AttributeType.STRING),
+            sort_key=aws_dynamodb.Attribute(name="next_attempt_at", type=aws_dynamodb.AttributeType.NUMBER)
+        )
+
+        # source branches of merge requests, never expire
+        mr_cache_table = aws_dynamodb.Table(
+            self, "mr_cache",
+            partition_key=aws_dynamodb.Attribute(name="mr_key", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # checkpoints of resumable jobs, and the current version of the board snapshot
+        checkpoint_table = aws_dynamodb.Table(
+            self, "checkpoint",
+            partition_key=aws_dynamodb.Attribute(name="name", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # leases serializing the creation of the issue of a branch, expired leases are removed by TTL
+        lock_table = aws_dynamodb.Table(
+            self, "lock",
+            partition_key=aws_dynamodb.Attribute(name="key", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at"
+        )
+
+        # materialized view of the board
+        board_snapshot_bucket = aws_s3.Bucket(self, "board_snapshot")
+
+        # sampled profiles of the lambda function, kept for 2 weeks
+        profile_bucket = aws_s3.Bucket(
+            self, "profiles",
+            lifecycle_rules=[aws_s3.LifecycleRule(expiration=core.Duration.days(14))]
+        )
+
+        environment = {
+            "SECRET_TOKEN": os.environ.get("SECRET_TOKEN"),
+            "ACCESS_TOKEN": os.environ.get("ACCESS_TOKEN"),
+            "PROJECT_A_PROJECT_ID": os.environ.get("PROJECT_A_PROJECT_ID"),
+            "PROJECT_B_PROJECT_ID": os.environ.get("PROJECT_B_PROJECT_ID"),
+            "RETRY_QUEUE_TABLE": retry_queue_table.table_name,
+            "MR_CACHE_TABLE": mr_cache_table.table_name,
+            "BOARD_SNAPSHOT_BUCKET": board_snapshot_bucket.bucket_name,
+            "CHECKPOINT_TABLE": checkpoint_table.table_name,
+            "LOCK_TABLE": lock_table.table_name,
+            "PROFILE_BUCKET": profile_bucket.bucket_name,
+            "PROFILE_SAMPLE_RATE": os.environ.get("PROFILE_SAMPLE_RATE", "0"),
+            "TRACING_EXPORTER": os.environ.get("TRACING_EXPORTER", "stdout")
+        }
+
         # lambda function
         issue_boards_maintainer = aws_lambda.Function(
             self, "issue_boards_maintainer",
@@ -20,12 +82,50 @@ class CDKStack(core.Stack):
             timeout=core.Duration.seconds(300),
             runtime=aws_lambda.Runtime.PYTHON_3_7,
             memory_size=1024,
-            environment={
-                "SECRET_TOKEN": os.environ.get("SECRET_TOKEN"),
-                "ACCESS_TOKEN": os.environ.get("ACCESS_TOKEN"),
-                "PROJECT_A_PROJECT_ID": os.environ.get("PROJECT_A_PROJECT_ID"),
-                "PROJECT_B_PROJECT_ID": os.environ.get("PROJECT_B_PROJECT_ID")
-            }
+            environment=environment
+        )
+        retry_queue_table.grant_read_write_data(issue_boards_maintainer)
+        mr_cache_table.grant_read_write_data(issue_boards_maintainer)
+        lock_table.grant_read_write_data(issue_boards_maintainer)
+        board_snapshot_bucket.grant_read_write(issue_boards_maintainer)
+        checkpoint_table.grant_read_write_data(issue_boards_maintainer)
+        profile_bucket.grant_write(issue_boards_maintainer)
+
+        # batches of webhook events, invoked directly with {"events": [...]}
+        issue_boards_batch = aws_lambda.Function(
+            self, "issue_boards_batch",
+            function_name="issue_boards_batch",
+            code=aws_lambda.Code.asset("../functions/issue_boards_maintainer"),
+            handler="webhook_batch.process_webhook_batch",
+            timeout=core.Duration.seconds(300),
+            runtime=aws_lambda.Runtime.PYTHON_3_7,
+            memory_size=1024,
+            environment=environment
+        )
+        retry_queue_table.grant_read_write_data(issue_boards_batch)
+        mr_cache_table.grant_read_write_data(issue_boards_batch)
+        lock_table.grant_read_write_data(issue_boards_batch)
+        board_snapshot_bucket.grant_read_write(issue_boards_batch)
+        checkpoint_table.grant_read_write_data(issue_boards_batch)
+
+        # replay the retry queue every 5 minutes
+        retry_drainer = aws_lambda.Function(
+            self, "retry_drainer",
+            function_name="issue_boards_retry_drainer",
+            code=aws_lambda.Code.asset("../functions/issue_boards_maintainer"),
+            handler="retry_drainer.drain_retry_queue",
+            timeout=core.Duration.seconds(300),
+            runtime=aws_lambda.Runtime.PYTHON_3_7,
+            memory_size=256,
+            environment=environment
+        )
+        retry_queue_table.grant_read_write_data(retry_drainer)
+        mr_cache_table.grant_read_write_data(retry_drainer)
+        lock_table.grant_read_write_data(retry_drainer)
+        aws_events.Rule(
+            self, "retry_drainer_schedule",
+            schedule=aws_events.Schedule.rate(core.Duration.minutes(5)),
+            targets=[aws_events_targets.LambdaFunction(retry_drainer)]
         )
 
         # api gateway
@@ -36,3 +136,57 @@ class CDKStack(core.Stack):
         resource_entity = rest_api.root.add_resource('webhook')
         lambda_integration_entity = aws_apigateway.LambdaIntegration(issue_boards_maintainer, proxy=True)
         resource_entity.add_method('POST', lambda_integration_entity)
+
+        # check the board snapshot against GitLab every hour
+        board_snapshot_reconciler = aws_lambda.Function(
+            self, "board_snapshot_reconciler",
+            function_name="issue_boards_snapshot_reconciler",
+            code=aws_lambda.Code.asset("../functions/issue_boards_maintainer"),
+            handler="board_snapshot.reconcile_board_snapshot",
+            timeout=core.Duration.seconds(300),
+            runtime=aws_lambda.Runtime.PYTHON_3_7,
+            memory_size=512,
+            environment=environment
+        )
+        board_snapshot_bucket.grant_read_write(board_snapshot_reconciler)
+        checkpoint_table.grant_read_write_data(board_snapshot_reconciler)
+        aws_events.Rule(
+            self, "board_snapshot_reconciler_schedule",
+            schedule=aws_events.Schedule.rate(core.Duration.hours(1)),
+            targets=[aws_events_targets.LambdaFunction(board_snapshot_reconciler)]
+        )
+
+        # move open issues to the new sprint every hour
+        sprint_rollover = aws_lambda.Function(
+            self, "sprint_rollover",
+            function_name="issue_boards_sprint_rollover",
+            code=aws_lambda.Code.asset("../functions/issue_boards_maintainer"),
+            handler="sprint_rollover.sprint_rollover",
+            timeout=core.Duration.seconds(900),
+            runtime=aws_lambda.Runtime.PYTHON_3_7,
+            memory_size=256,
+            environment=environment
+        )
+        checkpoint_table.grant_read_write_data(sprint_rollover)
+        retry_queue_table.grant_read_write_data(sprint_rollover)
+        aws_events.Rule(
+            self, "sprint_rollover_schedule",
+            schedule=aws_events.Schedule.rate(core.Duration.hours(1)),
+            targets=[aws_events_targets.LambdaFunction(sprint_rollover)]
+        )
+
+        # rebuild the board from the merge request history, invoked on demand
+        backfill = aws_lambda.Function(
+            self, "backfill",
+            function_name="issue_boards_backfill",
+            code=aws_lambda.Code.asset("../functions/issue_boards_maintainer"),
+            handler="backfill.backfill",
+            timeout=core.Duration.seconds(900),
+            runtime=aws_lambda.Runtime.PYTHON_3_7,
+            memory_size=512,
+            environment=environment
+        )
+        checkpoint_table.grant_read_write_data(backfill)
+        retry_queue_table.grant_read_write_data(backfill)
+        mr_cache_table.grant_read_write_data(backfill)
+        lock_table.grant_read_write_data(backfill)
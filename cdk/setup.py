@@ -20,8 +20,12 @@ setuptools.setup(
 
     install_requires=[
         "aws-cdk.core",
+        "aws-cdk.aws-s3",
         "aws-cdk.aws-lambda",
-        "aws-cdk.aws-apigateway"
+        "aws-cdk.aws-events",
+        "aws-cdk.aws-dynamodb",
+        "aws-cdk.aws-apigateway",
+        "aws-cdk.aws-events-targets"
     ],
 
     python_requires=">=3.6",
@@ -0,0 +1,431 @@
+"""Rebuild the board from the merge request history of the projects.
+
+Runs as a lambda function, eg. when a project is onboarded or after a webhook outage, or locally:
+    python backfill.py [--since 2020-01-01T00:00:00Z] [--until 2020-07-01T00:00:00Z] [--shards 8]
+                       [--project-id 15] [--dry-run]
+"""
+import os
+import bisect
+import argparse
+from datetime import (
+    datetime,
+    timezone
+)
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    wait
+)
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple,
+    Optional
+)
+
+from gitlab_apis import search_project_merge_requests
+from gitlab_enum import (
+    MRAction,
+    Project,
+    GitlabEvent
+)
+from gitlab_lib import (
+    is_dev_branch,
+    is_master_branch,
+    is_staging_branch,
+    error_response_body,
+    response_message_body
+)
+from issue_board import (
+    GitLabBoard,
+    InMemoryBoard
+)
+from issue_lock import (
+    LockTimeoutError,
+    issue_lock
+)
+from issue_planner import (
+    Mutation,
+    run_plan,
+    plan_event,
+    branch_regex,
+    issue_creation_keys
+)
+from metrics import put_metric
+from rate_limiter import TokenBucket
+from retry_queue import park_failed_call
+from checkpoint_store import get_checkpoint_store
+
+backfill_shards = int(os.environ.get("BACKFILL_SHARDS", "8"))
+backfill_concurrency = int(os.environ.get("BACKFILL_CONCURRENCY", "4"))
+backfill_rate = float(os.environ.get("BACKFILL_RATE", "10"))
+backfill_per_page = int(os.environ.get("BACKFILL_PER_PAGE", "100"))
+backfill_reserved_millis = int(os.environ.get("BACKFILL_RESERVED_MILLIS", "60000"))
+backfill_since = os.environ.get("BACKFILL_SINCE", "2014-01-01T00:00:00Z")
+
+# merge request state => (webhook action, time of the action) replayed for it, in order
+replayed_actions = {
+    "merged": [(MRAction.OPEN.value, "created_at"), (MRAction.MERGE.value, "merged_at")],
+    "closed": [(MRAction.OPEN.value, "created_at"), (MRAction.CLOSE.value, "closed_at")]
+}
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def format_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def time_shards(since: str, until: str, shard_count: int) -> List[Tuple[str, str]]:
+    """Split [since, until) into consecutive time ranges of equal length.
+
+    Returns:
+        List[Tuple[str, str]]: [(updated after, updated before)]
+
+    """
+    start, end = parse_time(since), parse_time(until)
+    step = (end - start) / shard_count
+    bounds = [format_time(start + step * index) for index in range(shard_count)] + [format_time(end)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def fetch_shard(
+    project_id: int,
+    shard: Tuple[str, str],
+    rate_limiter: TokenBucket
+) -> Tuple[List[Dict], Optional[Exception]]:
+    """Page through the merge requests of a project last updated in a time range, oldest update first.
+
+    A merge request updated while it is paged moves past the end of the range, so it is not
+    replayed twice and the next incremental run picks it up.
+
+    Args:
+        project_id (int): The ID of the project.
+        shard (Tuple[str, str]): (updated after, updated before)
+        rate_limiter (TokenBucket): The rate limit of GitLab calls.
+
+    Returns:
+        Tuple[List[Dict], Exception]: (merge requests, Exception)
+
+    """
+    updated_after, updated_before = shard
+    start, end = parse_time(updated_after), parse_time(updated_before)
+    merge_requests = []
+    page = 1
+    while True:
+        rate_limiter.acquire()
+        results, error = search_project_merge_requests(project_id,
+                                                       state="all",
+                                                       updated_after=updated_after,
+                                                       updated_before=updated_before,
+                                                       order_by="updated_at",
+                                                       sort="asc",
+                                                       page=page,
+                                                       per_page=backfill_per_page)
+        if error is not None:
+            return merge_requests, error
+        put_metric("BackfillPages", 1)
+        # both bounds are inclusive in GitLab, keep each merge request in one shard
+        merge_requests.extend(mr for mr in results
+                              if mr.get("updated_at") and start <= parse_time(mr["updated_at"]) < end)
+        if len(results) < backfill_per_page:
+            return merge_requests, None
+        page += 1
+
+
+def webhook_bodies(
+    project_id: int,
+    merge_requests: List[Dict],
+    since: datetime
+) -> List[Tuple[Tuple, Dict]]:
+    """Build the merge request webhook bodies of merged and closed merge requests, in chronological order.
+
+    A merge request updated since may have been opened or merged before, only its actions from
+    since on are replayed, the earlier ones were replayed by the run covering them.
+
+    Args:
+        project_id (int): The ID of the project.
+        merge_requests (List[Dict]): The merge requests from the merge requests API.
+        since (datetime): The start of the replayed history.
+
+    Returns:
+        List[Tuple[Tuple, Dict]]: (sort key starting with the time of the action, webhook body)
+
+    """
+    bodies = []
+    for mr in merge_requests:
+        for (order, (action, time_key)) in enumerate(replayed_actions.get(mr.get("state"), [])):
+            occurred_at = parse_time(mr.get(time_key) or mr.get("updated_at"))
+            if occurred_at < since:
+                continue
+            bodies.append(((occurred_at, project_id, mr.get("iid"), order), {
+                "project": {"id": project_id},
+                "object_attributes": {
+                    "iid": mr.get("iid"),
+                    "action": action,
+                    "source_branch": mr.get("source_branch"),
+                    "target_branch": mr.get("target_branch"),
+                    "description": mr.get("description") or "",
+                    "url": mr.get("web_url")
+                }
+            }))
+    return bodies
+
+
+def replay_key(body_json: Dict) -> Optional[str]:
+    """Return the key the events of a feature branch are replayed in order under.
+
+    Returns:
+        str: None for events reading or changing the issues of other branches, eg. promotions,
+            cherry-picks and merges to topic branches, which are replayed alone.
+
+    """
+    mr_attribute = body_json.get("object_attributes", {})
+    source_branch = mr_attribute.get("source_branch") or ""
+    target_branch = mr_attribute.get("target_branch") or ""
+    if (mr_attribute.get("action") == MRAction.MERGE.value and not is_dev_branch(target_branch)
+            and not is_staging_branch(target_branch) and not is_master_branch(target_branch)):
+        return None
+    if branch_regex.match(source_branch) is None:
+        return None
+    return "{}:{}".format(body_json.get("project", {}).get("id"), source_branch)
+
+
+def park_mutation(
+    mutation: Mutation,
+    error: Exception
+) -> Tuple[Optional[str], Optional[Exception]]:
+    return park_failed_call(mutation.operation, mutation.arguments, error)
+
+
+def replay_event(
+    body_json: Dict,
+    board,
+    rate_limiter: TokenBucket,
+    previous: Optional[Future] = None
+) -> Optional[str]:
+    """Plan a merge request event and apply its mutations.
+
+    Args:
+        body_json (Dict): The webhook body.
+        board (GitLabBoard or InMemoryBoard): The board to read and mutate.
+        rate_limiter (TokenBucket): The rate limit of replayed events.
+        previous (Future, optional): The replay of the previous event of the branch, waited for first.
+
+    Returns:
+        str: The error if the event failed, None otherwise.
+
+    """
+    if previous is not None:
+        previous.result()
+    rate_limiter.acquire()
+    gitlab_event = GitlabEvent.MERGE_REQUEST_HOOK.value
+    lock_keys = issue_creation_keys(gitlab_event, body_json) if isinstance(board, GitLabBoard) else []
+    with issue_lock(lock_keys) as locked:
+        if not locked:
+            return str(LockTimeoutError(lock_keys))
+        response, _ = run_plan(plan_event(gitlab_event, body_json, board),
+                               board.apply_mutation,
+                               park_mutation if isinstance(board, GitLabBoard) else None)
+    if response.get("statusCode") >= 500:
+        return response.get("body")
+    return None
+
+
+def replay_events(
+    bodies: List[Dict],
+    start_index: int,
+    board,
+    executor: ThreadPoolExecutor,
+    rate_limiter: TokenBucket,
+    out_of_time: Callable[[], bool]
+) -> Tuple[int, List[str]]:
+    """Replay events in chronological order, concurrently across feature branches.
+
+    The events of a feature branch are replayed one after another, and an event without a
+    replay key waits for every event before it and runs alone.
+
+    Args:
+        bodies (List[Dict]): The webhook bodies, in chronological order.
+        start_index (int): The first event to replay.
+        board (GitLabBoard or InMemoryBoard): The board to read and mutate.
+        executor (ThreadPoolExecutor): The workers replaying events.
+        rate_limiter (TokenBucket): The rate limit of replayed events.
+        out_of_time (Callable): Return True to stop before the next event.
+
+    Returns:
+        Tuple[int, List[str]]: (index of the first event not replayed, errors)
+
+    """
+    errors = []
+    futures = []
+    # replay key => the replay of the last event of the key
+    last_futures = {}
+    index = start_index
+    while index < len(bodies) and not out_of_time():
+        body_json = bodies[index]
+        key = replay_key(body_json)
+        if key is None:
+            wait(futures)
+            last_futures = {}
+            errors.append(replay_event(body_json, board, rate_limiter))
+        else:
+            future = executor.submit(replay_event, body_json, board, rate_limiter, last_futures.get(key))
+            last_futures[key] = future
+            futures.append(future)
+        index += 1
+
+    wait(futures)
+    errors.extend(future.result() for future in futures)
+    return index, [error for error in errors if error is not None]
+
+
+def event_key_to_json(key: Tuple) -> List:
+    (occurred_at, project_id, mr_iid, order) = key
+    return [occurred_at.isoformat(), project_id, mr_iid, order]
+
+
+def event_key_from_json(value: List) -> Tuple:
+    (occurred_at, project_id, mr_iid, order) = value
+    return parse_time(occurred_at), project_id, mr_iid, order
+
+
+def backfill(event, context):
+    """Replay the merged and closed merge requests of the projects through the rules of the webhook.
+
+    The history from since to until is split into time shards of merge request updates, fetched
+    in parallel, and the events of all shards are replayed in the chronological order of their
+    actions. The checkpoint records the sort key of the last replayed event, so an invocation that
+    is about to time out resumes after it on the next run, even if merge requests moved between
+    shards meanwhile. Once done it records until, which a later run without since continues from.
+    {"dry_run": true} replays against an empty in-memory board instead.
+
+    Event:
+        project_ids (List[int], optional): The projects to backfill, PROJECT_A and PROJECT_B by default.
+        since (str, optional): ISO 8601 time, the until of the last finished run by default.
+        until (str, optional): ISO 8601 time, now by default.
+        shards (int, optional): The number of time shards, BACKFILL_SHARDS by default.
+        dry_run (bool, optional): Do not call the issues API, and do not checkpoint.
+
+    """
+    event = event or {}
+    dry_run = event.get("dry_run", False)
+    project_ids = sorted(event.get("project_ids") or Project.value_list())
+
+    store = get_checkpoint_store()
+    checkpoint_name = "backfill:{}".format(",".join(str(project_id) for project_id in project_ids))
+    checkpoint = None if dry_run else store.get(checkpoint_name)
+    if checkpoint is None or checkpoint["done"]:
+        since = event.get("since") or (checkpoint["until"] if checkpoint is not None else backfill_since)
+        checkpoint = {
+            "since": since,
+            "until": event.get("until") or format_time(datetime.now(timezone.utc)),
+            "shard_count": event.get("shards") or backfill_shards,
+            # sort key of the last replayed event
+            "after": None,
+            "replayed": 0,
+            "errors": [],
+            "done": False
+        }
+    shards = time_shards(checkpoint["since"], checkpoint["until"], checkpoint["shard_count"])
+
+    def out_of_time() -> bool:
+        return context is not None and context.get_remaining_time_in_millis() < backfill_reserved_millis
+
+    board = InMemoryBoard() if dry_run else GitLabBoard()
+    rate_limiter = TokenBucket(backfill_rate)
+    # the in-memory board is not thread safe
+    replayer = ThreadPoolExecutor(max_workers=1 if dry_run else backfill_concurrency)
+    with ThreadPoolExecutor(max_workers=backfill_concurrency) as fetcher:
+        shard_futures = [(project_id, fetcher.submit(fetch_shard, project_id, shard, rate_limiter))
+                         for shard in shards for project_id in project_ids]
+        events = []
+        for (project_id, future) in shard_futures:
+            merge_requests, error = future.result()
+            if error is not None:
+                for (_, pending) in shard_futures:
+                    pending.cancel()
+                replayer.shutdown()
+                if not dry_run:
+                    store.put(checkpoint_name, checkpoint)
+                return error_response_body("Search MR Error", error)
+            put_metric("BackfillMergeRequests", len(merge_requests))
+            # cherry-picks of the history look up the source branch of the original MR
+            for mr in merge_requests:
+                error = board.remember_merge_request(project_id, mr.get("iid"), mr.get("source_branch"))
+                if error is not None:
+                    print(error)
+            events.extend(webhook_bodies(project_id, merge_requests, parse_time(checkpoint["since"])))
+
+    # an MR merged early and updated late is in a late shard, only a global sort keeps the history in order
+    events.sort(key=lambda item: item[0])
+    start_index = 0
+    if checkpoint["after"] is not None:
+        after = event_key_from_json(checkpoint["after"])
+        start_index = bisect.bisect_right([key for (key, _) in events], after)
+    bodies = [body_json for (_, body_json) in events]
+
+    try:
+        next_index, errors = replay_events(bodies, start_index, board, replayer, rate_limiter, out_of_time)
+    finally:
+        replayer.shutdown()
+    put_metric("BackfillEvents", next_index - start_index)
+    checkpoint["replayed"] += next_index - start_index
+    checkpoint["errors"].extend(errors)
+    if next_index > start_index:
+        checkpoint["after"] = event_key_to_json(events[next_index - 1][0])
+    if next_index < len(bodies):
+        if not dry_run:
+            store.put(checkpoint_name, checkpoint)
+        return response_message_body(202, {
+            "message": "Backfill Paused",
+            "checkpoint": checkpoint
+        })
+
+    if dry_run:
+        return response_message_body(200, {
+            "message": "Backfill Dry Run",
+            "since": checkpoint["since"],
+            "until": checkpoint["until"],
+            "replayed": checkpoint["replayed"],
+            "issues": len(board.issues),
+            "errors": checkpoint["errors"]
+        })
+
+    checkpoint["done"] = True
+    store.put(checkpoint_name, checkpoint)
+    if len(checkpoint["errors"]) > 0:
+        return response_message_body(500, {
+            "message": "Backfill Error",
+            "error": str(checkpoint["errors"])
+        })
+    return response_message_body(200, {
+        "message": "Backfill Successfully",
+        "since": checkpoint["since"],
+        "until": checkpoint["until"],
+        "replayed": checkpoint["replayed"]
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the board from the merge request history of the projects.")
+    parser.add_argument("--since", help="ISO 8601 time, the end of the last finished run by default")
+    parser.add_argument("--until", help="ISO 8601 time, now by default")
+    parser.add_argument("--shards", type=int)
+    parser.add_argument("--project-id", type=int, action="append", dest="project_ids")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    print(backfill({
+        "since": args.since,
+        "until": args.until,
+        "shards": args.shards,
+        "project_ids": args.project_ids,
+        "dry_run": args.dry_run
+    }, None).get("body"))
+
+
+if __name__ == "__main__":
+    main()
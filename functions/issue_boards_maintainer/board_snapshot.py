@@ -0,0 +1,438 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import random
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Optional
+)
+
+from gitlab_apis import search_project_issues
+from gitlab_enum import Project
+from gitlab_lib import response_message_body
+from issue_board import (
+    InMemoryBoard,
+    search_active_milestones
+)
+from metrics import put_metric
+from budget_planner import (
+    CallBudget,
+    BudgetExhaustedError
+)
+
+# shorter than the hourly reconciliation, so reads go to GitLab when a reconciliation is missed
+board_snapshot_max_age = float(os.environ.get("BOARD_SNAPSHOT_MAX_AGE", "3000"))
+board_snapshot_write_attempts = int(os.environ.get("BOARD_SNAPSHOT_WRITE_ATTEMPTS", "5"))
+board_snapshot_key = os.environ.get("BOARD_SNAPSHOT_KEY", "board_snapshot.json.gz")
+reconcile_per_page = 100
+
+# write version replacing the snapshot whatever its current version
+any_snapshot_version = "*"
+
+# issue record of the compact format, in order
+snapshot_issue_fields = ("iid", "title", "description", "labels", "state", "milestone_id", "web_url")
+
+
+def encode_snapshot(board: InMemoryBoard, reconciled_at: float) -> bytes:
+    """Encode a board in the compact snapshot format: gzipped JSON with issues as arrays.
+
+    Args:
+        board (InMemoryBoard): The board.
+        reconciled_at (float): The time the board was last checked against GitLab.
+
+    Returns:
+        bytes
+
+    """
+    snapshot = {
+        "version": 1,
+        "reconciled_at": reconciled_at,
+        "web_url": board.web_url,
+        "milestones": board.milestones,
+        "issues": [[issue.get(field) for field in snapshot_issue_fields]
+                   for issue in board.to_snapshot()["issues"]]
+    }
+    return gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_snapshot(data: bytes) -> Tuple[InMemoryBoard, float]:
+    """Decode a board from the compact snapshot format.
+
+    Args:
+        data (bytes): The encoded snapshot.
+
+    Returns:
+        Tuple[InMemoryBoard, float]: (board, reconciled_at)
+
+    """
+    snapshot = json.loads(gzip.decompress(data).decode("utf-8"))
+    board = InMemoryBoard({
+        "web_url": snapshot.get("web_url"),
+        "milestones": snapshot.get("milestones", []),
+        "issues": [dict(zip(snapshot_issue_fields, record)) for record in snapshot.get("issues", [])]
+    })
+    return board, snapshot.get("reconciled_at", 0)
+
+
+class LocalSnapshotStore:
+    """Board snapshot stored in a local file, used for tests and local runs.
+
+    Each write records a new version in a file next to the snapshot, under a file lock.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version_path = path + ".version"
+
+    def read(self, version: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """Return (data, version), data is None if the snapshot is unchanged since version or absent."""
+        # the version is read before the data, so a write in between is seen as a conflict on the next write
+        current_version = self._version()
+        if current_version is None:
+            return None, None
+        if current_version == version:
+            return None, version
+        with open(self.path, "rb") as fp:
+            return fp.read(), current_version
+
+    def write(self, data: bytes, version: Optional[str]) -> Optional[str]:
+        """Replace the snapshot if it is still at version, None if another writer replaced it first."""
+        import fcntl
+
+        with open(self.path + ".lock", "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            if version != any_snapshot_version and self._version() != version:
+                return None
+            new_version = uuid.uuid4().hex
+            self._replace(self.path, data)
+            self._replace(self.version_path, new_version.encode("utf-8"))
+            return new_version
+
+    def _version(self) -> Optional[str]:
+        try:
+            with open(self.version_path, "r") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _replace(path: str, data: bytes) -> None:
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(temp_path, path)
+
+
+class S3SnapshotStore:
+    """Board snapshot stored as immutable S3 objects, the current one named by a DynamoDB record.
+
+    A write uploads a new object and swaps the record with a conditional put on the version it
+    was based on, so concurrent writers never overwrite each other. The object replaced is deleted.
+
+    """
+
+    def __init__(self, bucket: str, key: str, table_name: str):
+        import boto3
+
+        self.client = boto3.client("s3")
+        self.table = boto3.resource("dynamodb").Table(table_name)
+        self.bucket = bucket
+        self.key = key
+        self.record_name = "board_snapshot:{}".format(key)
+
+    def read(self, version: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """Return (data, version), data is None if the snapshot is unchanged since version or absent."""
+        from botocore.exceptions import ClientError
+
+        # the object of a version read just before it was replaced may be gone, read the new one
+        for _ in range(board_snapshot_write_attempts):
+            record = self.table.get_item(Key={"name": self.record_name}, ConsistentRead=True).get("Item")
+            if record is None:
+                return None, None
+            current_version = record["version"]
+            if current_version == version:
+                return None, version
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=current_version)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    continue
+                raise
+            return response["Body"].read(), current_version
+        return None, None
+
+    def write(self, data: bytes, version: Optional[str]) -> Optional[str]:
+        """Replace the snapshot if it is still at version, None if another writer replaced it first."""
+        from botocore.exceptions import ClientError
+
+        object_key = "{}/{}".format(uuid.uuid4().hex, self.key)
+        self.client.put_object(Bucket=self.bucket, Key=object_key, Body=data)
+        params = {
+            "Item": {
+                "name": self.record_name,
+                "version": object_key
+            }
+        }
+        if version is None:
+            params["ConditionExpression"] = "attribute_not_exists(#name)"
+            params["ExpressionAttributeNames"] = {"#name": "name"}
+        elif version != any_snapshot_version:
+            params["ConditionExpression"] = "#version = :version"
+            params["ExpressionAttributeNames"] = {"#version": "version"}
+            params["ExpressionAttributeValues"] = {":version": version}
+        try:
+            previous = self.table.put_item(ReturnValues="ALL_OLD", **params).get("Attributes")
+        except ClientError as e:
+            self.client.delete_object(Bucket=self.bucket, Key=object_key)
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return None
+            raise
+        if previous is not None:
+            self.client.delete_object(Bucket=self.bucket, Key=previous["version"])
+        return object_key
+
+
+class SnapshotConflictError(Exception):
+    def __init__(self):
+        super().__init__("Board Snapshot Write Conflict")
+
+
+class BoardSnapshot:
+    """Materialized view of the board, kept in a store and updated incrementally.
+
+    Issues read from and written to GitLab are journaled. save() rereads the latest snapshot,
+    replays the journal on top of it and writes it back only if no other invocation saved in
+    between, rereading and replaying again when one did. The scheduled reconciliation corrects
+    changes made in GitLab directly.
+
+    Args:
+        store (LocalSnapshotStore or S3SnapshotStore): Where the snapshot is kept.
+
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.board = InMemoryBoard()
+        self.reconciled_at = 0.0
+        self.version = None
+        self.journal = []
+
+    def refresh(self) -> Optional[Exception]:
+        """Load the latest snapshot if it changed since the last load.
+
+        Returns:
+            Exception: None if no error exists.
+
+        """
+        try:
+            data, version = self.store.read(self.version)
+        except Exception as e:
+            return e
+        if data is not None:
+            self.board, self.reconciled_at = decode_snapshot(data)
+            for (kind, change, result) in self.journal:
+                self._apply(kind, change, result)
+        self.version = version
+        return None
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.reconciled_at < board_snapshot_max_age
+
+    def observe_issues(self, issues: List[Dict]) -> None:
+        for issue in issues:
+            self._record("issue", issue, None)
+
+    def observe_mutation(self, mutation, result: Optional[Dict]) -> None:
+        self._record("mutation", mutation, result)
+
+    def save(self) -> Optional[Exception]:
+        """Write the journaled changes on top of the latest snapshot.
+
+        Returns:
+            Exception: None if no error exists.
+
+        """
+        if len(self.journal) == 0:
+            return None
+        for attempt in range(board_snapshot_write_attempts):
+            if attempt > 0:
+                # spread out the writers that keep conflicting
+                time.sleep(random.uniform(0, 0.05 * attempt))
+            error = self.refresh()
+            if error is not None:
+                return error
+            try:
+                version = self.store.write(encode_snapshot(self.board, self.reconciled_at), self.version)
+            except Exception as e:
+                return e
+            if version is not None:
+                self.version = version
+                self.journal = []
+                return None
+            put_metric("BoardSnapshotWriteConflict", 1)
+        return SnapshotConflictError()
+
+    def _record(self, kind: str, change, result: Optional[Dict]) -> None:
+        self.journal.append((kind, change, result))
+        self._apply(kind, change, result)
+
+    def _apply(self, kind: str, change, result: Optional[Dict]) -> None:
+        if kind == "issue":
+            self.board.observe_issue(change)
+        elif change.operation == "create_project_issue":
+            if result is not None:
+                self.board.observe_issue(result)
+        else:
+            # issues the snapshot does not hold yet are picked up by the reconciliation
+            self.board.apply_mutation(change)
+
+
+def get_board_snapshot_store():
+    """Return the snapshot store of the environment, None if the board snapshot is disabled.
+
+    BOARD_SNAPSHOT_BUCKET selects the S3 bucket, with the current version recorded in
+    CHECKPOINT_TABLE, otherwise BOARD_SNAPSHOT_PATH a local file.
+
+    Returns:
+        LocalSnapshotStore or S3SnapshotStore
+
+    """
+    bucket = os.environ.get("BOARD_SNAPSHOT_BUCKET")
+    if bucket:
+        return S3SnapshotStore(bucket, board_snapshot_key, os.environ.get("CHECKPOINT_TABLE"))
+    path = os.environ.get("BOARD_SNAPSHOT_PATH")
+    if path:
+        return LocalSnapshotStore(path)
+    return None
+
+
+def fetch_board(
+    per_page: int = 100,
+    budget: Optional[CallBudget] = None
+) -> Tuple[Optional[InMemoryBoard], Optional[Exception]]:
+    """Read the whole board of PROJECT_A from GitLab.
+
+    Args:
+        per_page (int, optional): The number of issues per page.
+        budget (CallBudget, optional): Stop with BudgetExhaustedError when the next page does not fit.
+
+    Returns:
+        Tuple[InMemoryBoard, Exception]: (board, Exception)
+
+    """
+    milestones, error = search_active_milestones()
+    if error is not None:
+        return None, error
+
+    board = InMemoryBoard({
+        "milestones": [{"id": milestone.get("id"), "state": milestone.get("state", "active"),
+                        "start_date": milestone.get("start_date")}
+                       for milestone in milestones]
+    })
+    page = 1
+    while True:
+        if budget is not None and not budget.fits(1):
+            return None, BudgetExhaustedError()
+        issues, error = search_project_issues(Project.PROJECT_A.value, page=page, per_page=per_page)
+        if error is not None:
+            return None, error
+        for issue in issues:
+            board.observe_issue(issue)
+            if issue.get("web_url"):
+                board.web_url = issue["web_url"].rsplit("/-/issues/", 1)[0]
+        if len(issues) < per_page:
+            return board, None
+        page += 1
+
+
+def merge_saved_issues(
+    board: InMemoryBoard,
+    base_board: Optional[InMemoryBoard],
+    saved_board: InMemoryBoard
+) -> None:
+    """Keep on the board the issues saved since the base snapshot, the others stay as fetched.
+
+    Args:
+        board (InMemoryBoard): The board fetched from GitLab.
+        base_board (InMemoryBoard, optional): The snapshot read before the fetch, None if absent.
+        saved_board (InMemoryBoard): The snapshot saved since.
+
+    """
+    base_issues = base_board.issues if base_board is not None else {}
+    for iid, issue in saved_board.issues.items():
+        if base_issues.get(iid) != issue:
+            board.observe_issue(issue)
+
+
+def reconcile_board_snapshot(event, context):
+    """Check the board snapshot against GitLab and replace it. Triggered by a schedule.
+
+    The reconciliation is skipped until the next schedule when its estimated calls do not fit
+    in the rest of the rate limit window or of the invocation, keeping the current snapshot.
+
+    """
+    store = get_board_snapshot_store()
+    if store is None:
+        return response_message_body(200, {
+            "message": "Board Snapshot Disabled"
+        })
+
+    # the version read before the fetch, saves landing during the fetch are merged before writing
+    data, version = store.read()
+    previous_board = decode_snapshot(data)[0] if data is not None else None
+
+    # one call for the milestones and one per page of issues, at the size of the last snapshot
+    budget = CallBudget(context)
+    if previous_board is not None:
+        estimated_calls = 2 + len(previous_board.issues) // reconcile_per_page
+        if not budget.fits(estimated_calls):
+            put_metric("BoardSnapshotReconcileDeferred", 1)
+            return response_message_body(202, {
+                "message": "Reconcile Board Snapshot Deferred",
+                "estimated_calls": estimated_calls
+            })
+
+    board, error = fetch_board(reconcile_per_page, budget)
+    if isinstance(error, BudgetExhaustedError):
+        put_metric("BoardSnapshotReconcileDeferred", 1)
+        return response_message_body(202, {
+            "message": "Reconcile Board Snapshot Deferred"
+        })
+    if error is not None:
+        return response_message_body(500, {
+            "message": "Fetch Board Error",
+            "error": str(error)
+        })
+
+    drift = 0
+    if previous_board is not None:
+        for iid in set(board.issues) | set(previous_board.issues):
+            if board.issues.get(iid) != previous_board.issues.get(iid):
+                drift += 1
+    put_metric("BoardSnapshotDrift", drift)
+
+    reconciled_at = time.time()
+    for attempt in range(board_snapshot_write_attempts):
+        if store.write(encode_snapshot(board, reconciled_at), version) is not None:
+            break
+        put_metric("BoardSnapshotWriteConflict", 1)
+        # an invocation saved during the fetch, its issues may be newer than the pages fetched
+        data, version = store.read()
+        latest_board = decode_snapshot(data)[0]
+        merge_saved_issues(board, previous_board, latest_board)
+        previous_board = latest_board
+    else:
+        return response_message_body(500, {
+            "message": "Save Board Snapshot Error",
+            "error": str(SnapshotConflictError())
+        })
+    return response_message_body(200, {
+        "message": "Reconcile Board Snapshot Successfully",
+        "issues": len(board.issues),
+        "drift": drift
+    })
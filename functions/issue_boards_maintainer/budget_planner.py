@@ -0,0 +1,87 @@
+import os
+from typing import (
+    List,
+    Optional
+)
+
+from rate_limiter import gitlab_rate_limit
+
+# estimated duration of a GitLab call
+budget_call_millis = float(os.environ.get("BUDGET_CALL_MILLIS", "500"))
+# time kept to finish the invocation after the last call
+budget_reserved_millis = int(os.environ.get("BUDGET_RESERVED_MILLIS", "10000"))
+# fraction of the rate limit kept for webhook events
+budget_reserved_ratio = float(os.environ.get("BUDGET_RESERVED_RATIO", "0.05"))
+
+
+class BudgetExhaustedError(Exception):
+    def __init__(self):
+        super().__init__("GitLab Call Budget Exhausted")
+
+
+class CallBudget:
+    """The GitLab calls an invocation can still make.
+
+    The calls are bounded by the rest of the GitLab rate limit window, less a reserve for
+    webhook events, and by the time left in the lambda invocation at the estimated call duration.
+
+    Args:
+        context (optional): The lambda context, the time left is not bounded if None.
+        call_millis (float, optional): The estimated duration of a GitLab call.
+        reserved_millis (int, optional): The time kept to finish the invocation.
+        reserved_ratio (float, optional): The fraction of the rate limit not to spend.
+
+    """
+
+    def __init__(
+        self,
+        context=None,
+        call_millis: float = budget_call_millis,
+        reserved_millis: int = budget_reserved_millis,
+        reserved_ratio: float = budget_reserved_ratio
+    ):
+        self.context = context
+        self.call_millis = call_millis
+        self.reserved_millis = reserved_millis
+        self.reserved_ratio = reserved_ratio
+
+    def calls_left(self) -> Optional[int]:
+        """Return the calls that fit in the budget now, None if unbounded.
+
+        Returns:
+            int
+
+        """
+        limits = []
+        rate_limit_calls = gitlab_rate_limit.calls_left(self.reserved_ratio)
+        if rate_limit_calls is not None:
+            limits.append(rate_limit_calls)
+        if self.context is not None:
+            millis = self.context.get_remaining_time_in_millis() - self.reserved_millis
+            limits.append(max(0, int(millis // self.call_millis)))
+        return min(limits) if len(limits) != 0 else None
+
+    def fits(self, calls: int) -> bool:
+        calls_left = self.calls_left()
+        return calls_left is None or calls <= calls_left
+
+
+def split_to_budget(costs: List[int], calls: Optional[int]) -> int:
+    """Return how many items of a bulk operation, taken in order, fit in a number of calls.
+
+    Args:
+        costs (List[int]): The estimated GitLab calls of each item.
+        calls (int, optional): The calls available, unbounded if None.
+
+    Returns:
+        int: The number of items of the first chunk.
+
+    """
+    if calls is None:
+        return len(costs)
+    total = 0
+    for (index, cost) in enumerate(costs):
+        total += cost
+        if total > calls:
+            return index
+    return len(costs)
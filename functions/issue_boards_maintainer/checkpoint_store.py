@@ -0,0 +1,84 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import (
+    Dict,
+    Optional
+)
+
+
+class SQLiteCheckpointStore:
+    """Checkpoints of resumable jobs stored in a local SQLite file, used for tests and local runs."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "name TEXT PRIMARY KEY, "
+                "checkpoint TEXT NOT NULL)"
+            )
+
+    def get(self, name: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT checkpoint FROM checkpoints WHERE name = ?", (name,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, name: str, checkpoint: Dict) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?)", (name, json.dumps(checkpoint))
+            )
+
+    def delete(self, name: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM checkpoints WHERE name = ?", (name,))
+
+
+class DynamoDBCheckpointStore:
+    """Checkpoints of resumable jobs stored in a DynamoDB table keyed by name."""
+
+    def __init__(self, table_name: str):
+        import boto3
+
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, name: str) -> Optional[Dict]:
+        record = self.table.get_item(Key={"name": name}).get("Item")
+        return json.loads(record["checkpoint"]) if record is not None else None
+
+    def put(self, name: str, checkpoint: Dict) -> None:
+        self.table.put_item(Item={
+            "name": name,
+            "checkpoint": json.dumps(checkpoint)
+        })
+
+    def delete(self, name: str) -> None:
+        self.table.delete_item(Key={"name": name})
+
+
+checkpoint_store = None
+
+
+def get_checkpoint_store():
+    """Return the checkpoint store of the environment.
+
+    CHECKPOINT_TABLE selects the DynamoDB table, otherwise a SQLite file at
+    CHECKPOINT_SQLITE_PATH is used.
+
+    Returns:
+        SQLiteCheckpointStore or DynamoDBCheckpointStore
+
+    """
+    global checkpoint_store
+    if checkpoint_store is None:
+        table_name = os.environ.get("CHECKPOINT_TABLE")
+        if table_name:
+            checkpoint_store = DynamoDBCheckpointStore(table_name)
+        else:
+            checkpoint_store = SQLiteCheckpointStore(os.environ.get("CHECKPOINT_SQLITE_PATH", "/tmp/checkpoints.sqlite3"))
+    return checkpoint_store
@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict
+
+from gitlab_enum import BreakerState
+from metrics import put_metric
+
+breaker_failure_rate = float(os.environ.get("BREAKER_FAILURE_RATE", "0.5"))
+breaker_minimum_calls = int(os.environ.get("BREAKER_MINIMUM_CALLS", "5"))
+breaker_window_seconds = float(os.environ.get("BREAKER_WINDOW_SECONDS", "60"))
+breaker_recovery_seconds = float(os.environ.get("BREAKER_RECOVERY_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling GitLab while the breaker of an endpoint is open."""
+
+    def __init__(self, endpoint: str):
+        super().__init__("Circuit Open: {}".format(endpoint))
+        self.endpoint = endpoint
+
+
+class CircuitBreaker:
+    """Track the error rate of one GitLab endpoint and stop calling it during an outage.
+
+    closed: calls pass through, outcomes are recorded in a rolling time window.
+    open: calls fail fast until the recovery timeout has elapsed.
+    half_open: a single probe call is let through, its outcome closes or reopens the breaker.
+
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        failure_rate: float = breaker_failure_rate,
+        minimum_calls: int = breaker_minimum_calls,
+        window_seconds: float = breaker_window_seconds,
+        recovery_seconds: float = breaker_recovery_seconds
+    ):
+        self.endpoint = endpoint
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.recovery_seconds = recovery_seconds
+
+        self.state = BreakerState.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.outcomes = deque()
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Return True if a call to the endpoint may be sent now.
+
+        Returns:
+            bool
+
+        """
+        with self.lock:
+            if self.state == BreakerState.CLOSED:
+                return True
+            if self.state == BreakerState.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_seconds:
+                    return False
+                self._change_state(BreakerState.HALF_OPEN)
+            # half open: only one probe in flight
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.state == BreakerState.HALF_OPEN:
+                self.probing = False
+                self.outcomes.clear()
+                self._change_state(BreakerState.CLOSED)
+                return
+            self._record(True)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            if self.state == BreakerState.HALF_OPEN:
+                self.probing = False
+                self._open()
+                return
+            self._record(False)
+            if self.state != BreakerState.CLOSED or len(self.outcomes) < self.minimum_calls:
+                return
+            failures = sum(1 for (_, ok) in self.outcomes if not ok)
+            if failures / len(self.outcomes) >= self.failure_rate:
+                self._open()
+
+    def _record(self, ok: bool) -> None:
+        now = time.monotonic()
+        self.outcomes.append((now, ok))
+        while len(self.outcomes) > 0 and now - self.outcomes[0][0] > self.window_seconds:
+            self.outcomes.popleft()
+
+    def _open(self) -> None:
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self._change_state(BreakerState.OPEN)
+
+    def _change_state(self, state: BreakerState) -> None:
+        if state == self.state:
+            return
+        put_metric("CircuitBreakerStateChange", 1, dimensions={
+            "Endpoint": self.endpoint,
+            "From": self.state.value,
+            "To": state.value
+        })
+        self.state = state
+
+
+circuit_breakers = {}  # type: Dict[str, CircuitBreaker]
+circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Return the breaker of an endpoint, kept for the lifetime of the lambda container.
+
+    Args:
+        endpoint (str): The endpoint name, eg. "GET /projects/:id/issues".
+
+    Returns:
+        CircuitBreaker
+
+    """
+    with circuit_breakers_lock:
+        breaker = circuit_breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint)
+            circuit_breakers[endpoint] = breaker
+        return breaker
@@ -0,0 +1,113 @@
+"""Replay recorded webhook events against an in-memory board, without calling GitLab.
+
+usage:
+    python dry_run.py EVENTS [--board BOARD] [--mutations MUTATIONS] [--final-board FINAL_BOARD]
+
+EVENTS is a JSON lines file of recorded lambda events ({"headers": {...}, "body": "..."}).
+BOARD is a board snapshot (see issue_board.InMemoryBoard), an empty board by default.
+The planned mutations of each event are written as JSON lines and the final board as JSON,
+so the output of two rule versions can be diffed.
+PROJECT_A_PROJECT_ID and PROJECT_B_PROJECT_ID must be set as in the lambda function.
+"""
+import sys
+import json
+import time
+import argparse
+from typing import (
+    Dict,
+    List,
+    Tuple
+)
+
+from gitlab_lib import response_message_body
+from gitlab_enum import (
+    Project,
+    GitlabEvent
+)
+from gitlab_payload import (
+    json_loads,
+    parse_webhook_body
+)
+from issue_board import InMemoryBoard
+from issue_planner import (
+    Mutation,
+    run_plan,
+    plan_event
+)
+
+
+def dry_run_event(event: Dict, board: InMemoryBoard) -> Tuple[Dict, List[Mutation]]:
+    """Plan a recorded lambda event and apply its mutations to the in-memory board.
+
+    Args:
+        event (Dict): The recorded lambda event.
+        board (InMemoryBoard): The board to read and mutate.
+
+    Returns:
+        Tuple[Dict, List[Mutation]]: (response, planned mutations)
+
+    """
+    gitlab_event = (event.get("headers") or {}).get("X-Gitlab-Event")
+    body = event.get("body")
+    if body is None or gitlab_event not in GitlabEvent.value_list():
+        return response_message_body(406, {
+            "message": "Unsupported GitLab Event"
+        }), []
+    try:
+        body_json = parse_webhook_body(gitlab_event, body)
+    except ValueError:
+        return response_message_body(400, {
+            "message": "Invalid Request Body or Header"
+        }), []
+
+    project_id = body_json.get("project", {}).get("id")
+    if gitlab_event == GitlabEvent.MERGE_REQUEST_HOOK.value and project_id in Project.value_list():
+        mr_attribute = body_json.get("object_attributes", {})
+        board.remember_merge_request(project_id, mr_attribute.get("iid"), mr_attribute.get("source_branch"))
+
+    return run_plan(plan_event(gitlab_event, body_json, board), board.apply_mutation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded webhook events against an in-memory board.")
+    parser.add_argument("events")
+    parser.add_argument("--board")
+    parser.add_argument("--mutations", default="-")
+    parser.add_argument("--final-board")
+    args = parser.parse_args()
+
+    snapshot = None
+    if args.board is not None:
+        with open(args.board) as fp:
+            snapshot = json.load(fp)
+    board = InMemoryBoard(snapshot)
+
+    mutations_fp = sys.stdout if args.mutations == "-" else open(args.mutations, "w")
+    started = time.perf_counter()
+    count = 0
+    with open(args.events) as events_fp:
+        for (index, line) in enumerate(events_fp):
+            if line.strip() == "":
+                continue
+            response, mutations = dry_run_event(json_loads(line), board)
+            mutations_fp.write(json.dumps({
+                "event": index,
+                "status": response.get("statusCode"),
+                "response": json_loads(response.get("body", "{}")),
+                "mutations": [mutation.to_dict() for mutation in mutations]
+            }, sort_keys=True) + "\n")
+            count += 1
+    elapsed = time.perf_counter() - started
+    if mutations_fp is not sys.stdout:
+        mutations_fp.close()
+
+    if args.final_board is not None:
+        with open(args.final_board, "w") as fp:
+            json.dump(board.to_snapshot(), fp, indent=2, sort_keys=True)
+
+    print("{} events in {:.3f} s ({:.0f} events/s)".format(count, elapsed, count / elapsed if elapsed else 0),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,92 @@
 import os
 import requests
 from typing import (
+    Dict,
     List,
     Tuple,
     Optional
 )
 
 from gitlab_enum import IssueState
+from circuit_breaker import (
+    CircuitOpenError,
+    get_circuit_breaker
+)
+from tracing import (
+    start_span,
+    span_kind_client
+)
+from rate_limiter import gitlab_rate_limit
+
+gitlab_api_base_url = os.environ.get("GITLAB_API_BASE_URL", "https://gitlab.com/api/v4")
+gitlab_connect_timeout = float(os.environ.get("GITLAB_CONNECT_TIMEOUT", "3.05"))
+gitlab_read_timeout = float(os.environ.get("GITLAB_READ_TIMEOUT", "10"))
 
-gitlab_api_base_url = "https://gitlab.com/api/v4"
+
+def send_gitlab_request(
+    method: str,
+    endpoint: str,
+    url: str,
+    headers: Dict[str, str],
+    params: Dict
+) -> requests.Response:
+    """Send a request to GitLab through the circuit breaker of the endpoint.
+
+    Connection errors, timeouts, 429 and 5xx responses count as failures of the endpoint,
+    other 4xx responses are caller errors and count as successes. The RateLimit-* headers of
+    every response update gitlab_rate_limit.
+
+    Args:
+        method (str): The HTTP method.
+        endpoint (str): The endpoint name used as the breaker key, eg. "GET /projects/:id/issues".
+        url (str): The request URL.
+        headers (Dict[str, str]): The request headers.
+        params (Dict): The query parameters.
+
+    Returns:
+        requests.Response
+
+    Raises:
+        CircuitOpenError: The breaker of the endpoint is open.
+        requests.exceptions.RequestException: The request failed.
+
+    """
+    with start_span(endpoint, {"http.method": method}, span_kind_client) as span:
+        breaker = get_circuit_breaker(endpoint)
+        if not breaker.allow_request():
+            span.set_attribute("circuit_breaker.open", True)
+            raise CircuitOpenError(endpoint)
+
+        try:
+            response = requests.request(method, url,
+                                        headers=headers,
+                                        params=params,
+                                        timeout=(gitlab_connect_timeout, gitlab_read_timeout))
+        except Exception:
+            breaker.record_failure()
+            raise
+
+        span.set_attribute("http.status_code", response.status_code)
+        span.set_attribute("http.response_content_length", len(response.content))
+        gitlab_rate_limit.observe(response.headers)
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        response.raise_for_status()
+        return response
 
 
 def search_project_issues(
     project_id: int,
     labels: Optional[List[str]] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    page: Optional[int] = None,
+    per_page: Optional[int] = None,
+    state: Optional[str] = None,
+    sort: Optional[str] = None,
+    order_by: Optional[str] = None,
+    created_after: Optional[str] = None
 ) -> Tuple[List, Exception]:
     """Get a list of a project’s issues.
 
@@ -22,6 +94,12 @@ def search_project_issues(
         project_id (int): The ID of the project.
         labels (List[str], optional): Label names of an issue.
         search (str, optional): Search against title and description.
+        page (int, optional): The page to return, starting from 1.
+        per_page (int, optional): The number of issues per page, at most 100.
+        state (str, optional): Return only "opened" or "closed" issues.
+        sort (str, optional): Return issues sorted in "asc" or "desc" order of creation.
+        order_by (str, optional): Order issues by "created_at" or "updated_at".
+        created_after (str, optional): Return issues created on or after the ISO 8601 time.
 
     Returns:
         Tuple[List, Exception]: (list of issues, Exception)
@@ -39,10 +117,21 @@ def search_project_issues(
         params["labels"] = ",".join(labels)
     if search is not None:
         params["search"] = search
+    if page is not None:
+        params["page"] = page
+    if per_page is not None:
+        params["per_page"] = per_page
+    if state is not None:
+        params["state"] = state
+    if sort is not None:
+        params["sort"] = sort
+    if order_by is not None:
+        params["order_by"] = order_by
+    if created_after is not None:
+        params["created_after"] = created_after
 
     try:
-        response = requests.get(search_issue_url, headers=headers, params=params)
-        response.raise_for_status()
+        response = send_gitlab_request("GET", "GET /projects/:id/issues", search_issue_url, headers, params)
         return response.json(), None
     except Exception as e:
         return None, e
@@ -87,8 +176,7 @@ def create_project_issue(
         params["milestone_id"] = milestone_id
 
     try:
-        response = requests.post(create_issue_url, headers=headers, params=params)
-        response.raise_for_status()
+        response = send_gitlab_request("POST", "POST /projects/:id/issues", create_issue_url, headers, params)
         response_json = response.json()
         return response_json, None
     except Exception as e:
@@ -101,7 +189,9 @@ def update_project_issue(
     labels: Optional[List[str]] = None,
     description: Optional[str] = None,
     state_event: Optional[str] = None,
-    milestone_id: Optional[int] = None
+    milestone_id: Optional[int] = None,
+    add_labels: Optional[List[str]] = None,
+    remove_labels: Optional[List[str]] = None
 ) -> Optional[Exception]:
     """Update an existing project issue. This call is also used to mark an issue as closed.
 
@@ -112,6 +202,8 @@ def update_project_issue(
         description (str, optional): The description of an issue.
         state_event (str, optional): The state event of an issue. Set close to "close" the issue and "reopen" to reopen it.
         milestone_id (int, optional): The ID of a milestone to assign the issue to. Set to 0 or provide an empty value to unassign a milestone.
+        add_labels (List[str], optional): Label names to add to the issue, without reading its labels first.
+        remove_labels (List[str], optional): Label names to remove from the issue.
 
     Returns:
         Exception: None if no error exists.
@@ -130,10 +222,13 @@ def update_project_issue(
         params["state_event"] = state_event
     if milestone_id is not None:
         params["milestone_id"] = milestone_id
+    if add_labels is not None:
+        params["add_labels"] = ",".join(add_labels)
+    if remove_labels is not None:
+        params["remove_labels"] = ",".join(remove_labels)
 
     try:
-        response = requests.put(update_issue_url, headers=headers, params=params)
-        response.raise_for_status()
+        response = send_gitlab_request("PUT", "PUT /projects/:id/issues/:iid", update_issue_url, headers, params)
         return None
     except Exception as e:
         return e
@@ -141,13 +236,17 @@ def update_project_issue(
 
 def search_project_milestones(
     project_id: int,
-    state: str = "active"
+    state: str = "active",
+    page: Optional[int] = None,
+    per_page: Optional[int] = None
 ) -> Tuple[List, Exception]:
     """Return a list of project milestones.
 
     Args:
         project_id (int): The ID of the project.
         state (str, optional): Return only "active" or "closed" milestones.
+        page (int, optional): The page to return, starting from 1.
+        per_page (int, optional): The number of milestones per page, at most 100.
 
     Returns:
         Tuple[List, Exception]: (list of milestones, Exception)
@@ -160,10 +259,13 @@ def search_project_milestones(
     params = {}
     if state is not None:
         params["state"] = state
+    if page is not None:
+        params["page"] = page
+    if per_page is not None:
+        params["per_page"] = per_page
 
     try:
-        response = requests.get(search_milestone_url, headers=headers, params=params)
-        response.raise_for_status()
+        response = send_gitlab_request("GET", "GET /projects/:id/milestones", search_milestone_url, headers, params)
         response_json = response.json()
         return response_json, None
     except Exception as e:
@@ -172,13 +274,27 @@ def search_project_milestones(
 
 def search_project_merge_requests(
     project_id: int,
-    mr_iid: Optional[int] = None
+    mr_iid: Optional[int] = None,
+    state: Optional[str] = None,
+    updated_after: Optional[str] = None,
+    updated_before: Optional[str] = None,
+    order_by: Optional[str] = None,
+    sort: Optional[str] = None,
+    page: Optional[int] = None,
+    per_page: Optional[int] = None
 ) -> Tuple[List, Exception]:
     """Get all merge requests for this project.
 
     Args:
         project_id (int): The ID of the project.
         mr_iid (str, optional): Return the request having the given mr_iid.
+        state (str, optional): Return only "opened", "closed", "locked" or "merged" merge requests, or "all".
+        updated_after (str, optional): Return merge requests updated at or after this ISO 8601 time.
+        updated_before (str, optional): Return merge requests updated before this ISO 8601 time.
+        order_by (str, optional): Return merge requests ordered by "created_at" or "updated_at".
+        sort (str, optional): Return merge requests sorted in "asc" or "desc" order.
+        page (int, optional): The page to return, starting from 1.
+        per_page (int, optional): The number of merge requests per page, at most 100.
 
     Returns:
         Tuple[List, Exception]: (list of merge requests, Exception)
@@ -191,10 +307,49 @@ def search_project_merge_requests(
     params = {}
     if mr_iid is not None:
         params["iids[]"] = mr_iid
+    if state is not None:
+        params["state"] = state
+    if updated_after is not None:
+        params["updated_after"] = updated_after
+    if updated_before is not None:
+        params["updated_before"] = updated_before
+    if order_by is not None:
+        params["order_by"] = order_by
+    if sort is not None:
+        params["sort"] = sort
+    if page is not None:
+        params["page"] = page
+    if per_page is not None:
+        params["per_page"] = per_page
 
     try:
-        response = requests.get(search_merge_request_url, headers=headers, params=params)
-        response.raise_for_status()
+        response = send_gitlab_request("GET", "GET /projects/:id/merge_requests", search_merge_request_url, headers, params)
+        return response.json(), None
+    except Exception as e:
+        return None, e
+
+
+def get_project_merge_request(
+    project_id: int,
+    mr_iid: int
+) -> Tuple[Dict, Exception]:
+    """Get a single merge request of this project.
+
+    Args:
+        project_id (int): The ID of the project.
+        mr_iid (int): The internal ID of the merge request.
+
+    Returns:
+        Tuple[Dict, Exception]: (merge request, Exception)
+
+    """
+    get_merge_request_url = gitlab_api_base_url + "/projects/{}/merge_requests/{}".format(project_id, mr_iid)
+    headers = {
+        "Private-Token": os.environ.get("ACCESS_TOKEN")
+    }
+
+    try:
+        response = send_gitlab_request("GET", "GET /projects/:id/merge_requests/:iid", get_merge_request_url, headers, {})
         return response.json(), None
     except Exception as e:
         return None, e
@@ -1,9 +1,11 @@
 import os
 from enum import Enum
+from functools import lru_cache
 
 
 class ExtendedEnum(Enum):
     @classmethod
+    @lru_cache(maxsize=None)
     def value_list(cls):
         # List[str]: Convert Enum values to a list
         values = []
@@ -41,6 +43,11 @@ class IssueLabel(Enum):
     PROJECT_A = "project A"
     PROJECT_B = "project B"
 
+    @classmethod
+    def stage_values(cls):
+        # List[str]: Label names of the board lists
+        return [cls.DOING.value, cls.MR_REVIEW.value, cls.DEV.value, cls.STAGING.value, cls.PRODUCTION.value]
+
 
 class IssueState(Enum):
     OPENED = "opened"
@@ -51,3 +58,22 @@ class IssueState(Enum):
 class Project(ExtendedEnum):
     PROJECT_A = int(os.environ.get("PROJECT_A_PROJECT_ID"))
     PROJECT_B = int(os.environ.get("PROJECT_B_PROJECT_ID"))
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class RetryItemStatus(Enum):
+    PENDING = "pending"
+    DEAD = "dead"
+
+
+class EventLane(ExtendedEnum):
+    # priority lanes of webhook events, highest priority first
+    PROMOTION = "promotion"
+    MERGE = "merge"
+    OPEN = "open"
+    PUSH = "push"
@@ -1,11 +1,17 @@
 import re
 import json
+from datetime import date
 from typing import (
     Dict,
     List,
+    Tuple,
     Optional
 )
 
+from circuit_breaker import CircuitOpenError
+from gitlab_enum import IssueLabel
+from tracing import start_span
+
 
 def response_message_body(
     status_code: int,
@@ -29,6 +35,50 @@ def response_message_body(
     return response
 
 
+def error_response_body(
+    message: str,
+    error: Exception
+) -> Dict[str, str]:
+    """Construct an error response, 503 if GitLab calls are failing fast because of an open circuit.
+
+    Args:
+        message (str): The message of the response.
+        error (Exception): The error causing the failure.
+
+    Returns:
+        Dict[str, str]
+
+    """
+    status_code = 500
+    if isinstance(error, CircuitOpenError):
+        status_code = 503
+    return response_message_body(status_code, {
+        "message": message,
+        "error": str(error)
+    })
+
+
+def stage_transition(
+    stage_label: Optional[str],
+    labels: Optional[List[str]] = None
+) -> Tuple[List[str], List[str]]:
+    """Express a move to a board list as label deltas, eg. remove Staging, add Production.
+
+    Args:
+        stage_label (str, optional): The board list to move the issue to, None to leave every board list.
+        labels (List[str], optional): Other label names the issue should have.
+
+    Returns:
+        Tuple[List[str], List[str]]: (add_labels, remove_labels)
+
+    """
+    add_labels = list(labels or [])
+    if stage_label is not None:
+        add_labels.append(stage_label)
+    remove_labels = [label for label in IssueLabel.stage_values() if label != stage_label]
+    return add_labels, remove_labels
+
+
 def get_id_from_text_description(description: str) -> Optional[int]:
     """Parse id from text in the description.
 
@@ -41,11 +91,12 @@ def get_id_from_text_description(description: str) -> Optional[int]:
 
     """
     description_regex = re.compile("^(.|\n)*!([0-9]*)(.|\n)*$")
-    try:
-        (_, mr_id, _) = description_regex.match(description).groups()
-        return int(mr_id)
-    except Exception:
-        return None
+    with start_span("parse MR description", {"gitlab.description_size": len(description or "")}):
+        try:
+            (_, mr_id, _) = description_regex.match(description).groups()
+            return int(mr_id)
+        except Exception:
+            return None
 
 
 def get_ids_from_url_description(description: str) -> List[int]:
@@ -60,15 +111,41 @@ def get_ids_from_url_description(description: str) -> List[int]:
 
     """
     description_regex = re.compile("^.*/([0-9]*)$")
-    description_lines = description.split("\n\n")
-    issue_iids = []
-    for line in description_lines:
-        try:
-            issue_iid = description_regex.match(line).groups()[0]
-            issue_iids.append(int(issue_iid))
-        except Exception:
-            pass
-    return issue_iids
+    with start_span("parse issue description", {"gitlab.description_size": len(description)}) as span:
+        description_lines = description.split("\n\n")
+        issue_iids = []
+        for line in description_lines:
+            try:
+                issue_iid = description_regex.match(line).groups()[0]
+                issue_iids.append(int(issue_iid))
+            except Exception:
+                pass
+        span.set_attribute("parse.issue_count", len(issue_iids))
+        return issue_iids
+
+
+def newest_active_milestone(milestones: List[Dict], today: Optional[str] = None) -> Optional[Dict]:
+    """Return the active milestone started last, the sprint issues should be on.
+
+    Milestones starting after today are planned sprints and skipped, those without a start date
+    count as started.
+
+    Args:
+        milestones (List[Dict]): The milestones of the project.
+        today (str, optional): The ISO date to compare start dates with, today if None.
+
+    Returns:
+        Dict: None if no milestone is active.
+
+    """
+    today = today or date.today().isoformat()
+    active_milestones = [
+        milestone for milestone in milestones
+        if milestone.get("state", "active") == "active" and (milestone.get("start_date") or "") <= today
+    ]
+    if len(active_milestones) == 0:
+        return None
+    return max(active_milestones, key=lambda milestone: (milestone.get("start_date") or "", milestone.get("id")))
 
 
 def is_cherry_pick_branch(branch_name: str) -> bool:
@@ -0,0 +1,213 @@
+import re
+import json
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional
+)
+
+from gitlab_enum import GitlabEvent
+from tracing import start_span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_decoder = json.JSONDecoder()
+whitespace_regex = re.compile(r"[ \t\n\r]*")
+# a string, a bracket, or a run of anything else
+skip_token_regex = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]|[^"\[\]{}]+', re.S)
+
+# bodies under this size are not worth a partial parse
+peek_min_body_size = 16 * 1024
+
+# top-level keys holding the bulk of a payload, routing keys after them are looked up from the tail
+heavy_keys = ("commits",)
+
+
+def json_loads(body: str) -> Any:
+    """Deserialize a whole JSON document, with orjson when it is installed.
+
+    Args:
+        body (str): The JSON document.
+
+    Returns:
+        Any
+
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def skip_whitespace(body: str, pos: int) -> int:
+    return whitespace_regex.match(body, pos).end()
+
+
+def skip_value(body: str, pos: int) -> int:
+    """Return the end of the JSON value at pos without building it.
+
+    Args:
+        body (str): The JSON document.
+        pos (int): The start of the value.
+
+    Returns:
+        int
+
+    """
+    if body[pos] not in "[{":
+        (_, end) = json_decoder.raw_decode(body, pos)
+        return end
+
+    depth = 0
+    for token in skip_token_regex.finditer(body, pos):
+        text = token.group()
+        if text == "[" or text == "{":
+            depth += 1
+        elif text == "]" or text == "}":
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    raise ValueError("Unterminated JSON value")
+
+
+def ends_top_level_object(body: str, pos: int) -> bool:
+    """Return True if the rest of the body from pos is the remaining members of the top-level object.
+
+    Args:
+        body (str): The JSON document.
+        pos (int): The end of a member value.
+
+    Returns:
+        bool
+
+    """
+    try:
+        pos = skip_whitespace(body, pos)
+        while body[pos:pos + 1] == ",":
+            pos = skip_whitespace(body, pos + 1)
+            if body[pos:pos + 1] != '"':
+                return False
+            (_, pos) = json_decoder.raw_decode(body, pos)
+            pos = skip_whitespace(body, pos)
+            if body[pos:pos + 1] != ":":
+                return False
+            pos = skip_whitespace(body, skip_value(body, skip_whitespace(body, pos + 1)))
+        return body[pos:pos + 1] == "}" and skip_whitespace(body, pos + 1) == len(body)
+    except (ValueError, IndexError):
+        return False
+
+
+def find_tail_value(body: str, key: str) -> Optional[Any]:
+    """Decode the value of the last occurrence of a top-level key, searching from the end.
+
+    The occurrence is only used when the members after it close the top-level object, so the
+    same key in a nested object is never returned.
+
+    Args:
+        body (str): The JSON document.
+        key (str): The key to find.
+
+    Returns:
+        Any: None if the key cannot be found safely.
+
+    """
+    pos = body.rfind('"{}"'.format(key))
+    if pos <= 0 or body[pos - 1] == "\\":
+        return None
+    pos = skip_whitespace(body, pos + len(key) + 2)
+    if body[pos:pos + 1] != ":":
+        return None
+    try:
+        (value, end) = json_decoder.raw_decode(body, skip_whitespace(body, pos + 1))
+    except ValueError:
+        return None
+    if not ends_top_level_object(body, end):
+        return None
+    return value
+
+
+def peek_payload_fields(body: str, keys: List[str]) -> Dict[str, Any]:
+    """Decode only the given top-level fields of a webhook body.
+
+    The top-level object is scanned key by key, values of other keys are skipped without
+    being built, and the scan stops as soon as all fields are found. Fields after a heavy
+    key (eg. total_commits_count after commits in a push hook) are looked up from the tail.
+
+    Args:
+        body (str): The webhook body.
+        keys (List[str]): The top-level keys to decode.
+
+    Returns:
+        Dict[str, Any]: Decoded fields, missing keys are absent.
+
+    Raises:
+        ValueError: The body is not a JSON object.
+
+    """
+    fields = {}
+    wanted = set(keys)
+    pos = skip_whitespace(body, 0)
+    if body[pos:pos + 1] != "{":
+        raise ValueError("Expecting JSON object")
+    pos = skip_whitespace(body, pos + 1)
+
+    while len(wanted) != 0 and body[pos:pos + 1] == '"':
+        (key, pos) = json_decoder.raw_decode(body, pos)
+        pos = skip_whitespace(body, pos)
+        if body[pos:pos + 1] != ":":
+            raise ValueError("Expecting ':' delimiter")
+        pos = skip_whitespace(body, pos + 1)
+
+        if key in wanted:
+            (fields[key], pos) = json_decoder.raw_decode(body, pos)
+            wanted.discard(key)
+        else:
+            if key in heavy_keys:
+                for tail_key in list(wanted):
+                    value = find_tail_value(body, tail_key)
+                    if value is not None:
+                        fields[tail_key] = value
+                        wanted.discard(tail_key)
+                if len(wanted) == 0:
+                    break
+            pos = skip_value(body, pos)
+
+        pos = skip_whitespace(body, pos)
+        if body[pos:pos + 1] == ",":
+            pos = skip_whitespace(body, pos + 1)
+    return fields
+
+
+def parse_webhook_body(gitlab_event: str, body: str) -> Dict[str, Any]:
+    """Parse the fields of a webhook body the handler routes on, the whole body only as a fallback.
+
+    Args:
+        gitlab_event (str): The X-Gitlab-Event header.
+        body (str): The webhook body.
+
+    Returns:
+        Dict[str, Any]
+
+    Raises:
+        ValueError: The body is not a JSON object.
+
+    """
+    with start_span("parse webhook body", {"gitlab.body_size": len(body)}) as span:
+        # small bodies decode faster as a whole
+        if len(body) < peek_min_body_size:
+            span.set_attribute("parse.mode", "full")
+            return json_loads(body)
+
+        if gitlab_event == GitlabEvent.PUSH_HOOK.value:
+            routing_keys = ["project", "ref", "total_commits_count"]
+        else:
+            routing_keys = ["project", "object_attributes"]
+        body_json = peek_payload_fields(body, routing_keys)
+        span.set_attribute("parse.mode", "peek")
+        if len(body_json) != len(routing_keys):
+            span.set_attribute("parse.mode", "fallback")
+            body_json = json_loads(body)
+        return body_json
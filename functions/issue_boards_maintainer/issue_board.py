@@ -0,0 +1,491 @@
+from collections import OrderedDict
+from typing import (
+    Any,
+    Dict,
+    List,
+    Set,
+    Tuple,
+    Optional
+)
+
+from gitlab_apis import (
+    create_project_issue,
+    update_project_issue,
+    search_project_issues,
+    search_project_milestones
+)
+from gitlab_enum import (
+    Project,
+    IssueState
+)
+from gitlab_lib import (
+    newest_active_milestone,
+    get_ids_from_url_description
+)
+from issue_planner import Mutation
+from mr_cache import (
+    get_merge_request_source_branch,
+    remember_merge_request_source_branch
+)
+
+search_per_page = 100
+
+
+def search_active_milestones() -> Tuple[Optional[List[Dict]], Optional[Exception]]:
+    """Return every active milestone of PROJECT_A, all pages.
+
+    Returns:
+        Tuple[List[Dict], Exception]: (milestones, Exception)
+
+    """
+    milestones = []
+    page = 1
+    while True:
+        page_milestones, error = search_project_milestones(Project.PROJECT_A.value, "active",
+                                                           page=page, per_page=search_per_page)
+        if error is not None:
+            return None, error
+        milestones.extend(page_milestones)
+        if len(page_milestones) < search_per_page:
+            return milestones, None
+        page += 1
+
+
+class GitLabBoard:
+    """The live board, read from and written to GitLab.
+
+    With a board snapshot, label-only searches (eg. all issues in Staging) are served from the
+    snapshot while it is fresh, and every issue read from or written to GitLab updates it.
+
+    Args:
+        snapshot (BoardSnapshot, optional): The materialized view of the board.
+
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+
+    def search_issues(
+        self,
+        labels: Optional[List[str]] = None,
+        search: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[Exception]]:
+        if self.snapshot is not None and search is None and self.snapshot.is_fresh():
+            return self.snapshot.board.search_issues(labels)
+
+        # all pages, eg. every issue in Staging when staging is merged to master
+        issues = []
+        page = 1
+        while True:
+            page_issues, error = search_project_issues(Project.PROJECT_A.value, labels, search,
+                                                       page=page, per_page=search_per_page)
+            if error is not None:
+                return None, error
+            issues.extend(page_issues)
+            if len(page_issues) < search_per_page:
+                break
+            page += 1
+        if self.snapshot is not None:
+            self.snapshot.observe_issues(issues)
+        return issues, None
+
+    def active_milestone_id(self) -> Tuple[Optional[int], Optional[Exception]]:
+        milestones, error = search_active_milestones()
+        if error is not None:
+            return None, error
+        milestone = newest_active_milestone(milestones)
+        if milestone is None:
+            return None, None
+        return milestone.get("id"), None
+
+    def merge_request_source_branch(
+        self,
+        project_id: int,
+        mr_iid: int
+    ) -> Tuple[Optional[str], Optional[Exception]]:
+        return get_merge_request_source_branch(project_id, mr_iid)
+
+    def remember_merge_request(
+        self,
+        project_id: int,
+        mr_iid: Optional[int],
+        source_branch: Optional[str]
+    ) -> Optional[Exception]:
+        return remember_merge_request_source_branch(project_id, mr_iid, source_branch)
+
+    def apply_mutation(self, mutation) -> Tuple[Any, Optional[Exception]]:
+        if mutation.operation == "create_project_issue":
+            result, error = create_project_issue(**mutation.arguments)
+        elif mutation.operation == "update_project_issue":
+            result, error = None, update_project_issue(**mutation.arguments)
+        else:
+            return None, ValueError("Unsupported Operation: {}".format(mutation.operation))
+
+        if error is None and self.snapshot is not None:
+            self.snapshot.observe_mutation(mutation, result)
+        return result, error
+
+
+class InMemoryBoard:
+    """A board held in memory, searched and mutated the way GitLab would.
+
+    The snapshot format is:
+        {
+            "web_url": "https://gitlab.com/xxx/project_a",
+            "issues": [{"iid", "title", "description", "labels", "state", "milestone_id", "web_url"}],
+            "milestones": [{"id", "state", "start_date"}],
+            "merge_requests": {"<project_id>:<mr_iid>": "<source branch>"}
+        }
+
+    Args:
+        snapshot (Dict, optional): The board state to start from.
+
+    """
+
+    def __init__(self, snapshot: Optional[Dict] = None):
+        snapshot = snapshot or {}
+        self.web_url = snapshot.get("web_url", "https://gitlab.com/project_a")
+        self.milestones = list(snapshot.get("milestones", []))
+        self.merge_requests = dict(snapshot.get("merge_requests", {}))
+        self.issues = {}
+        # label name => iids having the label
+        self.label_index = {}
+        # trigram of the lowercased title and description => iids containing it
+        self.trigram_index = {}
+        self.search_texts = {}
+        # milestone id => iids assigned to the milestone
+        self.milestone_index = {}
+        for issue in snapshot.get("issues", []):
+            self._put_issue(dict(issue))
+        self.last_iid = max(self.issues.keys(), default=0)
+
+    def to_snapshot(self) -> Dict:
+        return {
+            "web_url": self.web_url,
+            "issues": [self.issues[iid] for iid in sorted(self.issues)],
+            "milestones": self.milestones,
+            "merge_requests": self.merge_requests
+        }
+
+    def search_issues(
+        self,
+        labels: Optional[List[str]] = None,
+        search: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[Exception]]:
+        # intersect label and trigram postings, smallest first
+        candidate_sets = [self.label_index.get(label, set()) for label in labels or []]
+        if search is not None:
+            search = search.lower()
+            if len(search) >= 3:
+                candidate_sets.extend(self.trigram_index.get(trigram, set()) for trigram in trigrams(search))
+
+        if len(candidate_sets) != 0:
+            candidate_sets.sort(key=len)
+            iids = candidate_sets[0].intersection(*candidate_sets[1:])
+        else:
+            iids = self.issues.keys()
+        if search is not None:
+            iids = [iid for iid in iids if search in self.search_texts[iid]]
+
+        issues = []
+        for iid in sorted(iids, reverse=True):
+            issue = self.issues[iid]
+            issues.append(dict(issue, labels=list(issue["labels"])))
+        return issues, None
+
+    def issues_in_stage(self, stage_label: str) -> List[Dict]:
+        issues, _ = self.search_issues([stage_label])
+        return issues
+
+    def issues_in_milestone(self, milestone_id: int) -> List[Dict]:
+        return [self.issues[iid] for iid in sorted(self.milestone_index.get(milestone_id, set()), reverse=True)]
+
+    def epic_members(self, epic_iid: int) -> List[Dict]:
+        epic = self.issues.get(epic_iid)
+        if epic is None:
+            return []
+        related_issue_iids = get_ids_from_url_description(epic.get("description") or "")
+        return [self.issues[iid] for iid in related_issue_iids if iid in self.issues]
+
+    def observe_issue(self, issue: Dict) -> None:
+        """Upsert an issue as returned by the GitLab issues API.
+
+        Args:
+            issue (Dict): The GitLab issue.
+
+        """
+        self._put_issue({
+            "iid": issue.get("iid"),
+            "title": issue.get("title", ""),
+            "description": issue.get("description") or "",
+            "labels": list(issue.get("labels") or []),
+            "state": issue.get("state", IssueState.OPENED.value),
+            "milestone_id": (issue.get("milestone") or {}).get("id", issue.get("milestone_id")),
+            "web_url": issue.get("web_url")
+        })
+        self.last_iid = max(self.last_iid, issue.get("iid"))
+
+    def active_milestone_id(self) -> Tuple[Optional[int], Optional[Exception]]:
+        milestone = newest_active_milestone(self.milestones)
+        if milestone is None:
+            return None, None
+        return milestone.get("id"), None
+
+    def merge_request_source_branch(
+        self,
+        project_id: int,
+        mr_iid: int
+    ) -> Tuple[Optional[str], Optional[Exception]]:
+        return self.merge_requests.get("{}:{}".format(project_id, mr_iid)), None
+
+    def remember_merge_request(
+        self,
+        project_id: int,
+        mr_iid: Optional[int],
+        source_branch: Optional[str]
+    ) -> Optional[Exception]:
+        if mr_iid is not None and source_branch is not None:
+            self.merge_requests["{}:{}".format(project_id, mr_iid)] = source_branch
+        return None
+
+    def apply_mutation(self, mutation) -> Tuple[Any, Optional[Exception]]:
+        arguments = mutation.arguments
+        if mutation.operation == "create_project_issue":
+            self.last_iid += 1
+            iid = self.last_iid
+            issue = {
+                "iid": iid,
+                "title": arguments.get("title", ""),
+                "description": arguments.get("description", ""),
+                "labels": list(arguments.get("labels") or []),
+                "state": IssueState.OPENED.value,
+                "milestone_id": arguments.get("milestone_id"),
+                "web_url": "{}/-/issues/{}".format(self.web_url, iid)
+            }
+            self._put_issue(issue)
+            return dict(issue), None
+
+        if mutation.operation == "update_project_issue":
+            issue = self.issues.get(arguments.get("issue_iid"))
+            if issue is None:
+                return None, LookupError("404 Issue Not Found: {}".format(arguments.get("issue_iid")))
+            labels = list(issue["labels"])
+            if arguments.get("labels") is not None:
+                labels = list(arguments["labels"])
+            for label in arguments.get("remove_labels") or []:
+                if label in labels:
+                    labels.remove(label)
+            for label in arguments.get("add_labels") or []:
+                if label not in labels:
+                    labels.append(label)
+            updated = dict(issue, labels=labels)
+            if arguments.get("description") is not None:
+                updated["description"] = arguments["description"]
+            if arguments.get("milestone_id") is not None:
+                updated["milestone_id"] = arguments["milestone_id"]
+            if arguments.get("state_event") == IssueState.CLOSE.value:
+                updated["state"] = "closed"
+            elif arguments.get("state_event") == IssueState.REOPEN.value:
+                updated["state"] = IssueState.OPENED.value
+            self._put_issue(updated)
+            return None, None
+
+        return None, ValueError("Unsupported Operation: {}".format(mutation.operation))
+
+    def _put_issue(self, issue: Dict) -> None:
+        iid = issue["iid"]
+        previous = self.issues.get(iid)
+        if previous is not None:
+            for label in previous["labels"]:
+                self.label_index[label].discard(iid)
+            self.milestone_index.get(previous.get("milestone_id"), set()).discard(iid)
+        issue["labels"] = list(issue.get("labels") or [])
+        self.issues[iid] = issue
+        for label in issue["labels"]:
+            self.label_index.setdefault(label, set()).add(iid)
+        if issue.get("milestone_id") is not None:
+            self.milestone_index.setdefault(issue["milestone_id"], set()).add(iid)
+
+        # GitLab searches title and description, the trigram index narrows down substring matches
+        if (previous is not None and previous.get("title") == issue.get("title")
+                and previous.get("description") == issue.get("description")):
+            return
+        search_text = "{}\0{}".format(issue.get("title", ""), issue.get("description") or "").lower()
+        previous_search_text = self.search_texts.get(iid)
+        if previous_search_text == search_text:
+            return
+        if previous_search_text is not None and search_text.startswith(previous_search_text):
+            # appended descriptions, eg. the related issues of an EPIC, only add the trigrams of the tail
+            for trigram in trigrams(search_text[max(0, len(previous_search_text) - 2):]):
+                self.trigram_index.setdefault(trigram, set()).add(iid)
+            self.search_texts[iid] = search_text
+            return
+        previous_trigrams = trigrams(previous_search_text) if previous_search_text is not None else set()
+        current_trigrams = trigrams(search_text)
+        for trigram in previous_trigrams - current_trigrams:
+            self.trigram_index[trigram].discard(iid)
+        for trigram in current_trigrams - previous_trigrams:
+            self.trigram_index.setdefault(trigram, set()).add(iid)
+        self.search_texts[iid] = search_text
+
+
+class BatchBoard:
+    """A board shared by a batch of events, reading each lookup once and updating each issue once.
+
+    Searches, the active milestone and MR source branches are read from the live board the first
+    time and answered from an in-memory overlay afterwards, which also reflects the mutations of
+    earlier events of the batch. Issues are created right away, since later mutations refer to
+    them, while the updates of each issue are combined and applied by flush().
+
+    Args:
+        board (GitLabBoard): The live board.
+
+    """
+
+    def __init__(self, board):
+        self.board = board
+        self.overlay = InMemoryBoard()
+        # (labels, search) => iids returned by the live board
+        self.query_iids = {}
+        self.milestone_id = None
+        self.milestone_fetched = False
+        self.merge_requests = {}
+        self.pending_updates = OrderedDict()
+        self.lookups = 0
+        self.updates = 0
+
+    def search_issues(
+        self,
+        labels: Optional[List[str]] = None,
+        search: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[Exception]]:
+        query = (tuple(labels or []), search)
+        if query not in self.query_iids:
+            self.lookups += 1
+            issues, error = self.board.search_issues(labels, search)
+            if error is not None:
+                return issues, error
+            for issue in issues:
+                if issue.get("iid") not in self.overlay.issues:
+                    self.overlay.observe_issue(issue)
+            self.query_iids[query] = [issue.get("iid") for issue in issues]
+
+        # issues created or relabeled by earlier events of the batch match too
+        overlay_issues, _ = self.overlay.search_issues(labels, search)
+        iids = set(self.query_iids[query]) | {issue["iid"] for issue in overlay_issues}
+        issues = []
+        for iid in sorted(iids, reverse=True):
+            issue = self.overlay.issues[iid]
+            if all(label in issue["labels"] for label in labels or []):
+                issues.append(dict(issue, labels=list(issue["labels"])))
+        return issues, None
+
+    def active_milestone_id(self) -> Tuple[Optional[int], Optional[Exception]]:
+        if not self.milestone_fetched:
+            self.lookups += 1
+            milestone_id, error = self.board.active_milestone_id()
+            if error is not None:
+                return None, error
+            self.milestone_id = milestone_id
+            self.milestone_fetched = True
+        return self.milestone_id, None
+
+    def merge_request_source_branch(
+        self,
+        project_id: int,
+        mr_iid: int
+    ) -> Tuple[Optional[str], Optional[Exception]]:
+        mr_key = "{}:{}".format(project_id, mr_iid)
+        if mr_key not in self.merge_requests:
+            self.lookups += 1
+            source_branch, error = self.board.merge_request_source_branch(project_id, mr_iid)
+            if error is not None:
+                return None, error
+            self.merge_requests[mr_key] = source_branch
+        return self.merge_requests[mr_key], None
+
+    def remember_merge_request(
+        self,
+        project_id: int,
+        mr_iid: Optional[int],
+        source_branch: Optional[str]
+    ) -> Optional[Exception]:
+        if mr_iid is not None and source_branch is not None:
+            self.merge_requests["{}:{}".format(project_id, mr_iid)] = source_branch
+        return self.board.remember_merge_request(project_id, mr_iid, source_branch)
+
+    def apply_mutation(self, mutation) -> Tuple[Any, Optional[Exception]]:
+        if mutation.operation == "create_project_issue":
+            result, error = self.board.apply_mutation(mutation)
+            if error is None and result is not None:
+                self.overlay.observe_issue(result)
+            return result, error
+
+        if mutation.operation == "update_project_issue":
+            issue_iid = mutation.arguments.get("issue_iid")
+            if issue_iid in self.overlay.issues:
+                self.overlay.apply_mutation(mutation)
+            if issue_iid in self.pending_updates:
+                mutation = combine_updates(self.pending_updates[issue_iid], mutation)
+            self.pending_updates[issue_iid] = mutation
+            self.updates += 1
+            return None, None
+
+        return None, ValueError("Unsupported Operation: {}".format(mutation.operation))
+
+    def flush(self) -> Dict[int, Tuple[Mutation, Optional[Exception]]]:
+        """Apply the combined update of each issue to the live board.
+
+        Returns:
+            Dict[int, Tuple[Mutation, Exception]]: issue iid => (combined update, error)
+
+        """
+        results = OrderedDict()
+        while len(self.pending_updates) != 0:
+            issue_iid, mutation = self.pending_updates.popitem(last=False)
+            _, error = self.board.apply_mutation(mutation)
+            results[issue_iid] = (mutation, error)
+        return results
+
+
+def combine_updates(first: Mutation, second: Mutation) -> Mutation:
+    """Combine two updates of an issue into one with the same effect as applying both in order.
+
+    Args:
+        first (Mutation): The earlier update.
+        second (Mutation): The later update.
+
+    Returns:
+        Mutation
+
+    """
+    arguments = dict(first.arguments)
+    add_labels = list(arguments.pop("add_labels", None) or [])
+    remove_labels = list(arguments.pop("remove_labels", None) or [])
+    for (key, value) in second.arguments.items():
+        if key not in ("add_labels", "remove_labels"):
+            arguments[key] = value
+    if second.arguments.get("labels") is not None:
+        add_labels, remove_labels = [], []
+
+    second_add_labels = second.arguments.get("add_labels") or []
+    second_remove_labels = second.arguments.get("remove_labels") or []
+    if arguments.get("labels") is not None:
+        # a full label list absorbs the deltas
+        labels = [label for label in arguments["labels"] if label not in second_remove_labels]
+        arguments["labels"] = labels + [label for label in second_add_labels if label not in labels]
+    else:
+        add_labels = [label for label in add_labels if label not in second_remove_labels]
+        add_labels += [label for label in second_add_labels if label not in add_labels]
+        remove_labels += [label for label in second_remove_labels if label not in remove_labels]
+        remove_labels = [label for label in remove_labels if label not in add_labels]
+        if len(add_labels) != 0:
+            arguments["add_labels"] = add_labels
+        if len(remove_labels) != 0:
+            arguments["remove_labels"] = remove_labels
+
+    return Mutation(first.operation, arguments, second.error_message, first.parkable and second.parkable)
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[index:index + 3] for index in range(len(text) - 2)}
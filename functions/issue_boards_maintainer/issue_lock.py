@@ -0,0 +1,247 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List
+
+from metrics import put_metric
+from tracing import start_span
+
+# a lease outlives a crashed holder by at most this many seconds, a live holder renews it
+lock_ttl_seconds = float(os.environ.get("LOCK_TTL_SECONDS", "15"))
+lock_renew_seconds = float(os.environ.get("LOCK_RENEW_SECONDS", str(lock_ttl_seconds / 3)))
+lock_wait_seconds = float(os.environ.get("LOCK_WAIT_SECONDS", "5"))
+lock_poll_seconds = float(os.environ.get("LOCK_POLL_SECONDS", "0.1"))
+
+
+class LockTimeoutError(Exception):
+    def __init__(self, keys: List[str]):
+        super().__init__("Lock Not Acquired: {}".format(", ".join(keys)))
+
+
+class SQLiteLeaseStore:
+    """Leases stored in a local SQLite file, used for tests and local runs."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, "
+                "owner TEXT NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO leases VALUES (?, ?, ?)", (key, owner, now + ttl)
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?", (time.time() + ttl, key, owner)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, key: str, owner: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+
+class DynamoDBLeaseStore:
+    """Leases stored in a DynamoDB table keyed by key, taken with a conditional put.
+
+    expires_at is also the TTL attribute of the table, so DynamoDB removes abandoned leases.
+
+    """
+
+    def __init__(self, table_name: str):
+        import boto3
+
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        from botocore.exceptions import ClientError
+
+        now = time.time()
+        try:
+            self.table.put_item(
+                Item={
+                    "key": key,
+                    "owner": owner,
+                    "expires_at": int(now + ttl) + 1
+                },
+                ConditionExpression="attribute_not_exists(#key) OR expires_at <= :now",
+                ExpressionAttributeNames={"#key": "key"},
+                ExpressionAttributeValues={":now": int(now)}
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.table.update_item(
+                Key={"key": key},
+                UpdateExpression="SET expires_at = :expires_at",
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={
+                    ":owner": owner,
+                    ":expires_at": int(time.time() + ttl) + 1
+                }
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def release(self, key: str, owner: str) -> None:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.table.delete_item(
+                Key={"key": key},
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":owner": owner}
+            )
+        except ClientError as e:
+            # the lease expired and was taken by another invocation
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+
+lease_store = None
+
+
+def get_lease_store():
+    """Return the lease store of the environment.
+
+    LOCK_TABLE selects the DynamoDB table, otherwise a SQLite file at LOCK_SQLITE_PATH is used.
+
+    Returns:
+        SQLiteLeaseStore or DynamoDBLeaseStore
+
+    """
+    global lease_store
+    if lease_store is None:
+        table_name = os.environ.get("LOCK_TABLE")
+        if table_name:
+            lease_store = DynamoDBLeaseStore(table_name)
+        else:
+            lease_store = SQLiteLeaseStore(os.environ.get("LOCK_SQLITE_PATH", "/tmp/locks.sqlite3"))
+    return lease_store
+
+
+class LeaseRenewer(threading.Thread):
+    """Renew held leases every LOCK_RENEW_SECONDS until stopped, so a lease never expires while
+    its holder is still working, however long its GitLab calls take.
+
+    Args:
+        store (SQLiteLeaseStore or DynamoDBLeaseStore): The lease store.
+        keys (List[str]): The keys of the held leases.
+        owner (str): The owner of the leases.
+
+    """
+
+    def __init__(self, store, keys: List[str], owner: str):
+        super().__init__(daemon=True)
+        self.store = store
+        self.keys = keys
+        self.owner = owner
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(lock_renew_seconds):
+            for key in self.keys:
+                try:
+                    if not self.store.renew(key, self.owner, lock_ttl_seconds):
+                        print("Lock Lost: {}".format(key))
+                        put_metric("LockLost", 1)
+                except Exception as e:
+                    print(e)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+@contextmanager
+def issue_lock(keys: List[str]):
+    """Hold the leases of keys for the body of a with statement.
+
+    Keys are taken in sorted order. An invocation finding a lease taken polls for it for up to
+    LOCK_WAIT_SECONDS, so it plans its event after the holder has created the issue and finds it.
+    Held leases are renewed in the background and expire after LOCK_TTL_SECONDS only if their
+    holder stops, eg. crashes.
+
+    Args:
+        keys (List[str]): The keys to lock, nothing is locked if empty.
+
+    Yields:
+        bool: False if a lease could not be taken in time.
+
+    """
+    if len(keys) == 0:
+        yield True
+        return
+
+    keys = sorted(set(keys))
+    owner = uuid.uuid4().hex
+    held = []
+    acquired = False
+    with start_span("issue lock", {"lock.key": ",".join(keys)}) as span:
+        started_at = time.monotonic()
+        contended = False
+        try:
+            store = get_lease_store()
+            for key in keys:
+                acquired = store.acquire(key, owner, lock_ttl_seconds)
+                contended = contended or not acquired
+                while not acquired and time.monotonic() - started_at < lock_wait_seconds:
+                    time.sleep(lock_poll_seconds)
+                    acquired = store.acquire(key, owner, lock_ttl_seconds)
+                if not acquired:
+                    break
+                held.append(key)
+        except Exception as e:
+            # the lock is a safeguard, an unavailable store should not stop the event
+            print(e)
+            span.set_error(e)
+            contended = None
+
+        waited = time.monotonic() - started_at
+        span.set_attribute("lock.contended", contended)
+        span.set_attribute("lock.acquired", acquired)
+        if contended:
+            span.set_attribute("lock.wait_ms", waited * 1000)
+            put_metric("LockContention", 1)
+            put_metric("LockWait", waited * 1000, "Milliseconds")
+
+    renewer = None
+    if acquired:
+        renewer = LeaseRenewer(store, held, owner)
+        renewer.start()
+    try:
+        yield acquired or contended is None
+    finally:
+        if renewer is not None:
+            renewer.stop()
+        for key in held:
+            try:
+                store.release(key, owner)
+            except Exception as e:
+                print(e)
@@ -0,0 +1,587 @@
+import re
+import json
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Callable,
+    Match,
+    Optional,
+    Generator
+)
+
+from gitlab_enum import (
+    MRAction,
+    Project,
+    IssueLabel,
+    IssueState,
+    GitlabEvent
+)
+from gitlab_lib import (
+    is_dev_branch,
+    is_master_branch,
+    is_staging_branch,
+    is_cherry_pick_branch,
+    error_response_body,
+    stage_transition,
+    response_message_body,
+    get_id_from_text_description,
+    get_ids_from_url_description
+)
+from tracing import start_span
+from budget_planner import (
+    BudgetExhaustedError,
+    split_to_budget
+)
+
+branch_regex = re.compile("^(.+/)*(kitty)/(feature|bugfix|change)/(.+)$")
+
+
+def match_branch(branch_name: str) -> Optional[Match]:
+    """Match a branch name against branch_regex, as a span of the trace.
+
+    Args:
+        branch_name (str): The name of the branch.
+
+    Returns:
+        Match: None if the branch is not a feature branch.
+
+    """
+    with start_span("parse branch_regex", {"gitlab.branch_size": len(branch_name or "")}) as span:
+        branch_match = branch_regex.match(branch_name)
+        span.set_attribute("parse.matched", branch_match is not None)
+        return branch_match
+
+
+def issue_creation_keys(gitlab_event: str, body_json: Dict) -> List[str]:
+    """Return the lock keys of the issues an event may search for and create.
+
+    Pushes, opens and merges of a feature branch search for the issue of the branch and create it
+    if none is found, and merges to a topic branch do the same for the EPIC issue of the topic
+    branch, so concurrent events creating the same issue are serialized on these keys.
+
+    Args:
+        gitlab_event (str): The X-Gitlab-Event header.
+        body_json (Dict): The webhook body.
+
+    Returns:
+        List[str]: Empty if the event never creates an issue.
+
+    """
+    project_id = body_json.get("project", {}).get("id")
+    if project_id not in Project.value_list():
+        return []
+
+    keys = []
+    if gitlab_event == GitlabEvent.PUSH_HOOK.value:
+        branch_name = body_json.get("ref")
+    else:
+        mr_attribute = body_json.get("object_attributes", {})
+        if mr_attribute.get("action") not in (MRAction.OPEN.value, MRAction.MERGE.value):
+            return []
+        branch_name = mr_attribute.get("source_branch")
+        target_branch = mr_attribute.get("target_branch") or ""
+        if (mr_attribute.get("action") == MRAction.MERGE.value and not is_dev_branch(target_branch)
+                and not is_staging_branch(target_branch) and not is_master_branch(target_branch)):
+            keys.append("epic:{}:{}".format(project_id, target_branch))
+
+    branch_match = branch_regex.match(branch_name or "")
+    if branch_match is not None:
+        (_, _, category, title) = branch_match.groups()
+        keys.append("issue:{}:{}:{}".format(project_id, category, title))
+    return keys
+
+
+class Mutation:
+    """An intended GitLab mutation, named after the gitlab_apis function performing it.
+
+    Args:
+        operation (str): "create_project_issue" or "update_project_issue".
+        arguments (Dict): The keyword arguments of the call.
+        error_message (str): The message of the error response if the mutation fails.
+        parkable (bool, optional): True if a failure should be parked for retry instead of failing the event.
+        deferred (bool, optional): True if a parkable mutation is over the call budget of the event,
+            and should be parked for a later invocation without being performed.
+
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        arguments: Dict,
+        error_message: str,
+        parkable: bool = False,
+        deferred: bool = False
+    ):
+        self.operation = operation
+        self.arguments = arguments
+        self.error_message = error_message
+        self.parkable = parkable
+        self.deferred = deferred
+
+    def to_dict(self) -> Dict:
+        return {
+            "operation": self.operation,
+            "arguments": self.arguments
+        }
+
+
+# planner protocol: yields mutations, is sent (result, error) of each, returns the response
+Plan = Generator[Mutation, Tuple[Any, Optional[Exception]], Dict]
+
+
+def create_issue(
+    labels: List[str],
+    title: str,
+    description: Optional[str] = None,
+    milestone_id: Optional[int] = None,
+    error_message: str = "Create Issue Error"
+) -> Mutation:
+    arguments = {
+        "project_id": Project.PROJECT_A.value,
+        "labels": labels,
+        "title": title
+    }
+    if description is not None:
+        arguments["description"] = description
+    if milestone_id is not None:
+        arguments["milestone_id"] = milestone_id
+    return Mutation("create_project_issue", arguments, error_message)
+
+
+def update_issue(
+    issue_iid: int,
+    error_message: str,
+    parkable: bool = False,
+    deferred: bool = False,
+    **arguments
+) -> Mutation:
+    arguments = {key: value for (key, value) in arguments.items() if value is not None}
+    arguments["project_id"] = Project.PROJECT_A.value
+    arguments["issue_iid"] = issue_iid
+    return Mutation("update_project_issue", arguments, error_message, parkable, deferred)
+
+
+def plan_event(
+    gitlab_event: str,
+    body_json: Dict,
+    board,
+    call_budget: Optional[int] = None
+) -> Plan:
+    """Decide the GitLab mutations of a webhook event, without performing any of them.
+
+    Reads go through the board, a live GitLab board in the lambda function or an in-memory
+    board in a dry run. Each mutation is yielded to the caller, which performs or simulates it
+    and sends back (result, error).
+
+    Args:
+        gitlab_event (str): The X-Gitlab-Event header.
+        body_json (Dict): The webhook body.
+        board: The board to read issues, milestones and merge requests from.
+        call_budget (int, optional): The GitLab calls the updates of a promotion may take,
+            the updates over it are deferred. Unbounded if None.
+
+    Returns:
+        Dict: The response of the event.
+
+    """
+    # check project_id in body
+    project_id = body_json.get("project", {}).get("id")
+    if project_id not in Project.value_list():
+        return response_message_body(406, {
+            "message": "Unsupported Project"
+        })
+
+    # parse project_id to labels
+    project_label = IssueLabel[Project(project_id).name].value
+
+    # triggered when someone push to the repository
+    if gitlab_event == GitlabEvent.PUSH_HOOK.value:
+        # push without commit
+        if body_json.get("total_commits_count") == 0:
+            return response_message_body(200, {
+                "message": "Push to a Branch with no Commit"
+            })
+
+        branch_name = body_json.get("ref")
+
+        # only create issues for feature branch
+        try:
+            (_, _, category, title) = match_branch(branch_name).groups()
+        except Exception:
+            return response_message_body(200, {
+                "message": "No Need to Create an Issue"
+            })
+
+        issues, error = board.search_issues([project_label, category], title)
+        if error is not None:
+            return error_response_body("Search Issue Error", error)
+
+        # branch with more than 1 issue
+        if len(issues) > 1:
+            return response_message_body(500, {
+                "message": "Multiple Issues"
+            })
+
+        # already created an issue, update label and state
+        if len(issues) == 1:
+            return response_message_body(200, {
+                "message": "Issue Has Been Created"
+            })
+
+        # has not created any issue
+        # assignee_id = body_json.get("user_id")
+        yield create_issue([project_label, category, IssueLabel.DOING.value], title)
+        return response_message_body(200, {
+            "message": "Create Issue Successfully"
+        })
+
+    # triggered when a new merge request is created/updated/merged/closed
+    mr_attribute = body_json.get("object_attributes", {})
+    mr_action = mr_attribute.get("action")
+    # assignee_id = mr_attribute.get("author_id")
+
+    # check MR state
+    if mr_action not in MRAction.value_list():
+        return response_message_body(200, {
+            "message": "Unsupported MR Action"
+        })
+
+    source_branch = mr_attribute.get("source_branch")
+    target_branch = mr_attribute.get("target_branch")
+    mr_url = mr_attribute.get("url")
+
+    milestone_id = None
+    if is_master_branch(target_branch) or mr_action == MRAction.CLOSE.value:
+        milestone_id, _ = board.active_milestone_id()
+
+    # open a MR
+    if mr_action == MRAction.OPEN.value:
+        """
+        source branch: feature branch
+        target branch: dev, topic branch
+        => add MR label to the issue
+        """
+        source_branch_match = match_branch(source_branch)
+        if source_branch_match is None or is_staging_branch(target_branch) or is_master_branch(target_branch):
+            return response_message_body(200, {
+                "message": "No Need to Update the Issue"
+            })
+
+        (_, _, category, title) = source_branch_match.groups()
+        issues, error = board.search_issues([project_label, category], title)
+        if error is not None:
+            return error_response_body("Search Issue Error", error)
+
+        description = "Related MR URL: {}".format(mr_url)
+        if len(issues) == 0:
+            yield create_issue([project_label, category, IssueLabel.MR_REVIEW.value], title, description)
+            return response_message_body(200, {
+                "message": "Create Issue Successfully"
+            })
+
+        add_labels, remove_labels = stage_transition(IssueLabel.MR_REVIEW.value, [project_label, category])
+        yield update_issue(issues[0].get("iid"), "Update Issue Error",
+                           description=description,
+                           add_labels=add_labels,
+                           remove_labels=remove_labels)
+        return response_message_body(200, {
+            "message": "Update Issue Successfully"
+        })
+
+    # merge a MR
+    elif mr_action == MRAction.MERGE.value:
+        """
+        source branch: feature branch
+        target branch: topic branch
+        => create a topic issue and close the feature issue
+        """
+        if not is_dev_branch(target_branch) and not is_staging_branch(target_branch) and not is_master_branch(target_branch):
+            try:
+                (_, _, category, title) = match_branch(source_branch).groups()
+            except Exception:
+                return response_message_body(200, {
+                    "message": "No Need to Create an Issue"
+                })
+
+            issues, error = board.search_issues([project_label, category], title)
+            if error is not None:
+                return error_response_body("Search Issue Error", error)
+
+            topic_issues, error = board.search_issues([project_label, IssueLabel.EPIC.value], target_branch)
+            if error is not None:
+                return error_response_body("Search Topic Issue Error", error)
+
+            try:
+                new_topic_description = "Related Issue URL: {}".format(issues[0].get("web_url"))
+            except Exception:
+                new_topic_description = ""
+
+            if len(topic_issues) == 0:
+                topic_issue, _ = yield create_issue([project_label, IssueLabel.EPIC.value, IssueLabel.MR_REVIEW.value],
+                                                    target_branch,
+                                                    new_topic_description,
+                                                    error_message="Create Topic Issue Error")
+                topic_issues.append(topic_issue)
+            else:
+                topic_description = topic_issues[0].get("description") + "\n\n" + new_topic_description
+                yield update_issue(topic_issues[0].get("iid"), "Update Topic Issue Error",
+                                   description=topic_description)
+
+            if len(issues) != 0:
+                issue_description = issues[0].get("description") + "\n\nRelated Issue URL: {}".format(topic_issues[0].get("web_url"))
+                add_labels, remove_labels = stage_transition(None, [project_label, category])
+                yield update_issue(issues[0].get("iid"), "Close Issue Error",
+                                   description=issue_description,
+                                   state_event=IssueState.CLOSE.value,
+                                   add_labels=add_labels,
+                                   remove_labels=remove_labels)
+            return response_message_body(200, {
+                "message": "Create/Update/Close Issue Successfully"
+            })
+
+        # ready for merging to dev/staging/master
+        target_branch_label = None
+        if is_dev_branch(target_branch):
+            target_branch_label = IssueLabel.DEV.value
+        elif is_staging_branch(target_branch):
+            target_branch_label = IssueLabel.STAGING.value
+        elif is_master_branch(target_branch):
+            target_branch_label = IssueLabel.PRODUCTION.value
+
+        """
+        source branch: cherry-pick-xxxxxxxx
+        target branch: dev/staging/master
+        description: xxx\n\nSee merge request xxx/xxx/xxx!30\n\n(cherry picked from commit 79b5be87)\n\nxxx
+        => get mr_id from mr description
+        => get original source branch by mr_id
+        => add target_branch_label and milestone to the issue
+        """
+        if is_cherry_pick_branch(source_branch) and target_branch_label is not None:
+            mr_id = get_id_from_text_description(mr_attribute.get("description"))
+            if mr_id is None:
+                return response_message_body(400, {
+                    "message": "Cannot Find Original MR Id From MR Description"
+                })
+            original_source_branch, error = board.merge_request_source_branch(project_id, mr_id)
+            if error is not None:
+                return error_response_body("Search MR Error", error)
+            if original_source_branch is None:
+                return response_message_body(400, {
+                    "message": "Cannot Find Related MR"
+                })
+
+            original_source_branch_match = match_branch(original_source_branch)
+            if original_source_branch_match is not None:
+                (_, _, category, title) = original_source_branch_match.groups()
+                issues, error = board.search_issues([project_label, category], title)
+                if error is not None:
+                    return error_response_body("Search Issue Error", error)
+                if len(issues) == 0:
+                    yield create_issue([project_label, category, target_branch_label], title, None, milestone_id)
+                    return response_message_body(200, {
+                        "message": "Create Issue Successfully"
+                    })
+                add_labels, remove_labels = stage_transition(target_branch_label, [project_label, category])
+                yield update_issue(issues[0].get("iid"), "Update Issue Error",
+                                   milestone_id=milestone_id,
+                                   add_labels=add_labels,
+                                   remove_labels=remove_labels)
+                return response_message_body(200, {
+                    "message": "Update Issue Successfully"
+                })
+
+            topic_issues, error = board.search_issues([project_label, IssueLabel.EPIC.value], original_source_branch)
+            if error is not None:
+                return error_response_body("Search Topic Issue Error", error)
+            if len(topic_issues) == 0:
+                return response_message_body(200, {
+                    "message": "No Need to Create a Topic Issue"
+                })
+            add_labels, remove_labels = stage_transition(target_branch_label, [project_label, IssueLabel.EPIC.value])
+            yield update_issue(topic_issues[0].get("iid"), "Update Topic Issue Error",
+                               milestone_id=milestone_id,
+                               add_labels=add_labels,
+                               remove_labels=remove_labels)
+            return response_message_body(200, {
+                "message": "Update Topic Issue Successfully"
+            })
+
+        """
+        source branch: feature branch/ topic branch
+        target branch: dev/staging/master
+        => add target_branch_label and milestone to the issue
+        """
+        if not is_dev_branch(source_branch) and not is_staging_branch(source_branch) and not is_master_branch(source_branch) and target_branch_label is not None:
+            source_branch_match = match_branch(source_branch)
+            if source_branch_match is not None:
+                (_, _, category, title) = source_branch_match.groups()
+                issues, error = board.search_issues([project_label, category], title)
+                if error is not None:
+                    return error_response_body("Search Issue Error", error)
+                if len(issues) == 0:
+                    yield create_issue([project_label, category, target_branch_label], title, None, milestone_id)
+                    return response_message_body(200, {
+                        "message": "Create Issue Successfully"
+                    })
+                add_labels, remove_labels = stage_transition(target_branch_label, [project_label, category])
+                yield update_issue(issues[0].get("iid"), "Update Issue Error",
+                                   milestone_id=milestone_id,
+                                   add_labels=add_labels,
+                                   remove_labels=remove_labels)
+                return response_message_body(200, {
+                    "message": "Update Issue Successfully"
+                })
+
+            topic_issues, error = board.search_issues([project_label, IssueLabel.EPIC.value], source_branch)
+            if error is not None:
+                return error_response_body("Search Topic Issue Error", error)
+            if len(topic_issues) == 0:
+                return response_message_body(200, {
+                    "message": "No Need to Create a Topic Issue"
+                })
+
+            if milestone_id is not None:
+                related_issue_iids = get_ids_from_url_description(topic_issues[0].get("description", ""))
+                for related_issue_iid in related_issue_iids:
+                    yield update_issue(related_issue_iid, "Close Related Issue Error", True,
+                                       state_event=IssueState.CLOSE.value,
+                                       milestone_id=milestone_id)
+
+            add_labels, remove_labels = stage_transition(target_branch_label, [project_label, IssueLabel.EPIC.value])
+            yield update_issue(topic_issues[0].get("iid"), "Update Topic Issue Error",
+                               milestone_id=milestone_id,
+                               add_labels=add_labels,
+                               remove_labels=remove_labels)
+            return response_message_body(200, {
+                "message": "Update Topic Issue Successfully"
+            })
+
+        """
+        source branch: staging
+        target branch: master
+        => add label(Production) and milestone to all issues in staging
+        """
+        if is_staging_branch(source_branch) and is_master_branch(target_branch):
+            issues, error = board.search_issues([project_label, IssueLabel.STAGING.value])
+            if error is not None:
+                return error_response_body("Search Issue Error", error)
+
+            if len(issues) == 0:
+                return response_message_body(200, {
+                    "message": "No Need to Move Issues from Staging to Production"
+                })
+
+            # one call per issue, and per related issue of a topic issue
+            related_issue_iids = [get_ids_from_url_description(issue.get("description", ""))
+                                  if IssueLabel.EPIC.value in issue.get("labels", []) else []
+                                  for issue in issues]
+            costs = [1 + len(iids) for iids in related_issue_iids]
+            chunk_size = split_to_budget(costs, call_budget)
+
+            for (index, issue) in enumerate(issues):
+                deferred = index >= chunk_size
+                yield update_issue(issue.get("iid"), "Update Staging Issues Error", True, deferred,
+                                   milestone_id=milestone_id,
+                                   add_labels=[target_branch_label],
+                                   remove_labels=[IssueLabel.STAGING.value])
+
+                # topic issue:
+                for related_issue_iid in related_issue_iids[index]:
+                    yield update_issue(related_issue_iid, "Update Staging Issues Error", True, deferred,
+                                       milestone_id=milestone_id)
+
+            body = {
+                "message": "Move Issues from Staging to Production Successfully"
+            }
+            if chunk_size < len(issues):
+                body["estimated_calls"] = sum(costs)
+                body["deferred_issues"] = len(issues) - chunk_size
+            return response_message_body(200, body)
+
+        return response_message_body(406, {
+            "message": "Unsupported MR"
+        })
+
+    # close a MR => close the issue
+    issues, error = board.search_issues(None, mr_url)
+    if error is not None:
+        return error_response_body("Search Issue Error", error)
+
+    if len(issues) == 0:
+        return response_message_body(200, {
+            "message": "No Need to Close a Issue"
+        })
+
+    yield update_issue(issues[0].get("iid"), "Close Issue Error",
+                       state_event=IssueState.CLOSE.value,
+                       milestone_id=milestone_id)
+    return response_message_body(200, {
+        "message": "Close Issue Successfully"
+    })
+
+
+def run_plan(
+    plan: Plan,
+    apply_mutation: Callable[[Mutation], Tuple[Any, Optional[Exception]]],
+    park_mutation: Optional[Callable[[Mutation, Exception], Tuple[Optional[str], Optional[Exception]]]] = None
+) -> Tuple[Dict, List[Mutation]]:
+    """Drive a plan, applying each of its mutations in order.
+
+    A failed mutation ends the event with its error response, unless it is parkable and
+    park_mutation stores it for retry. Parkable failures that cannot be parked fail the event
+    after the remaining mutations have been applied. Deferred mutations are parked without
+    being performed.
+
+    Args:
+        plan (Plan): The plan of an event.
+        apply_mutation (Callable): Perform a mutation, returning (result, error).
+        park_mutation (Callable, optional): Store a failed mutation for retry, returning (item id, error).
+
+    Returns:
+        Tuple[Dict, List[Mutation]]: (response, mutations applied or attempted)
+
+    """
+    mutations = []
+    error_list = []
+    error_message = None
+    retry_item_ids = []
+    sent = None
+    while True:
+        try:
+            mutation = plan.send(sent)
+        except StopIteration as stop:
+            response = stop.value
+            break
+
+        mutations.append(mutation)
+        if mutation.deferred and mutation.parkable and park_mutation is not None:
+            result, error = None, BudgetExhaustedError()
+        else:
+            result, error = apply_mutation(mutation)
+        if error is not None and not mutation.parkable:
+            plan.close()
+            return error_response_body(mutation.error_message, error), mutations
+        if error is not None:
+            item_id, park_error = (None, error)
+            if park_mutation is not None:
+                item_id, park_error = park_mutation(mutation, error)
+            if park_error is not None:
+                error_list.append(str(error))
+                error_message = mutation.error_message
+            else:
+                retry_item_ids.append(item_id)
+        sent = (result, error)
+
+    if len(error_list) > 0:
+        return response_message_body(500, {
+            "message": error_message,
+            "error": str(error_list)
+        }), mutations
+    if len(retry_item_ids) > 0:
+        body = json.loads(response.get("body", "{}"))
+        body["retry_items"] = retry_item_ids
+        return response_message_body(202, body), mutations
+    return response, mutations
+
@@ -1,39 +1,96 @@
 import os
-import re
 import json
-
-from gitlab_apis import (
-    create_project_issue,
-    update_project_issue,
-    search_project_issues,
-    search_project_milestones,
-    search_project_merge_requests
+import time
+from typing import (
+    Dict,
+    Tuple,
+    Optional
 )
+
 from gitlab_enum import (
-    MRAction,
     Project,
-    IssueLabel,
-    IssueState,
     GitlabEvent
 )
 from gitlab_lib import (
-    is_dev_branch,
-    is_master_branch,
-    is_staging_branch,
-    is_cherry_pick_branch,
-    response_message_body,
-    get_id_from_text_description,
-    get_ids_from_url_description
+    error_response_body,
+    response_message_body
+)
+from retry_queue import park_failed_call
+from gitlab_payload import parse_webhook_body
+from issue_board import GitLabBoard
+from issue_planner import (
+    Mutation,
+    run_plan,
+    plan_event,
+    issue_creation_keys
+)
+from issue_lock import (
+    LockTimeoutError,
+    issue_lock
+)
+from board_snapshot import (
+    BoardSnapshot,
+    get_board_snapshot_store
 )
+from profiling import sampled_profiling
+from budget_planner import CallBudget
+from metrics import put_metric
+from priority_lanes import (
+    should_defer,
+    classify_event,
+    defer_webhook_event
+)
+from tracing import (
+    start_span,
+    span_kind_server
+)
+
+board_snapshot_store = get_board_snapshot_store()
+board_snapshot = BoardSnapshot(board_snapshot_store) if board_snapshot_store is not None else None
+gitlab_board = GitLabBoard(board_snapshot)
+
 
+def park_mutation(
+    mutation: Mutation,
+    error: Exception
+) -> Tuple[Optional[str], Optional[Exception]]:
+    return park_failed_call(mutation.operation, mutation.arguments, error)
 
+
+@sampled_profiling
 def issue_boards_maintainer(event, context):
-    headers = event.get("headers", {})
+    headers = event.get("headers") or {}
+    attributes = {
+        "faas.invocation_id": getattr(context, "aws_request_id", None),
+        "gitlab.event": headers.get("X-Gitlab-Event")
+    }
+    with start_span("issue_boards_maintainer", attributes, span_kind_server, headers.get("traceparent")) as span:
+        response = handle_webhook(event, context, span)
+        if span.is_recording():
+            # the response message names the route the event took
+            span.set_attribute("http.status_code", response.get("statusCode"))
+            span.set_attribute("handler.route", json.loads(response.get("body", "{}")).get("message"))
+            if response.get("statusCode") >= 500:
+                span.set_error(response.get("body"))
+        return response
+
+
+def read_webhook(event) -> Tuple[Optional[str], Optional[Dict], Optional[Dict]]:
+    """Check the headers of a webhook event and pre-parse its body.
+
+    Args:
+        event (Dict): The lambda event.
+
+    Returns:
+        Tuple[str, Dict, Dict]: (gitlab event, body, None) or (None, None, error response)
+
+    """
+    headers = event.get("headers") or {}
 
     # check secret_token in headers
     secret_token = headers.get("X-Gitlab-Token")
     if secret_token != os.environ.get("SECRET_TOKEN"):
-        return response_message_body(403, {
+        return None, None, response_message_body(403, {
             "detailed message": "Invalid Secret Token"
         })
 
@@ -41,512 +98,98 @@ def issue_boards_maintainer(event, context):
     gitlab_event = headers.get("X-Gitlab-Event")
     body = event.get("body")
     if body is None or gitlab_event is None:
-        return response_message_body(400, {
+        return None, None, response_message_body(400, {
             "message": "Invalid Request Body or Header"
         })
 
     if gitlab_event not in GitlabEvent.value_list():
-        return response_message_body(406, {
+        return None, None, response_message_body(406, {
             "message": "Unsupported GitLab Event"
         })
 
-    # check project_id in body
-    body_json = json.loads(body)
-    project_id = body_json.get("project", {}).get("id")
-    if project_id not in Project.value_list():
-        return response_message_body(406, {
-            "message": "Unsupported Project"
+    # pre-parse only the fields needed for routing, the commits of a push are never built
+    try:
+        body_json = parse_webhook_body(gitlab_event, body)
+    except ValueError:
+        return None, None, response_message_body(400, {
+            "message": "Invalid Request Body or Header"
         })
+    return gitlab_event, body_json, None
 
-    # parse project_id to labels
-    project_label = IssueLabel[Project(project_id).name].value
-    branch_regex = re.compile("^(.+/)*(kitty)/(feature|bugfix|change)/(.+)$")
-
-    # triggered when someone push to the repository
-    if gitlab_event == GitlabEvent.PUSH_HOOK.value:
-        # push without commit
-        if body_json.get("total_commits_count") == 0:
-            return response_message_body(200, {
-                "message": "Push to a Branch with no Commit"
-            })
-
-        branch_name = body_json.get("ref")
-
-        # only create issues for feature branch
-        try:
-            (_, _, category, title) = branch_regex.match(branch_name).groups()
-        except Exception:
-            return response_message_body(200, {
-                "message": "No Need to Create an Issue"
-            })
-
-        issues, error = search_project_issues(Project.PROJECT_A.value,
-                                              [project_label, category],
-                                              title)
-        if error is not None:
-            return response_message_body(500, {
-                "message": "Search Issue Error",
-                "error": str(error)
-            })
-
-        # branch with more than 1 issue
-        if len(issues) > 1:
-            return response_message_body(500, {
-                "message": "Multiple Issues"
-            })
 
-        # already created an issue, update label and state
-        if len(issues) == 1:
-            return response_message_body(200, {
-                "message": "Issue Has Been Created"
-            })
-
-        # has not created any issue
-        # assignee_id = body_json.get("user_id")
-        _, error = create_project_issue(Project.PROJECT_A.value,
-                                        None,
-                                        [project_label, category, IssueLabel.DOING.value],
-                                        title)
+def remember_merge_request(gitlab_event: str, body_json: Dict, board, span) -> None:
+    """Remember the source branch of a MR, it never changes and is needed by later cherry-picks of the MR."""
+    project_id = body_json.get("project", {}).get("id")
+    span.set_attribute("gitlab.project_id", project_id)
+    if gitlab_event == GitlabEvent.MERGE_REQUEST_HOOK.value:
+        span.set_attribute("gitlab.mr_action", body_json.get("object_attributes", {}).get("action"))
+    if gitlab_event == GitlabEvent.MERGE_REQUEST_HOOK.value and project_id in Project.value_list():
+        mr_attribute = body_json.get("object_attributes", {})
+        error = board.remember_merge_request(project_id,
+                                             mr_attribute.get("iid"),
+                                             mr_attribute.get("source_branch"))
         if error is not None:
-            return response_message_body(500, {
-                "message": "Create Issue Error",
-                "error": str(error)
+            print(error)
+
+
+def handle_webhook(event, context, span):
+    started_at = time.perf_counter()
+    gitlab_event, body_json, error_response = read_webhook(event)
+    if error_response is not None:
+        return error_response
+
+    lane = classify_event(gitlab_event, body_json)
+    span.set_attribute("handler.lane", lane)
+    response = handle_lane_event(gitlab_event, body_json, lane, span, CallBudget(context).calls_left())
+    put_metric("LaneLatency", (time.perf_counter() - started_at) * 1000, "Milliseconds", {"Lane": lane})
+    return response
+
+
+def handle_lane_event(
+    gitlab_event: str,
+    body_json: Dict,
+    lane: str,
+    span,
+    call_budget: Optional[int] = None
+) -> Dict:
+    # keep the rest of the rate limit window for promotions and merges
+    if should_defer(lane, body_json):
+        item_id, error = defer_webhook_event(gitlab_event, body_json)
+        if error is None:
+            put_metric("LaneDeferred", 1, dimensions={"Lane": lane})
+            return response_message_body(202, {
+                "message": "Event Deferred",
+                "retry_items": [item_id]
             })
+        print(error)
 
-        return response_message_body(200, {
-            "message": "Create Issue Successfully"
-        })
+    remember_merge_request(gitlab_event, body_json, gitlab_board, span)
 
-    # triggered when a new merge request is created/updated/merged/closed
-    mr_attribute = body_json.get("object_attributes", {})
-    mr_action = mr_attribute.get("action")
-    # assignee_id = mr_attribute.get("author_id")
-
-    # check MR state
-    if mr_action not in MRAction.value_list():
-        return response_message_body(200, {
-            "message": "Unsupported MR Action"
-        })
-
-    source_branch = mr_attribute.get("source_branch")
-    target_branch = mr_attribute.get("target_branch")
-    mr_url = mr_attribute.get("url")
-
-    milestone_id = None
-    if is_master_branch(target_branch) or mr_action == MRAction.CLOSE.value:
-        milestones, error = search_project_milestones(Project.PROJECT_A.value)
+    if board_snapshot is not None:
+        error = board_snapshot.refresh()
         if error is not None:
-            pass
-        elif len(milestones) != 0:
-            milestone_id = milestones[0].get("id")
-
-    # open a MR
-    if mr_action == MRAction.OPEN.value:
-        """
-        source branch: feature branch
-        target branch: dev, topic branch
-        => add MR label to the issue
-        """
-        source_branch_match = branch_regex.match(source_branch)
-        if source_branch_match is None or is_staging_branch(target_branch) or is_master_branch(target_branch):
-            return response_message_body(200, {
-                "message": "No Need to Update the Issue"
-            })
-
-        (_, _, category, title) = source_branch_match.groups()
-        issues, error = search_project_issues(Project.PROJECT_A.value,
-                                              [project_label, category],
-                                              title)
+            print(error)
+
+    # only one invocation at a time searches for and creates the issue of a branch or the EPIC of a topic
+    lock_keys = issue_creation_keys(gitlab_event, body_json)
+    with issue_lock(lock_keys) as locked:
+        if locked:
+            # a promotion over the call budget parks the rest of its updates for the retry drainer
+            response, _ = run_plan(plan_event(gitlab_event, body_json, gitlab_board, call_budget),
+                                   gitlab_board.apply_mutation,
+                                   park_mutation)
+    if not locked:
+        item_id, error = defer_webhook_event(gitlab_event, body_json, LockTimeoutError(lock_keys))
         if error is not None:
-            return response_message_body(500, {
-                "message": "Search Issue Error",
-                "error": str(error)
-            })
-
-        description = "Related MR URL: {}".format(mr_url)
-        if len(issues) == 0:
-            _, error = create_project_issue(Project.PROJECT_A.value,
-                                            None,
-                                            [project_label, category, IssueLabel.MR_REVIEW.value],
-                                            title,
-                                            description)
-            if error is not None:
-                return response_message_body(500, {
-                    "message": "Create Issue Error",
-                    "error": str(error)
-                })
-
-            return response_message_body(200, {
-                "message": "Create Issue Successfully"
-            })
-
-        error = update_project_issue(Project.PROJECT_A.value,
-                                     issues[0].get("iid"),
-                                     [project_label, category, IssueLabel.MR_REVIEW.value],
-                                     description)
-        if error is not None:
-            return response_message_body(500, {
-                "message": "Update Issue Error",
-                "error": str(error)
-            })
-        return response_message_body(200, {
-            "message": "Update Issue Successfully"
+            return error_response_body("Defer Event Error", error)
+        return response_message_body(202, {
+            "message": "Event Deferred",
+            "retry_items": [item_id]
         })
 
-    # merge a MR
-    elif mr_action == MRAction.MERGE.value:
-        """
-        source branch: feature branch
-        target branch: topic branch
-        => create a topic issue and close the feature issue
-        """
-        if not is_dev_branch(target_branch) and not is_staging_branch(target_branch) and not is_master_branch(target_branch):
-            try:
-                (_, _, category, title) = branch_regex.match(source_branch).groups()
-            except Exception:
-                return response_message_body(200, {
-                    "message": "No Need to Create an Issue"
-                })
-
-            issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                  [project_label, category],
-                                                  title)
-            if error is not None:
-                return response_message_body(500, {
-                    "message": "Search Issue Error",
-                    "error": str(error)
-                })
-
-            topic_issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                        [project_label, IssueLabel.EPIC.value],
-                                                        target_branch)
-            if error is not None:
-                return response_message_body(500, {
-                    "message": "Search Topic Issue Error",
-                    "error": str(error)
-                })
-
-            try:
-                new_topic_description = "Related Issue URL: {}".format(issues[0].get("web_url"))
-            except Exception:
-                new_topic_description = ""
-
-            if len(topic_issues) == 0:
-                topic_issue, error = create_project_issue(Project.PROJECT_A.value,
-                                                          None,
-                                                          [project_label, IssueLabel.EPIC.value, IssueLabel.MR_REVIEW.value],
-                                                          target_branch,
-                                                          new_topic_description)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Create Topic Issue Error",
-                        "error": str(error)
-                    })
-                topic_issues.append(topic_issue)
-            else:
-                topic_description = topic_issues[0].get("description") + "\n\n" + new_topic_description
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             topic_issues[0].get("iid"),
-                                             None,
-                                             topic_description)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Update Topic Issue Error",
-                        "error": str(error)
-                    })
-
-            if len(issues) != 0:
-                issue_description = issues[0].get("description") + "\n\nRelated Issue URL: {}".format(topic_issues[0].get("web_url"))
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             issues[0].get("iid"),
-                                             [project_label, category],
-                                             issue_description,
-                                             IssueState.CLOSE.value)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Close Issue Error",
-                        "error": str(error)
-                    })
-            return response_message_body(200, {
-                "message": "Create/Update/Close Issue Successfully"
-            })
-
-        # ready for merging to dev/staging/master
-        target_branch_label = None
-        if is_dev_branch(target_branch):
-            target_branch_label = IssueLabel.DEV.value
-        elif is_staging_branch(target_branch):
-            target_branch_label = IssueLabel.STAGING.value
-        elif is_master_branch(target_branch):
-            target_branch_label = IssueLabel.PRODUCTION.value
-
-        """
-        source branch: cherry-pick-xxxxxxxx
-        target branch: dev/staging/master
-        description: xxx\n\nSee merge request xxx/xxx/xxx!30\n\n(cherry picked from commit 79b5be87)\n\nxxx
-        => get mr_id from mr description
-        => get original source branch by mr_id
-        => add target_branch_label and milestone to the issue
-        """
-        if is_cherry_pick_branch(source_branch) and target_branch_label is not None:
-            mr_id = get_id_from_text_description(mr_attribute.get("description"))
-            if mr_id is None:
-                return response_message_body(400, {
-                    "message": "Cannot Find Original MR Id From MR Description"
-                })
-            mrs, error = search_project_merge_requests(project_id, mr_id)
-            if error is not None:
-                return response_message_body(500, {
-                    "message": "Search MR Error",
-                    "error": str(error)
-                })
-            if len(mrs) == 0:
-                return response_message_body(400, {
-                    "message": "Cannot Find Related MR"
-                })
-
-            original_source_branch = mrs[0].get("source_branch")
-            try:
-                (_, _, category, title) = branch_regex.match(original_source_branch).groups()
-                issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                      [project_label, category],
-                                                      title)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Search Issue Error",
-                        "error": str(error)
-                    })
-                if len(issues) == 0:
-                    _, error = create_project_issue(Project.PROJECT_A.value,
-                                                    None,
-                                                    [project_label, category, target_branch_label],
-                                                    title,
-                                                    None,
-                                                    milestone_id)
-                    if error is not None:
-                        return response_message_body(500, {
-                            "message": "Create Issue Error",
-                            "error": str(error)
-                        })
-                    return response_message_body(200, {
-                        "message": "Create Issue Successfully"
-                    })
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             issues[0].get("iid"),
-                                             [project_label, category, target_branch_label],
-                                             None,
-                                             None,
-                                             milestone_id)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Update Issue Error",
-                        "error": str(error)
-                    })
-                return response_message_body(200, {
-                    "message": "Update Issue Successfully"
-                })
-            except Exception:
-                topic_issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                            [project_label, IssueLabel.EPIC.value],
-                                                            original_source_branch)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Search Topic Issue Error",
-                        "error": str(error)
-                    })
-                if len(topic_issues) == 0:
-                    return response_message_body(200, {
-                        "message": "No Need to Create a Topic Issue"
-                    })
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             topic_issues[0].get("iid"),
-                                             [project_label, IssueLabel.EPIC.value, target_branch_label],
-                                             None,
-                                             None,
-                                             milestone_id)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Update Topic Issue Error",
-                        "error": str(error)
-                    })
-                return response_message_body(200, {
-                    "message": "Update Topic Issue Successfully"
-                })
-
-        """
-        source branch: feature branch/ topic branch
-        target branch: dev/staging/master
-        => add target_branch_label and milestone to the issue
-        """
-        if not is_dev_branch(source_branch) and not is_staging_branch(source_branch) and not is_master_branch(source_branch) and target_branch_label is not None:
-            try:
-                (_, _, category, title) = branch_regex.match(source_branch).groups()
-                issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                      [project_label, category],
-                                                      title)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Search Issue Error",
-                        "error": str(error)
-                    })
-                if len(issues) == 0:
-                    _, error = create_project_issue(Project.PROJECT_A.value,
-                                                    None,
-                                                    [project_label, category, target_branch_label],
-                                                    title,
-                                                    None,
-                                                    milestone_id)
-                    if error is not None:
-                        return response_message_body(500, {
-                            "message": "Create Issue Error",
-                            "error": str(error)
-                        })
-                    return response_message_body(200, {
-                        "message": "Create Issue Successfully"
-                    })
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             issues[0].get("iid"),
-                                             [project_label, category, target_branch_label],
-                                             None,
-                                             None,
-                                             milestone_id)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Update Issue Error",
-                        "error": str(error)
-                    })
-                return response_message_body(200, {
-                    "message": "Update Issue Successfully"
-                })
-            except Exception:
-                topic_issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                            [project_label, IssueLabel.EPIC.value],
-                                                            source_branch)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Search Topic Issue Error",
-                        "error": str(error)
-                    })
-                if len(topic_issues) == 0:
-                    return response_message_body(200, {
-                        "message": "No Need to Create a Topic Issue"
-                    })
-
-                if milestone_id is not None:
-                    related_issue_iids = get_ids_from_url_description(topic_issues[0].get("description", ""))
-                    for related_issue_iid in related_issue_iids:
-                        error = update_project_issue(Project.PROJECT_A.value,
-                                                     related_issue_iid,
-                                                     None,
-                                                     None,
-                                                     IssueState.CLOSE.value,
-                                                     milestone_id)
-                        if error is not None:
-                            print(error)
-
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             topic_issues[0].get("iid"),
-                                             [project_label, IssueLabel.EPIC.value, target_branch_label],
-                                             None,
-                                             None,
-                                             milestone_id)
-                if error is not None:
-                    return response_message_body(500, {
-                        "message": "Update Topic Issue Error",
-                        "error": str(error)
-                    })
-                return response_message_body(200, {
-                    "message": "Update Topic Issue Successfully"
-                })
-
-        """
-        source branch: staging
-        target branch: master
-        => add label(Production) and milestone to all issues in staging
-        """
-        if is_staging_branch(source_branch) and is_master_branch(target_branch):
-            issues, error = search_project_issues(Project.PROJECT_A.value,
-                                                  [project_label, IssueLabel.STAGING.value])
-            if error is not None:
-                return response_message_body(500, {
-                    "message": "Search Issue Error",
-                    "error": str(error)
-                })
-
-            if len(issues) == 0:
-                return response_message_body(200, {
-                    "message": "No Need to Move Issues from Staging to Production"
-                })
-
-            error_list = []
-            for issue in issues:
-                issue_labels = issue.get("labels", [])
-                try:
-                    issue_labels.remove(IssueLabel.STAGING.value)
-                except Exception:
-                    pass
-                issue_labels.append(target_branch_label)
-                error = update_project_issue(Project.PROJECT_A.value,
-                                             issue.get("iid"),
-                                             issue_labels,
-                                             None,
-                                             None,
-                                             milestone_id)
-                if error is not None:
-                    error_list.append(str(error))
-
-                # topic issue:
-                if IssueLabel.EPIC.value in issue_labels:
-                    related_issue_iids = get_ids_from_url_description(issue.get("description", ""))
-                    for related_issue_iid in related_issue_iids:
-                        error = update_project_issue(Project.PROJECT_A.value,
-                                                     related_issue_iid,
-                                                     None,
-                                                     None,
-                                                     None,
-                                                     milestone_id)
-                        if error is not None:
-                            error_list.append(str(error))
-
-            if len(error_list) > 0:
-                return response_message_body(500, {
-                    "message": "Update Staging Issues Error",
-                    "error": str(error_list)
-                })
-            return response_message_body(200, {
-                "message": "Move Issues from Staging to Production Successfully"
-            })
-
-        return response_message_body(406, {
-            "message": "Unsupported MR"
-        })
-
-    # close a MR => close the issue
-    issues, error = search_project_issues(Project.PROJECT_A.value,
-                                          None,
-                                          mr_url)
-    if error is not None:
-        return response_message_body(500, {
-            "message": "Search Issue Error",
-            "error": str(error)
-        })
-
-    if len(issues) == 0:
-        return response_message_body(200, {
-            "message": "No Need to Close a Issue"
-        })
-
-    error = update_project_issue(Project.PROJECT_A.value,
-                                 issues[0].get("iid"),
-                                 None,
-                                 None,
-                                 IssueState.CLOSE.value,
-                                 milestone_id)
-    if error is not None:
-        return response_message_body(500, {
-            "message": "Close Issue Error",
-            "error": str(error)
-        })
-    return response_message_body(200, {
-        "message": "Close Issue Successfully"
-    })
+    # keep the board snapshot up to date with what this event read and changed
+    if board_snapshot is not None:
+        error = board_snapshot.save()
+        if error is not None:
+            print(error)
+    return response
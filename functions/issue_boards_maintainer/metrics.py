@@ -0,0 +1,43 @@
+import os
+import json
+import time
+from typing import (
+    Dict,
+    Optional
+)
+
+metrics_namespace = os.environ.get("METRICS_NAMESPACE", "IssueBoardsMaintainer")
+
+
+def put_metric(
+    name: str,
+    value: float,
+    unit: str = "Count",
+    dimensions: Optional[Dict[str, str]] = None
+) -> None:
+    """Emit a metric in CloudWatch embedded metric format to the function log.
+
+    Args:
+        name (str): The name of the metric.
+        value (float): The value of the metric.
+        unit (str, optional): The CloudWatch unit of the metric.
+        dimensions (Dict[str, str], optional): The dimensions of the metric.
+
+    """
+    dimensions = dimensions or {}
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": metrics_namespace,
+                "Dimensions": [list(dimensions.keys())],
+                "Metrics": [{
+                    "Name": name,
+                    "Unit": unit
+                }]
+            }]
+        },
+        name: value
+    }
+    record.update(dimensions)
+    print(json.dumps(record))
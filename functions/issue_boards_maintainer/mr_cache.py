@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import (
+    Tuple,
+    Optional
+)
+
+import requests
+
+from gitlab_apis import get_project_merge_request
+
+mr_cache_size = int(os.environ.get("MR_CACHE_SIZE", "4096"))
+
+
+class SQLiteMRCacheStore:
+    """Source branches of merge requests stored in a local SQLite file, used for tests and local runs."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS mr_source_branches ("
+                "mr_key TEXT PRIMARY KEY, "
+                "source_branch TEXT NOT NULL)"
+            )
+
+    def get(self, mr_key: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT source_branch FROM mr_source_branches WHERE mr_key = ?", (mr_key,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, mr_key: str, source_branch: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO mr_source_branches VALUES (?, ?)", (mr_key, source_branch)
+            )
+
+
+class DynamoDBMRCacheStore:
+    """Source branches of merge requests stored in a DynamoDB table keyed by mr_key."""
+
+    def __init__(self, table_name: str):
+        import boto3
+
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, mr_key: str) -> Optional[str]:
+        record = self.table.get_item(Key={"mr_key": mr_key}).get("Item")
+        return record.get("source_branch") if record is not None else None
+
+    def put(self, mr_key: str, source_branch: str) -> None:
+        self.table.put_item(Item={
+            "mr_key": mr_key,
+            "source_branch": source_branch
+        })
+
+
+class MRSourceBranchCache:
+    """Never-expiring cache from (project_id, mr_iid) to the source branch of the merge request.
+
+    The source branch of a merge request never changes, so entries are never invalidated.
+    A LRU-bounded dict in the lambda container is backed by a persistent store.
+
+    """
+
+    def __init__(self, store, size: int = mr_cache_size):
+        self.store = store
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, project_id: int, mr_iid: int) -> Optional[str]:
+        mr_key = "{}:{}".format(project_id, mr_iid)
+        with self.lock:
+            source_branch = self.entries.get(mr_key)
+            if source_branch is not None:
+                self.entries.move_to_end(mr_key)
+                return source_branch
+        source_branch = self.store.get(mr_key)
+        if source_branch is not None:
+            self._remember(mr_key, source_branch)
+        return source_branch
+
+    def put(self, project_id: int, mr_iid: int, source_branch: str) -> None:
+        mr_key = "{}:{}".format(project_id, mr_iid)
+        with self.lock:
+            if mr_key in self.entries:
+                self.entries.move_to_end(mr_key)
+                return
+        self.store.put(mr_key, source_branch)
+        self._remember(mr_key, source_branch)
+
+    def _remember(self, mr_key: str, source_branch: str) -> None:
+        with self.lock:
+            self.entries[mr_key] = source_branch
+            self.entries.move_to_end(mr_key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+mr_source_branch_cache = None
+
+
+def get_mr_source_branch_cache() -> MRSourceBranchCache:
+    """Return the cache of the environment.
+
+    MR_CACHE_TABLE selects the DynamoDB table, otherwise a SQLite file at
+    MR_CACHE_SQLITE_PATH is used.
+
+    Returns:
+        MRSourceBranchCache
+
+    """
+    global mr_source_branch_cache
+    if mr_source_branch_cache is None:
+        table_name = os.environ.get("MR_CACHE_TABLE")
+        if table_name:
+            store = DynamoDBMRCacheStore(table_name)
+        else:
+            store = SQLiteMRCacheStore(os.environ.get("MR_CACHE_SQLITE_PATH", "/tmp/mr_cache.sqlite3"))
+        mr_source_branch_cache = MRSourceBranchCache(store)
+    return mr_source_branch_cache
+
+
+def remember_merge_request_source_branch(
+    project_id: int,
+    mr_iid: Optional[int],
+    source_branch: Optional[str]
+) -> Optional[Exception]:
+    """Fill the cache from a merge request webhook event.
+
+    Args:
+        project_id (int): The ID of the project.
+        mr_iid (int, optional): The internal ID of the merge request.
+        source_branch (str, optional): The source branch of the merge request.
+
+    Returns:
+        Exception: None if no error exists.
+
+    """
+    if mr_iid is None or source_branch is None:
+        return None
+    try:
+        get_mr_source_branch_cache().put(project_id, mr_iid, source_branch)
+        return None
+    except Exception as e:
+        return e
+
+
+def get_merge_request_source_branch(
+    project_id: int,
+    mr_iid: int
+) -> Tuple[Optional[str], Optional[Exception]]:
+    """Return the source branch of a merge request, from the cache or the single merge request API.
+
+    Args:
+        project_id (int): The ID of the project.
+        mr_iid (int): The internal ID of the merge request.
+
+    Returns:
+        Tuple[str, Exception]: (source branch, Exception), source branch is None if the merge request does not exist.
+
+    """
+    try:
+        source_branch = get_mr_source_branch_cache().get(project_id, mr_iid)
+        if source_branch is not None:
+            return source_branch, None
+    except Exception as e:
+        # the store is an optimization, fall back to GitLab
+        print(e)
+
+    mr, error = get_project_merge_request(project_id, mr_iid)
+    if isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code == 404:
+        return None, None
+    if error is not None:
+        return None, error
+
+    source_branch = mr.get("source_branch")
+    error = remember_merge_request_source_branch(project_id, mr_iid, source_branch)
+    if error is not None:
+        print(error)
+    return source_branch, None
@@ -0,0 +1,121 @@
+import os
+import json
+from typing import (
+    Dict,
+    Tuple,
+    Optional
+)
+
+from circuit_breaker import CircuitOpenError
+from gitlab_enum import (
+    MRAction,
+    Project,
+    EventLane,
+    GitlabEvent
+)
+from gitlab_lib import (
+    is_master_branch,
+    is_staging_branch
+)
+from issue_board import GitLabBoard
+from issue_planner import (
+    run_plan,
+    plan_event,
+    issue_creation_keys
+)
+from issue_lock import (
+    LockTimeoutError,
+    issue_lock
+)
+from rate_limiter import gitlab_rate_limit
+from retry_queue import park_failed_call
+
+# push events are deferred when no more than this fraction of the GitLab rate limit is left
+lane_defer_remaining_ratio = float(os.environ.get("LANE_DEFER_REMAINING_RATIO", "0.1"))
+
+# top-level fields of a deferred event kept for its replay
+deferred_event_keys = ("project", "ref", "total_commits_count", "object_attributes")
+
+
+class RateLimitExhaustedError(Exception):
+    def __init__(self):
+        super().__init__("GitLab Rate Limit Nearly Exhausted")
+
+
+def classify_event(gitlab_event: str, body_json: Dict) -> str:
+    """Return the priority lane of a webhook event.
+
+    staging to master promotions come first, then merges and closes, then opens, then pushes.
+
+    Args:
+        gitlab_event (str): The X-Gitlab-Event header.
+        body_json (Dict): The webhook body.
+
+    Returns:
+        str: The EventLane value.
+
+    """
+    if gitlab_event == GitlabEvent.PUSH_HOOK.value:
+        return EventLane.PUSH.value
+
+    mr_attribute = body_json.get("object_attributes") or {}
+    mr_action = mr_attribute.get("action")
+    if mr_action == MRAction.MERGE.value:
+        if is_staging_branch(mr_attribute.get("source_branch") or "") and is_master_branch(mr_attribute.get("target_branch") or ""):
+            return EventLane.PROMOTION.value
+        return EventLane.MERGE.value
+    if mr_action == MRAction.CLOSE.value:
+        return EventLane.MERGE.value
+    return EventLane.OPEN.value
+
+
+def should_defer(lane: str, body_json: Dict) -> bool:
+    """Return True if the event should be deferred to keep the rate limit for higher lanes."""
+    return (lane == EventLane.PUSH.value
+            and body_json.get("project", {}).get("id") in Project.value_list()
+            and gitlab_rate_limit.nearly_exhausted(lane_defer_remaining_ratio))
+
+
+def defer_webhook_event(
+    gitlab_event: str,
+    body_json: Dict,
+    reason: Optional[Exception] = None
+) -> Tuple[Optional[str], Optional[Exception]]:
+    """Park a webhook event in the retry queue, to be planned again by the retry drainer.
+
+    Args:
+        gitlab_event (str): The X-Gitlab-Event header.
+        body_json (Dict): The webhook body.
+        reason (Exception, optional): Why the event is deferred, RateLimitExhaustedError by default.
+
+    Returns:
+        Tuple[str, Exception]: (item id, Exception)
+
+    """
+    arguments = {
+        "gitlab_event": gitlab_event,
+        "body_json": {key: body_json[key] for key in deferred_event_keys if key in body_json}
+    }
+    return park_failed_call("plan_webhook_event", arguments, reason or RateLimitExhaustedError())
+
+
+def plan_webhook_event(gitlab_event: str, body_json: Dict) -> Optional[Exception]:
+    """Plan and apply a deferred webhook event against GitLab.
+
+    Returns:
+        Exception: None if no error exists, CircuitOpenError if GitLab calls are failing fast.
+
+    """
+    lock_keys = issue_creation_keys(gitlab_event, body_json)
+    board = GitLabBoard()
+    with issue_lock(lock_keys) as locked:
+        if not locked:
+            return LockTimeoutError(lock_keys)
+        response, _ = run_plan(plan_event(gitlab_event, body_json, board), board.apply_mutation)
+    if response.get("statusCode") == 503:
+        # only an open circuit answers 503, the drainer keeps the event without using up an attempt
+        error = json.loads(response.get("body") or "{}").get("error", "")
+        return CircuitOpenError(error.replace("Circuit Open: ", "", 1))
+    if response.get("statusCode") >= 500:
+        return Exception(response.get("body"))
+    return None
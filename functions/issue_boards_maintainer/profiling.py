@@ -0,0 +1,158 @@
+import io
+import os
+import time
+import pstats
+import random
+import marshal
+import cProfile
+import functools
+import tracemalloc
+from typing import (
+    Callable,
+    Optional
+)
+
+from metrics import put_metric
+
+profile_sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+profile_prefix = os.environ.get("PROFILE_PREFIX", "profiles")
+profile_top_allocations = int(os.environ.get("PROFILE_TOP_ALLOCATIONS", "25"))
+profile_top_functions = int(os.environ.get("PROFILE_TOP_FUNCTIONS", "40"))
+
+# forces profiling of a request carrying a valid X-Gitlab-Token
+profile_header = "X-Profile"
+
+
+class LocalProfileSink:
+    """Profiles written to a local directory, used for tests and local runs."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(data)
+        return path
+
+
+class S3ProfileSink:
+    """Profiles written to an S3 bucket."""
+
+    def __init__(self, bucket: str):
+        import boto3
+
+        self.client = boto3.client("s3")
+        self.bucket = bucket
+
+    def write(self, name: str, data: bytes) -> str:
+        self.client.put_object(Bucket=self.bucket, Key=name, Body=data)
+        return "s3://{}/{}".format(self.bucket, name)
+
+
+def get_profile_sink():
+    """Return the profile sink of the environment.
+
+    PROFILE_BUCKET selects the S3 bucket, otherwise PROFILE_PATH a local directory.
+
+    Returns:
+        LocalProfileSink or S3ProfileSink
+
+    """
+    bucket = os.environ.get("PROFILE_BUCKET")
+    if bucket:
+        return S3ProfileSink(bucket)
+    return LocalProfileSink(os.environ.get("PROFILE_PATH", "/tmp"))
+
+
+def should_profile(event) -> bool:
+    headers = event.get("headers") or {}
+    if headers.get(profile_header) and headers.get("X-Gitlab-Token") == os.environ.get("SECRET_TOKEN"):
+        return True
+    return profile_sample_rate > 0 and random.random() < profile_sample_rate
+
+
+def write_profile(
+    event,
+    context,
+    profiler: cProfile.Profile,
+    allocations: tracemalloc.Snapshot,
+    peak: int,
+    elapsed: float
+) -> Optional[Exception]:
+    """Write the profile and the top allocations of an invocation to the profile sink.
+
+    Three files are written under PROFILE_PREFIX/<event>/<time>-<request id>/:
+    profile.prof (load with pstats or snakeviz), functions.txt and allocations.txt.
+
+    Returns:
+        Exception: None if no error exists.
+
+    """
+    gitlab_event = ((event.get("headers") or {}).get("X-Gitlab-Event") or "unknown").replace(" ", "_")
+    request_id = getattr(context, "aws_request_id", None) or str(os.getpid())
+    prefix = "{}/{}/{}-{}".format(profile_prefix, gitlab_event, time.strftime("%Y%m%dT%H%M%S"), request_id)
+
+    functions = io.StringIO()
+    functions.write("{:.3f} s\n".format(elapsed))
+    stats = pstats.Stats(profiler, stream=functions)
+    stats.sort_stats("cumulative").print_stats(profile_top_functions)
+
+    top_allocations = ["{} {:.1f} KiB".format(statistic.traceback, statistic.size / 1024)
+                       for statistic in allocations.statistics("lineno")[:profile_top_allocations]]
+    top_allocations.insert(0, "peak {:.1f} KiB".format(peak / 1024))
+
+    try:
+        sink = get_profile_sink()
+        sink.write(prefix + "/profile.prof", marshal.dumps(stats.stats))
+        sink.write(prefix + "/functions.txt", functions.getvalue().encode("utf-8"))
+        location = sink.write(prefix + "/allocations.txt", "\n".join(top_allocations).encode("utf-8"))
+    except Exception as e:
+        return e
+    print("Profile: {}".format(location.rsplit("/", 1)[0]))
+    return None
+
+
+def sampled_profiling(handler: Callable) -> Callable:
+    """Run a lambda handler under cProfile and tracemalloc for a sample of invocations.
+
+    PROFILE_SAMPLE_RATE is the sampled fraction of invocations (0 by default), and a request
+    can force it with the X-Profile header. Unsampled invocations call the handler directly.
+
+    Args:
+        handler (Callable): The lambda handler.
+
+    Returns:
+        Callable
+
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not should_profile(event):
+            return handler(event, context)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return handler(event, context)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            allocations = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__)
+            ])
+            error = write_profile(event, context, profiler, allocations, peak, elapsed)
+            if started_tracing:
+                tracemalloc.stop()
+            if error is not None:
+                print(error)
+            put_metric("ProfiledInvocations", 1)
+
+    return wrapper
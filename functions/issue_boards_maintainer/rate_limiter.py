@@ -0,0 +1,97 @@
+import time
+import threading
+from typing import (
+    Mapping,
+    Optional
+)
+
+
+class TokenBucket:
+    """Allow at most rate calls per second on average, with bursts up to capacity.
+
+    Args:
+        rate (float): The tokens added per second.
+        capacity (float, optional): The maximum tokens held, rate by default.
+
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting until one is available.
+
+        Returns:
+            float: The seconds waited.
+
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimitState:
+    """The GitLab rate limit of the access token, as last reported by the RateLimit-* response headers."""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.lock = threading.Lock()
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        try:
+            limit = int(headers["RateLimit-Limit"])
+            remaining = int(headers["RateLimit-Remaining"])
+            reset_at = float(headers.get("RateLimit-Reset", time.time() + 60))
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            self.limit, self.remaining, self.reset_at = limit, remaining, reset_at
+
+    def remaining_ratio(self) -> Optional[float]:
+        """Return the fraction of the limit left in the current window, None if unknown.
+
+        Returns:
+            float
+
+        """
+        with self.lock:
+            if self.limit is None or self.limit <= 0 or time.time() >= self.reset_at:
+                return None
+            return self.remaining / self.limit
+
+    def calls_left(self, reserved_ratio: float = 0.0) -> Optional[int]:
+        """Return the calls left in the current window, keeping a fraction of the limit in reserve.
+
+        Args:
+            reserved_ratio (float, optional): The fraction of the limit not to spend.
+
+        Returns:
+            int: None if unknown.
+
+        """
+        with self.lock:
+            if self.limit is None or self.limit <= 0 or time.time() >= self.reset_at:
+                return None
+            return max(0, self.remaining - int(self.limit * reserved_ratio))
+
+    def nearly_exhausted(self, ratio: float) -> bool:
+        remaining_ratio = self.remaining_ratio()
+        return remaining_ratio is not None and remaining_ratio <= ratio
+
+
+gitlab_rate_limit = RateLimitState()
@@ -0,0 +1,135 @@
+import os
+import time
+from typing import (
+    Dict,
+    Optional
+)
+
+from gitlab_apis import (
+    create_project_issue,
+    update_project_issue
+)
+from gitlab_lib import response_message_body
+from circuit_breaker import CircuitOpenError
+from metrics import put_metric
+from retry_queue import (
+    retry_delay,
+    get_retry_queue,
+    next_retry_item
+)
+from priority_lanes import (
+    plan_webhook_event,
+    lane_defer_remaining_ratio
+)
+from rate_limiter import gitlab_rate_limit
+from budget_planner import CallBudget
+from gitlab_enum import RetryItemStatus
+from tracing import start_span
+
+retry_batch_size = int(os.environ.get("RETRY_BATCH_SIZE", "25"))
+retry_drain_reserved_millis = int(os.environ.get("RETRY_DRAIN_RESERVED_MILLIS", "15000"))
+
+retry_operations = {
+    "create_project_issue": create_project_issue,
+    "update_project_issue": update_project_issue,
+    "plan_webhook_event": plan_webhook_event
+}
+
+
+def replay_retry_item(item: Dict) -> Optional[Exception]:
+    """Call the GitLab mutation of a work item once.
+
+    Args:
+        item (Dict): The work item.
+
+    Returns:
+        Exception: None if no error exists.
+
+    """
+    operation = retry_operations.get(item["operation"])
+    if operation is None:
+        return ValueError("Unsupported Operation: {}".format(item["operation"]))
+    attributes = {
+        "retry.item_id": item["item_id"],
+        "retry.attempts": item["attempts"]
+    }
+    with start_span("replay {}".format(item["operation"]), attributes, traceparent=item.get("traceparent")) as span:
+        result = operation(**item["arguments"])
+        error = result[1] if isinstance(result, tuple) else result
+        if error is not None:
+            span.set_error(error)
+        return error
+
+
+def drain_retry_queue(event, context):
+    """Replay due work items in batches, off the webhook path. Triggered by a schedule.
+
+    Stops when no item is due, when the GitLab circuit is open, or when the next call does not
+    fit in the rest of the rate limit window or of the invocation. The due items of DynamoDB are
+    read from an eventually consistent index, which can still return items deleted or
+    rescheduled earlier in the drain, so each item is handled at most once per invocation.
+
+    """
+    batch_size = (event or {}).get("batch_size", retry_batch_size)
+    queue = get_retry_queue()
+    replayed = 0
+    rescheduled = 0
+    dead = 0
+    deferred = 0
+    circuit_open = False
+    budget_exhausted = False
+    budget = CallBudget(context)
+    handled_item_ids = set()
+
+    with start_span("drain_retry_queue", {"retry.batch_size": batch_size}) as span:
+        while not circuit_open and not budget_exhausted:
+            if context is not None and context.get_remaining_time_in_millis() < retry_drain_reserved_millis:
+                break
+            items = [item for item in queue.due_items(batch_size) if item["item_id"] not in handled_item_ids]
+            if len(items) == 0:
+                break
+
+            for item in items:
+                handled_item_ids.add(item["item_id"])
+                # deferred events wait for the next rate limit window without using up their attempts
+                if item["operation"] == "plan_webhook_event" and gitlab_rate_limit.nearly_exhausted(lane_defer_remaining_ratio):
+                    next_attempt_at = max(gitlab_rate_limit.reset_at, time.time() + retry_delay(item["attempts"]))
+                    queue.put(dict(item, next_attempt_at=next_attempt_at))
+                    deferred += 1
+                    continue
+                if not budget.fits(1):
+                    budget_exhausted = True
+                    break
+                error = replay_retry_item(item)
+                if error is None:
+                    queue.delete(item["item_id"])
+                    replayed += 1
+                    continue
+                if isinstance(error, CircuitOpenError):
+                    # the item stays queued as it was, an open circuit does not use up an attempt
+                    circuit_open = True
+                    break
+                item = next_retry_item(item, error)
+                queue.put(item)
+                if item["status"] == RetryItemStatus.DEAD.value:
+                    print("dead letter {}: {}".format(item["item_id"], item["last_error"]))
+                    dead += 1
+                else:
+                    rescheduled += 1
+
+        span.set_attribute("retry.replayed", replayed)
+        span.set_attribute("retry.dead", dead)
+
+    put_metric("RetryItemsReplayed", replayed)
+    put_metric("RetryItemsRescheduled", rescheduled)
+    put_metric("RetryItemsDeadLettered", dead)
+    put_metric("RetryItemsDeferred", deferred)
+    return response_message_body(200, {
+        "message": "Drain Retry Queue Successfully",
+        "replayed": replayed,
+        "rescheduled": rescheduled,
+        "dead": dead,
+        "deferred": deferred,
+        "circuit_open": circuit_open,
+        "budget_exhausted": budget_exhausted
+    })
@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+from decimal import Decimal
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Optional
+)
+
+from gitlab_enum import RetryItemStatus
+from tracing import current_traceparent
+
+retry_max_attempts = int(os.environ.get("RETRY_MAX_ATTEMPTS", "8"))
+retry_base_delay = float(os.environ.get("RETRY_BASE_DELAY", "30"))
+retry_max_delay = float(os.environ.get("RETRY_MAX_DELAY", "3600"))
+
+
+def retry_delay(attempts: int) -> float:
+    """Return the exponential backoff in seconds, with full jitter, before the next attempt.
+
+    Args:
+        attempts (int): The number of attempts already made.
+
+    Returns:
+        float
+
+    """
+    return random.uniform(0, min(retry_max_delay, retry_base_delay * (2 ** attempts)))
+
+
+def new_retry_item(
+    operation: str,
+    arguments: Dict,
+    error: Optional[Exception] = None
+) -> Dict:
+    """Construct a pending work item for a GitLab mutation.
+
+    Args:
+        operation (str): The name of the gitlab_apis function, eg. "update_project_issue".
+        arguments (Dict): The keyword arguments of the call.
+        error (Exception, optional): The error of the failed call.
+
+    Returns:
+        Dict
+
+    """
+    now = time.time()
+    return {
+        "item_id": uuid.uuid4().hex,
+        "operation": operation,
+        "arguments": arguments,
+        "status": RetryItemStatus.PENDING.value,
+        "attempts": 1,
+        "next_attempt_at": now + retry_delay(1),
+        "created_at": now,
+        "last_error": str(error) if error is not None else None,
+        # the replay joins the trace of the event that parked the item
+        "traceparent": current_traceparent()
+    }
+
+
+def next_retry_item(item: Dict, error: Exception) -> Dict:
+    """Return the item after one more failed attempt, moved to dead letter when out of retries.
+
+    Args:
+        item (Dict): The work item.
+        error (Exception): The error of the failed attempt.
+
+    Returns:
+        Dict
+
+    """
+    item = dict(item)
+    item["attempts"] += 1
+    item["last_error"] = str(error)
+    if item["attempts"] >= retry_max_attempts:
+        item["status"] = RetryItemStatus.DEAD.value
+    else:
+        item["next_attempt_at"] = time.time() + retry_delay(item["attempts"])
+    return item
+
+
+class SQLiteRetryQueue:
+    """Retry queue stored in a local SQLite file, used for tests and local runs."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS retry_items ("
+                "item_id TEXT PRIMARY KEY, "
+                "operation TEXT NOT NULL, "
+                "arguments TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, "
+                "next_attempt_at REAL NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "last_error TEXT, "
+                "traceparent TEXT)"
+            )
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(retry_items)")]
+            if "traceparent" not in columns:
+                self.connection.execute("ALTER TABLE retry_items ADD COLUMN traceparent TEXT")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS retry_items_due ON retry_items (status, next_attempt_at)"
+            )
+
+    def put(self, item: Dict) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO retry_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item["item_id"], item["operation"], json.dumps(item["arguments"]), item["status"],
+                 item["attempts"], item["next_attempt_at"], item["created_at"], item["last_error"],
+                 item.get("traceparent"))
+            )
+
+    def get(self, item_id: str) -> Optional[Dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM retry_items WHERE item_id = ?", (item_id,)
+            ).fetchall()
+        items = self._to_items(rows)
+        return items[0] if len(items) != 0 else None
+
+    def delete(self, item_id: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM retry_items WHERE item_id = ?", (item_id,))
+
+    def due_items(self, limit: int) -> List[Dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM retry_items WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (RetryItemStatus.PENDING.value, time.time(), limit)
+            ).fetchall()
+        return self._to_items(rows)
+
+    def dead_items(self, limit: int) -> List[Dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM retry_items WHERE status = ? ORDER BY created_at LIMIT ?",
+                (RetryItemStatus.DEAD.value, limit)
+            ).fetchall()
+        return self._to_items(rows)
+
+    @staticmethod
+    def _to_items(rows: List[Tuple]) -> List[Dict]:
+        keys = ("item_id", "operation", "arguments", "status",
+                "attempts", "next_attempt_at", "created_at", "last_error", "traceparent")
+        items = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            item["arguments"] = json.loads(item["arguments"])
+            items.append(item)
+        return items
+
+
+class DynamoDBRetryQueue:
+    """Retry queue stored in a DynamoDB table.
+
+    The table is keyed by item_id and has a "status-next_attempt_at" global secondary index
+    to query due and dead items.
+
+    """
+
+    def __init__(self, table_name: str):
+        import boto3
+
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def put(self, item: Dict) -> None:
+        record = dict(item)
+        record["arguments"] = json.dumps(item["arguments"])
+        record["next_attempt_at"] = Decimal(str(item["next_attempt_at"]))
+        record["created_at"] = Decimal(str(item["created_at"]))
+        self.table.put_item(Item=record)
+
+    def get(self, item_id: str) -> Optional[Dict]:
+        record = self.table.get_item(Key={"item_id": item_id}).get("Item")
+        return self._to_item(record) if record is not None else None
+
+    def delete(self, item_id: str) -> None:
+        self.table.delete_item(Key={"item_id": item_id})
+
+    def due_items(self, limit: int) -> List[Dict]:
+        return self._query_status(RetryItemStatus.PENDING.value, limit, time.time())
+
+    def dead_items(self, limit: int) -> List[Dict]:
+        return self._query_status(RetryItemStatus.DEAD.value, limit)
+
+    def _query_status(self, status: str, limit: int, before: Optional[float] = None) -> List[Dict]:
+        from boto3.dynamodb.conditions import Key
+
+        condition = Key("status").eq(status)
+        if before is not None:
+            condition = condition & Key("next_attempt_at").lte(Decimal(str(before)))
+        response = self.table.query(IndexName="status-next_attempt_at",
+                                    KeyConditionExpression=condition,
+                                    Limit=limit)
+        return [self._to_item(record) for record in response.get("Items", [])]
+
+    @staticmethod
+    def _to_item(record: Dict) -> Dict:
+        item = dict(record)
+        item["arguments"] = json.loads(record["arguments"])
+        item["attempts"] = int(record["attempts"])
+        item["next_attempt_at"] = float(record["next_attempt_at"])
+        item["created_at"] = float(record["created_at"])
+        return item
+
+
+retry_queue = None
+
+
+def get_retry_queue():
+    """Return the retry queue of the environment.
+
+    RETRY_QUEUE_TABLE selects the DynamoDB table, otherwise a SQLite file at
+    RETRY_QUEUE_SQLITE_PATH is used.
+
+    Returns:
+        SQLiteRetryQueue or DynamoDBRetryQueue
+
+    """
+    global retry_queue
+    if retry_queue is None:
+        table_name = os.environ.get("RETRY_QUEUE_TABLE")
+        if table_name:
+            retry_queue = DynamoDBRetryQueue(table_name)
+        else:
+            retry_queue = SQLiteRetryQueue(os.environ.get("RETRY_QUEUE_SQLITE_PATH", "/tmp/retry_queue.sqlite3"))
+    return retry_queue
+
+
+def park_failed_call(
+    operation: str,
+    arguments: Dict,
+    error: Exception
+) -> Tuple[Optional[str], Optional[Exception]]:
+    """Persist a failed GitLab mutation as a retryable work item.
+
+    Args:
+        operation (str): The name of the gitlab_apis function, eg. "update_project_issue".
+        arguments (Dict): The keyword arguments of the call.
+        error (Exception): The error of the failed call.
+
+    Returns:
+        Tuple[str, Exception]: (item id, Exception)
+
+    """
+    item = new_retry_item(operation, arguments, error)
+    try:
+        get_retry_queue().put(item)
+        return item["item_id"], None
+    except Exception as e:
+        return None, e
@@ -0,0 +1,69 @@
+"""Inspect and replay the retry queue and its dead letters.
+
+usage:
+    python retry_queue_cli.py list [--dead] [--limit N]
+    python retry_queue_cli.py replay ITEM_ID [ITEM_ID ...]
+    python retry_queue_cli.py replay-dead [--limit N]
+    python retry_queue_cli.py drain
+
+RETRY_QUEUE_TABLE or RETRY_QUEUE_SQLITE_PATH selects the queue, as in the lambda function.
+"""
+import json
+import time
+import argparse
+
+from retry_queue import get_retry_queue
+from retry_drainer import drain_retry_queue
+from gitlab_enum import RetryItemStatus
+
+
+def revive(queue, item):
+    # reset attempts so the drainer replays the item on its next run
+    item["status"] = RetryItemStatus.PENDING.value
+    item["attempts"] = 0
+    item["next_attempt_at"] = time.time()
+    queue.put(item)
+    print("replay queued: {}".format(item["item_id"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay the retry queue.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    list_parser = subparsers.add_parser("list", help="List due items, or dead letters with --dead.")
+    list_parser.add_argument("--dead", action="store_true")
+    list_parser.add_argument("--limit", type=int, default=100)
+
+    replay_parser = subparsers.add_parser("replay", help="Move items back to the queue.")
+    replay_parser.add_argument("item_ids", nargs="+")
+
+    replay_dead_parser = subparsers.add_parser("replay-dead", help="Move all dead letters back to the queue.")
+    replay_dead_parser.add_argument("--limit", type=int, default=100)
+
+    subparsers.add_parser("drain", help="Replay due items now.")
+
+    args = parser.parse_args()
+    queue = get_retry_queue()
+
+    if args.command == "list":
+        items = queue.dead_items(args.limit) if args.dead else queue.due_items(args.limit)
+        for item in items:
+            print(json.dumps(item))
+    elif args.command == "replay":
+        for item_id in args.item_ids:
+            item = queue.get(item_id)
+            if item is None:
+                print("not found: {}".format(item_id))
+                continue
+            revive(queue, item)
+    elif args.command == "replay-dead":
+        for item in queue.dead_items(args.limit):
+            revive(queue, item)
+    elif args.command == "drain":
+        print(drain_retry_queue({}, None).get("body"))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
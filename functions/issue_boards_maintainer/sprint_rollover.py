@@ -0,0 +1,188 @@
+"""Move the open issues of previous sprints to the new sprint.
+
+Runs on a schedule as a lambda function, or locally:
+    python sprint_rollover.py [--dry-run]
+"""
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from gitlab_apis import (
+    update_project_issue,
+    search_project_issues
+)
+from gitlab_enum import (
+    Project,
+    IssueState
+)
+from gitlab_lib import (
+    error_response_body,
+    response_message_body,
+    newest_active_milestone
+)
+from issue_board import search_active_milestones
+from metrics import put_metric
+from rate_limiter import TokenBucket
+from retry_queue import park_failed_call
+from checkpoint_store import get_checkpoint_store
+
+rollover_concurrency = int(os.environ.get("ROLLOVER_CONCURRENCY", "4"))
+rollover_rate = float(os.environ.get("ROLLOVER_RATE", "5"))
+rollover_per_page = int(os.environ.get("ROLLOVER_PER_PAGE", "100"))
+rollover_reserved_millis = int(os.environ.get("ROLLOVER_RESERVED_MILLIS", "30000"))
+
+
+def reassign_issue(
+    issue_iid: int,
+    milestone_id: int,
+    rate_limiter: TokenBucket
+) -> Optional[str]:
+    """Move an issue to the milestone, parking the update for retry if it fails.
+
+    Args:
+        issue_iid (int): The internal ID of the issue.
+        milestone_id (int): The ID of the milestone.
+        rate_limiter (TokenBucket): The rate limit of GitLab calls.
+
+    Returns:
+        str: The error if the update could not be parked, None otherwise.
+
+    """
+    rate_limiter.acquire()
+    arguments = {
+        "project_id": Project.PROJECT_A.value,
+        "issue_iid": issue_iid,
+        "milestone_id": milestone_id
+    }
+    error = update_project_issue(**arguments)
+    if error is None:
+        return None
+    _, park_error = park_failed_call("update_project_issue", arguments, error)
+    if park_error is not None:
+        return str(error)
+    return None
+
+
+def sprint_rollover(event, context):
+    """Reassign open issues on closed or previous milestones to the newest active milestone.
+
+    Issues are read oldest first from the last one processed, so the checkpoint stays valid while
+    issues are created or closed. When the invocation is about to time out, the checkpoint is saved
+    and the next scheduled run resumes from it. {"dry_run": true} only lists the issues to move.
+
+    """
+    event = event or {}
+    dry_run = event.get("dry_run", False)
+
+    milestones, error = search_active_milestones()
+    if error is not None:
+        return error_response_body("Search Milestone Error", error)
+    milestone = newest_active_milestone(milestones)
+    if milestone is None:
+        return response_message_body(200, {
+            "message": "No Active Milestone"
+        })
+    milestone_id = milestone.get("id")
+
+    store = get_checkpoint_store()
+    checkpoint_name = "sprint_rollover:{}:{}".format(Project.PROJECT_A.value, milestone_id)
+    checkpoint = None if dry_run else store.get(checkpoint_name)
+    checkpoint = checkpoint or {
+        # creation time and iid of the last issue processed
+        "created_at": None,
+        "iid": 0,
+        "reassigned": 0,
+        "errors": [],
+        "done": False
+    }
+    if checkpoint["done"]:
+        return response_message_body(200, {
+            "message": "Sprint Rollover Has Been Done",
+            "milestone_id": milestone_id
+        })
+
+    planned_iids = []
+    rate_limiter = TokenBucket(rollover_rate)
+    with ThreadPoolExecutor(max_workers=rollover_concurrency) as executor:
+        while True:
+            if context is not None and context.get_remaining_time_in_millis() < rollover_reserved_millis:
+                if not dry_run:
+                    store.put(checkpoint_name, checkpoint)
+                return response_message_body(202, {
+                    "message": "Sprint Rollover Paused",
+                    "milestone_id": milestone_id,
+                    "checkpoint": checkpoint
+                })
+
+            rate_limiter.acquire()
+            issues, error = search_project_issues(Project.PROJECT_A.value,
+                                                  per_page=rollover_per_page,
+                                                  state=IssueState.OPENED.value,
+                                                  sort="asc",
+                                                  order_by="created_at",
+                                                  created_after=checkpoint.get("created_at"))
+            if error is not None:
+                if not dry_run:
+                    store.put(checkpoint_name, checkpoint)
+                return error_response_body("Search Issue Error", error)
+
+            # created_after includes the issues created at the same time as the last one processed
+            last_key = (checkpoint.get("created_at") or "", checkpoint.get("iid", 0))
+            new_issues = [issue for issue in issues
+                          if (issue.get("created_at") or "", issue.get("iid")) > last_key]
+
+            stale_iids = []
+            for issue in new_issues:
+                issue_milestone_id = (issue.get("milestone") or {}).get("id")
+                if issue_milestone_id is not None and issue_milestone_id != milestone_id:
+                    stale_iids.append(issue.get("iid"))
+
+            if dry_run:
+                planned_iids.extend(stale_iids)
+            else:
+                errors = executor.map(lambda issue_iid: reassign_issue(issue_iid, milestone_id, rate_limiter),
+                                      stale_iids)
+                checkpoint["errors"].extend(error for error in errors if error is not None)
+                checkpoint["reassigned"] += len(stale_iids)
+                put_metric("SprintRolloverReassigned", len(stale_iids))
+
+            put_metric("SprintRolloverPages", 1)
+            # a full page of issues created at the same time as the last one would not move on
+            if len(issues) < rollover_per_page or len(new_issues) == 0:
+                break
+            checkpoint["created_at"] = new_issues[-1].get("created_at")
+            checkpoint["iid"] = new_issues[-1].get("iid")
+            if not dry_run:
+                store.put(checkpoint_name, checkpoint)
+
+    if dry_run:
+        return response_message_body(200, {
+            "message": "Sprint Rollover Dry Run",
+            "milestone_id": milestone_id,
+            "issue_iids": planned_iids
+        })
+
+    checkpoint["done"] = True
+    store.put(checkpoint_name, checkpoint)
+    if len(checkpoint["errors"]) > 0:
+        return response_message_body(500, {
+            "message": "Sprint Rollover Error",
+            "error": str(checkpoint["errors"])
+        })
+    return response_message_body(200, {
+        "message": "Sprint Rollover Successfully",
+        "milestone_id": milestone_id,
+        "reassigned": checkpoint["reassigned"]
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the open issues of previous sprints to the new sprint.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    print(sprint_rollover({"dry_run": args.dry_run}, None).get("body"))
+
+
+if __name__ == "__main__":
+    main()
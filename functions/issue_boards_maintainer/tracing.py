@@ -0,0 +1,295 @@
+"""Tracing in the OpenTelemetry data model, exported as OTLP/JSON.
+
+Spans nest through a context variable. Trace context crosses process boundaries as a
+W3C traceparent (eg. the traceparent header, or the traceparent of a retry item).
+Tracing is disabled unless TRACING_EXPORTER is "stdout" or "memory".
+"""
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Optional
+)
+
+tracing_exporter_name = os.environ.get("TRACING_EXPORTER", "")
+tracing_batch_size = int(os.environ.get("TRACING_BATCH_SIZE", "512"))
+tracing_service_name = os.environ.get("TRACING_SERVICE_NAME", "issue_boards_maintainer")
+
+# OTLP span kinds and status codes
+span_kind_internal = 1
+span_kind_server = 2
+span_kind_client = 3
+status_code_error = 2
+
+current_span_var = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation of a trace.
+
+    Args:
+        name (str): The name of the operation.
+        trace_id (str): 32 hex digits.
+        parent_span_id (str, optional): 16 hex digits, None for a root span.
+        kind (int, optional): The OTLP span kind.
+        attributes (Dict[str, Any], optional): The attributes of the span.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str] = None,
+        kind: int = span_kind_internal,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "{:016x}".format(random.getrandbits(64))
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = {key: value for (key, value) in (attributes or {}).items() if value is not None}
+        self.status_code = 0
+        self.status_message = None
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    def is_recording(self) -> bool:
+        return True
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, error: Any) -> None:
+        self.status_code = status_code_error
+        self.status_message = str(error)
+
+    def traceparent(self) -> str:
+        return "00-{}-{}-01".format(self.trace_id, self.span_id)
+
+    def to_dict(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [otlp_attribute(key, value) for (key, value) in self.attributes.items()],
+            "status": {"code": self.status_code}
+        }
+        if self.parent_span_id is not None:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message is not None:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class NoopSpan:
+    """The span handed out while tracing is disabled, also its own context manager."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, error: Any) -> None:
+        pass
+
+    def traceparent(self) -> Optional[str]:
+        return None
+
+
+noop_span = NoopSpan()
+
+
+def otlp_attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        typed_value = {"boolValue": value}
+    elif isinstance(value, int):
+        typed_value = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed_value = {"doubleValue": value}
+    else:
+        typed_value = {"stringValue": str(value)}
+    return {
+        "key": key,
+        "value": typed_value
+    }
+
+
+class StdoutSpanSink:
+    """Writes each batch as one OTLP/JSON line to the function log."""
+
+    def write(self, spans: List[Dict]) -> None:
+        print(json.dumps({
+            "resourceSpans": [{
+                "resource": {
+                    "attributes": [otlp_attribute("service.name", tracing_service_name)]
+                },
+                "scopeSpans": [{
+                    "scope": {"name": "issue_boards_maintainer"},
+                    "spans": spans
+                }]
+            }]
+        }, separators=(",", ":")))
+
+
+class InMemorySpanSink:
+    """Keeps the exported spans in memory, used for tests and local runs."""
+
+    def __init__(self):
+        self.spans = []
+
+    def write(self, spans: List[Dict]) -> None:
+        self.spans.extend(spans)
+
+
+class BatchSpanExporter:
+    """Buffers ended spans and writes them in batches.
+
+    A batch is written when it is full, and when the outermost span of the process ends,
+    so a lambda invocation writes its whole trace at once before it is frozen.
+
+    Args:
+        sink (StdoutSpanSink or InMemorySpanSink): Where batches are written.
+        batch_size (int, optional): The maximum spans buffered.
+
+    """
+
+    def __init__(self, sink, batch_size: int = tracing_batch_size):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch = []
+        self.lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self.lock:
+            self.batch.append(span.to_dict())
+            full = len(self.batch) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            batch, self.batch = self.batch, []
+        if len(batch) != 0:
+            self.sink.write(batch)
+
+
+def get_span_exporter() -> Optional[BatchSpanExporter]:
+    """Return the span exporter of the environment, None if tracing is disabled.
+
+    Returns:
+        BatchSpanExporter
+
+    """
+    if tracing_exporter_name == "stdout":
+        return BatchSpanExporter(StdoutSpanSink())
+    if tracing_exporter_name == "memory":
+        return BatchSpanExporter(InMemorySpanSink())
+    return None
+
+
+span_exporter = get_span_exporter()
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Parse a W3C traceparent.
+
+    Args:
+        traceparent (str, optional): eg. 00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01
+
+    Returns:
+        Tuple[str, str]: (trace id, parent span id), None if the traceparent is invalid.
+
+    """
+    try:
+        (_, trace_id, span_id, _) = traceparent.split("-")
+        int(trace_id, 16)
+        int(span_id, 16)
+    except Exception:
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16 or int(trace_id, 16) == 0:
+        return None
+    return trace_id, span_id
+
+
+def current_span():
+    return current_span_var.get() or noop_span
+
+
+def current_traceparent() -> Optional[str]:
+    span = current_span_var.get()
+    return span.traceparent() if span is not None else None
+
+
+def start_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    kind: int = span_kind_internal,
+    traceparent: Optional[str] = None
+):
+    """Run the body of a with statement as a span, child of the current span.
+
+    An exception escaping the body sets the error status of the span. While tracing is
+    disabled the shared noop_span is returned, so spans on hot paths allocate nothing.
+
+    Args:
+        name (str): The name of the operation.
+        attributes (Dict[str, Any], optional): The attributes of the span.
+        kind (int, optional): The OTLP span kind.
+        traceparent (str, optional): A remote parent, used instead of the current span.
+
+    """
+    if span_exporter is None:
+        return noop_span
+    return recording_span(name, attributes, kind, traceparent)
+
+
+@contextmanager
+def recording_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]],
+    kind: int,
+    traceparent: Optional[str]
+):
+    parent = current_span_var.get()
+    remote_parent = parse_traceparent(traceparent) if traceparent is not None else None
+    if remote_parent is not None:
+        trace_id, parent_span_id = remote_parent
+    elif parent is not None:
+        trace_id, parent_span_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_span_id = "{:032x}".format(random.getrandbits(128)), None
+
+    span = Span(name, trace_id, parent_span_id, kind, attributes)
+    token = current_span_var.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.set_error(e)
+        raise
+    finally:
+        span.end_time = time.time_ns()
+        current_span_var.reset(token)
+        span_exporter.export(span)
+        if parent is None:
+            span_exporter.flush()
@@ -0,0 +1,146 @@
+import json
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Optional
+)
+
+from gitlab_lib import (
+    error_response_body,
+    response_message_body
+)
+from issue_board import BatchBoard
+from issue_planner import (
+    Mutation,
+    run_plan,
+    plan_event,
+    issue_creation_keys
+)
+from issue_lock import (
+    LockTimeoutError,
+    issue_lock
+)
+from lambda_function import (
+    gitlab_board,
+    board_snapshot,
+    park_mutation,
+    read_webhook,
+    remember_merge_request
+)
+from metrics import put_metric
+from tracing import start_span
+
+
+def batch_event_response(
+    response: Dict,
+    mutations: List[Mutation],
+    failures: Dict[int, Tuple[Exception, Optional[str]]]
+) -> Dict:
+    """Return the response of an event of the batch, once the combined issue updates are applied.
+
+    Args:
+        response (Dict): The response of the plan of the event.
+        mutations (List[Mutation]): The mutations of the event.
+        failures (Dict[int, Tuple[Exception, str]]): issue iid => (error, retry item id or None if not parked)
+
+    Returns:
+        Dict
+
+    """
+    if response.get("statusCode") >= 400:
+        return response
+
+    retry_item_ids = []
+    for mutation in mutations:
+        if mutation.operation != "update_project_issue":
+            continue
+        failure = failures.get(mutation.arguments.get("issue_iid"))
+        if failure is None:
+            continue
+        error, item_id = failure
+        if item_id is None:
+            return error_response_body(mutation.error_message, error)
+        if item_id not in retry_item_ids:
+            retry_item_ids.append(item_id)
+
+    if len(retry_item_ids) == 0:
+        return response
+    body = json.loads(response.get("body", "{}"))
+    body["retry_items"] = body.get("retry_items", []) + retry_item_ids
+    return response_message_body(202, body)
+
+
+def process_webhook_batch(event, context):
+    """Process a batch of webhook events, eg. the merges of a coordinated release, in one invocation.
+
+    The events ({"events": [lambda events]}) are planned in order against a BatchBoard, so
+    the PROJECT_A issues and milestone are looked up once for the whole batch, and all updates
+    of an issue are applied as one. As the updates are applied after every event is planned,
+    an event whose update fails gets its error response while its other mutations still apply.
+
+    """
+    events = event.get("events") or []
+    with start_span("issue_boards_batch", {"batch.size": len(events)}) as span:
+        board = BatchBoard(gitlab_board)
+        if board_snapshot is not None:
+            error = board_snapshot.refresh()
+            if error is not None:
+                print(error)
+
+        results = []
+        for (index, webhook_event) in enumerate(events):
+            with start_span("batch event", {"batch.index": index}) as event_span:
+                gitlab_event, body_json, error_response = read_webhook(webhook_event)
+                if error_response is not None:
+                    results.append((error_response, []))
+                    continue
+                remember_merge_request(gitlab_event, body_json, board, event_span)
+                lock_keys = issue_creation_keys(gitlab_event, body_json)
+                with issue_lock(lock_keys) as locked:
+                    if locked:
+                        results.append(run_plan(plan_event(gitlab_event, body_json, board), board.apply_mutation))
+                if not locked:
+                    results.append((error_response_body("Lock Issue Error", LockTimeoutError(lock_keys)), []))
+
+        failures = {}
+        updated_issues = board.flush()
+        for (issue_iid, (mutation, error)) in updated_issues.items():
+            if error is None:
+                continue
+            item_id, park_error = (None, error)
+            if mutation.parkable:
+                item_id, park_error = park_mutation(mutation, error)
+            failures[issue_iid] = (error, item_id if park_error is None else None)
+
+        if board_snapshot is not None:
+            error = board_snapshot.save()
+            if error is not None:
+                print(error)
+
+        responses = []
+        event_indexes = {}
+        for (index, (response, mutations)) in enumerate(results):
+            response = batch_event_response(response, mutations, failures)
+            responses.append({
+                "statusCode": response.get("statusCode"),
+                "body": json.loads(response.get("body", "{}"))
+            })
+            for mutation in mutations:
+                if mutation.operation == "update_project_issue":
+                    issue_events = event_indexes.setdefault(mutation.arguments.get("issue_iid"), [])
+                    if index not in issue_events:
+                        issue_events.append(index)
+
+        span.set_attribute("batch.lookups", board.lookups)
+        span.set_attribute("batch.issue_updates", len(updated_issues))
+
+    put_metric("BatchEvents", len(events))
+    put_metric("BatchLookups", board.lookups)
+    put_metric("BatchIssueUpdates", len(updated_issues))
+    put_metric("BatchUpdatesCoalesced", board.updates - len(updated_issues))
+    return response_message_body(200, {
+        "message": "Process Batch Successfully",
+        "responses": responses,
+        "issues": {str(issue_iid): indexes for (issue_iid, indexes) in event_indexes.items()}
+    })
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the lambda functions import their modules by name, from the function directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions", "issue_boards_maintainer"))
+
+os.environ.setdefault("PROJECT_A_PROJECT_ID", "15")
+os.environ.setdefault("PROJECT_B_PROJECT_ID", "16")
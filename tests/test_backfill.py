@@ -0,0 +1,33 @@
+from backfill import (
+    parse_time,
+    webhook_bodies
+)
+
+
+def merge_request(iid: int, state: str, **times):
+    return dict({
+        "iid": iid,
+        "state": state,
+        "source_branch": "kitty/feature/branch-{}".format(iid),
+        "target_branch": "develop"
+    }, **times)
+
+
+def test_only_actions_since_the_start_of_the_window_are_replayed():
+    since = parse_time("2020-06-01T00:00:00Z")
+    merge_requests = [
+        # merged long ago, updated inside the window by a comment
+        merge_request(1, "merged", created_at="2020-01-01T00:00:00Z", merged_at="2020-01-02T00:00:00Z",
+                      updated_at="2020-06-05T00:00:00Z"),
+        # opened before the window, merged inside it
+        merge_request(2, "merged", created_at="2020-05-30T00:00:00Z", merged_at="2020-06-02T00:00:00Z",
+                      updated_at="2020-06-02T00:00:00Z"),
+        merge_request(3, "closed", created_at="2020-06-03T00:00:00Z", closed_at="2020-06-04T00:00:00Z",
+                      updated_at="2020-06-04T00:00:00Z")
+    ]
+
+    bodies = webhook_bodies(15, merge_requests, since)
+
+    actions = [(body["object_attributes"]["iid"], body["object_attributes"]["action"]) for (_, body) in bodies]
+    assert actions == [(2, "merge"), (3, "open"), (3, "close")]
+    assert all(key[0] >= since for (key, _) in bodies)
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from board_snapshot import (
+    BoardSnapshot,
+    LocalSnapshotStore,
+    encode_snapshot,
+    any_snapshot_version
+)
+from issue_board import InMemoryBoard
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalSnapshotStore(str(tmp_path / "board_snapshot.json.gz"))
+    store.write(encode_snapshot(InMemoryBoard(), time.time()), None)
+    return store
+
+
+def observed_issue(iid: int):
+    return {"iid": iid, "title": "branch-{}".format(iid), "labels": ["project A", "Staging"]}
+
+
+def test_write_is_rejected_when_the_version_changed(store):
+    data, version = store.read()
+    assert store.write(data, version) is not None
+    assert store.write(data, version) is None
+    assert store.write(data, any_snapshot_version) is not None
+
+
+def test_concurrent_saves_keep_both_changes(store):
+    first = BoardSnapshot(store)
+    second = BoardSnapshot(store)
+    first.refresh()
+    second.refresh()
+
+    first.observe_issues([observed_issue(1)])
+    second.observe_issues([observed_issue(2)])
+    assert first.save() is None
+    # the second save is based on the version before the first, it rereads and replays its journal
+    assert second.save() is None
+
+    latest = BoardSnapshot(store)
+    latest.refresh()
+    assert sorted(latest.board.issues) == [1, 2]
+
+
+def test_reconcile_keeps_a_save_made_during_the_fetch(store, monkeypatch):
+    import board_snapshot
+
+    def fetch_board(per_page, budget):
+        # a webhook invocation saves while the reconciliation pages through GitLab
+        webhook = BoardSnapshot(store)
+        webhook.refresh()
+        webhook.observe_issues([dict(observed_issue(2), labels=["project A", "Production"])])
+        assert webhook.save() is None
+        return InMemoryBoard({"issues": [observed_issue(1), observed_issue(2)]}), None
+
+    monkeypatch.setattr(board_snapshot, "get_board_snapshot_store", lambda: store)
+    monkeypatch.setattr(board_snapshot, "fetch_board", fetch_board)
+    response = board_snapshot.reconcile_board_snapshot({}, None)
+    assert response["statusCode"] == 200
+
+    latest = BoardSnapshot(store)
+    latest.refresh()
+    assert sorted(latest.board.issues) == [1, 2]
+    assert latest.board.issues[2]["labels"] == ["project A", "Production"]
@@ -0,0 +1,89 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+from gitlab_enum import BreakerState
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def new_breaker() -> CircuitBreaker:
+    return CircuitBreaker("GET /projects/:id/issues", failure_rate=0.5, minimum_calls=4,
+                          window_seconds=60, recovery_seconds=30)
+
+
+def test_stays_closed_below_minimum_calls(clock):
+    breaker = new_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.allow_request()
+
+
+def test_opens_at_failure_rate(clock):
+    breaker = new_breaker()
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow_request()
+
+
+def test_outcomes_leave_the_window(clock):
+    breaker = new_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 61
+    breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = new_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert not breaker.allow_request()
+
+
+def test_probe_success_closes(clock):
+    breaker = new_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.allow_request()
+
+
+def test_probe_failure_reopens(clock):
+    breaker = new_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow_request()
+    clock.now += 30
+    assert breaker.allow_request()
@@ -0,0 +1,80 @@
+import json
+
+from gitlab_payload import (
+    find_tail_value,
+    peek_payload_fields,
+    parse_webhook_body,
+    peek_min_body_size
+)
+
+
+def push_body(**fields) -> str:
+    body = {
+        "object_kind": "push",
+        "ref": "refs/heads/kitty/feature/branch",
+        "project": {"id": 15, "name": "project"},
+        "commits": [{"id": "{:040x}".format(index), "message": "commit {}".format(index)} for index in range(3)],
+        "total_commits_count": 3
+    }
+    body.update(fields)
+    return json.dumps(body)
+
+
+def test_peek_decodes_only_the_wanted_fields():
+    body = push_body()
+    assert peek_payload_fields(body, ["ref", "project"]) == {
+        "ref": "refs/heads/kitty/feature/branch",
+        "project": {"id": 15, "name": "project"}
+    }
+
+
+def test_peek_skips_the_same_key_in_nested_objects():
+    body = json.dumps({
+        "object_kind": "merge_request",
+        "user": {"project": {"id": 99}, "object_attributes": {"action": "nested"}},
+        "project": {"id": 15},
+        "object_attributes": {"action": "merge", "project": {"id": 98}}
+    })
+    assert peek_payload_fields(body, ["project", "object_attributes"]) == {
+        "project": {"id": 15},
+        "object_attributes": {"action": "merge", "project": {"id": 98}}
+    }
+
+
+def test_peek_looks_up_fields_after_heavy_keys_from_the_tail():
+    body = push_body()
+    assert peek_payload_fields(body, ["total_commits_count"]) == {"total_commits_count": 3}
+
+
+def test_peek_leaves_missing_keys_absent():
+    assert peek_payload_fields(push_body(), ["object_attributes"]) == {}
+
+
+def test_find_tail_value_returns_a_top_level_key():
+    assert find_tail_value(push_body(), "total_commits_count") == 3
+
+
+def test_find_tail_value_ignores_the_key_in_a_trailing_nested_object():
+    body = push_body(repository={"total_commits_count": 9})
+    assert find_tail_value(body, "total_commits_count") is None
+    assert peek_payload_fields(body, ["total_commits_count"]) == {"total_commits_count": 3}
+
+
+def test_find_tail_value_ignores_the_key_in_a_trailing_array():
+    body = push_body(repository=[{"total_commits_count": 9}])
+    assert find_tail_value(body, "total_commits_count") is None
+
+
+def test_find_tail_value_ignores_the_key_in_a_string():
+    body = push_body(repository={"description": '"total_commits_count": 9'})
+    assert find_tail_value(body, "total_commits_count") == 3
+
+
+def test_parse_webhook_body_peeks_large_bodies_like_a_full_parse():
+    commits = [{"id": "{:040x}".format(index), "message": "x" * 200} for index in range(200)]
+    body = push_body(commits=commits, repository={"total_commits_count": 9, "name": "project"})
+    assert len(body) > peek_min_body_size
+    body_json = parse_webhook_body("Push Hook", body)
+    full_json = json.loads(body)
+    assert {key: body_json[key] for key in ("project", "ref", "total_commits_count")} == \
+        {key: full_json[key] for key in ("project", "ref", "total_commits_count")}
@@ -0,0 +1,68 @@
+from gitlab_lib import newest_active_milestone
+from issue_board import (
+    InMemoryBoard,
+    combine_updates
+)
+from issue_planner import (
+    Mutation,
+    update_issue
+)
+
+
+def labels_of(mutation: Mutation):
+    return mutation.arguments.get("add_labels"), mutation.arguments.get("remove_labels")
+
+
+def test_combine_updates_chains_label_deltas():
+    first = update_issue(1, "first", add_labels=["Dev"], remove_labels=["Doing"])
+    second = update_issue(1, "second", add_labels=["Staging"], remove_labels=["Dev"])
+    combined = combine_updates(first, second)
+    assert labels_of(combined) == (["Staging"], ["Doing", "Dev"])
+    assert combined.error_message == "second"
+
+
+def test_combine_updates_later_add_cancels_earlier_remove():
+    first = update_issue(1, "first", remove_labels=["Dev"])
+    second = update_issue(1, "second", add_labels=["Dev"])
+    assert labels_of(combine_updates(first, second)) == (["Dev"], None)
+
+
+def test_combine_updates_full_label_list_absorbs_deltas():
+    first = update_issue(1, "first", labels=["project A", "Doing"])
+    second = update_issue(1, "second", add_labels=["Dev"], remove_labels=["Doing"])
+    combined = combine_updates(first, second)
+    assert combined.arguments["labels"] == ["project A", "Dev"]
+    assert labels_of(combined) == (None, None)
+
+    combined = combine_updates(second, update_issue(1, "third", labels=["project A"]))
+    assert combined.arguments["labels"] == ["project A"]
+    assert labels_of(combined) == (None, None)
+
+
+def test_combine_updates_keeps_the_latest_fields():
+    first = update_issue(1, "first", parkable=True, description="old", milestone_id=7)
+    second = update_issue(1, "second", parkable=False, description="new")
+    combined = combine_updates(first, second)
+    assert combined.arguments["description"] == "new"
+    assert combined.arguments["milestone_id"] == 7
+    assert not combined.parkable
+
+def test_newest_active_milestone_skips_future_sprints():
+    milestones = [
+        {"id": 1, "state": "active", "start_date": "2026-10-05"},
+        {"id": 2, "state": "active", "start_date": "2026-10-19"},
+        {"id": 3, "state": "active", "start_date": "2026-11-02"},
+        {"id": 4, "state": "closed", "start_date": "2026-10-12"}
+    ]
+    assert newest_active_milestone(milestones, "2026-10-20")["id"] == 2
+    assert newest_active_milestone(milestones, "2026-10-18")["id"] == 1
+    # a milestone without start date counts as started
+    assert newest_active_milestone([{"id": 5, "state": "active"}, milestones[2]], "2026-10-20")["id"] == 5
+
+
+def test_board_active_milestone_ignores_a_planned_sprint():
+    board = InMemoryBoard({"milestones": [
+        {"id": 7, "state": "active", "start_date": "2000-01-03"},
+        {"id": 8, "state": "active", "start_date": "9999-01-03"}
+    ]})
+    assert board.active_milestone_id() == (7, None)
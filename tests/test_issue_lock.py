@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import issue_lock
+from issue_lock import (
+    SQLiteLeaseStore,
+    issue_lock as lock
+)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SQLiteLeaseStore(str(tmp_path / "locks.sqlite3"))
+    monkeypatch.setattr(issue_lock, "lease_store", store)
+    monkeypatch.setattr(issue_lock, "lock_wait_seconds", 0.2)
+    monkeypatch.setattr(issue_lock, "lock_poll_seconds", 0.01)
+    return store
+
+
+def test_lease_is_exclusive_until_it_expires(store):
+    assert store.acquire("issue:15:feature:branch", "a", 0.1)
+    assert not store.acquire("issue:15:feature:branch", "b", 10)
+    time.sleep(0.15)
+    assert store.acquire("issue:15:feature:branch", "b", 10)
+    # the expired holder can neither renew nor release the lease of the new holder
+    assert not store.renew("issue:15:feature:branch", "a", 10)
+    store.release("issue:15:feature:branch", "a")
+    assert not store.acquire("issue:15:feature:branch", "c", 10)
+
+
+def test_released_lease_can_be_taken(store):
+    assert store.acquire("key", "a", 10)
+    store.release("key", "a")
+    assert store.acquire("key", "b", 10)
+
+
+def test_lock_times_out_while_another_invocation_holds_the_lease(store):
+    assert store.acquire("key", "other", 10)
+    with lock(["key"]) as locked:
+        assert not locked
+
+
+def test_lock_takes_an_expired_lease(store):
+    assert store.acquire("key", "crashed", 0.1)
+    with lock(["key"]) as locked:
+        assert locked
+
+
+def test_held_lease_is_renewed_past_its_ttl(store, monkeypatch):
+    monkeypatch.setattr(issue_lock, "lock_ttl_seconds", 0.2)
+    monkeypatch.setattr(issue_lock, "lock_renew_seconds", 0.05)
+    with lock(["key"]) as locked:
+        assert locked
+        time.sleep(0.5)
+        assert not store.acquire("key", "other", 10)
+    assert store.acquire("key", "other", 10)
+
+
+def test_lock_releases_every_key_when_one_is_taken(store):
+    assert store.acquire("b", "other", 10)
+    with lock(["a", "b"]) as locked:
+        assert not locked
+    assert store.acquire("a", "next", 10)
+
+
+def test_lock_without_keys_locks_nothing(store):
+    with lock([]) as locked:
+        assert locked
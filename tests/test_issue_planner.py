@@ -0,0 +1,107 @@
+from gitlab_enum import (
+    IssueLabel,
+    GitlabEvent
+)
+from issue_board import InMemoryBoard
+from issue_planner import (
+    run_plan,
+    plan_event,
+    issue_creation_keys
+)
+
+project_a_id = 15
+
+
+def staging_board(issue_count: int) -> InMemoryBoard:
+    return InMemoryBoard({
+        "milestones": [{"id": 7, "state": "active"}],
+        "issues": [{
+            "iid": iid,
+            "title": "branch-{}".format(iid),
+            "labels": [IssueLabel.PROJECT_A.value, IssueLabel.FEATURE.value, IssueLabel.STAGING.value]
+        } for iid in range(1, issue_count + 1)]
+    })
+
+
+def promotion_body():
+    return {
+        "project": {"id": project_a_id},
+        "object_attributes": {
+            "iid": 100,
+            "action": "merge",
+            "source_branch": "staging",
+            "target_branch": "master",
+            "url": "https://gitlab.com/project/-/merge_requests/100"
+        }
+    }
+
+
+def production_iids(board: InMemoryBoard):
+    return sorted(iid for (iid, issue) in board.issues.items() if IssueLabel.PRODUCTION.value in issue["labels"])
+
+
+def test_promotion_without_budget_moves_every_issue():
+    board = staging_board(5)
+    response, mutations = run_plan(plan_event(GitlabEvent.MERGE_REQUEST_HOOK.value, promotion_body(), board),
+                                   board.apply_mutation)
+    assert response["statusCode"] == 200
+    assert len(mutations) == 5
+    assert production_iids(board) == [1, 2, 3, 4, 5]
+
+
+def test_promotion_over_budget_parks_the_rest():
+    board = staging_board(5)
+    parked = []
+
+    def park_mutation(mutation, error):
+        parked.append(mutation.arguments["issue_iid"])
+        return "item-{}".format(len(parked)), None
+
+    response, mutations = run_plan(plan_event(GitlabEvent.MERGE_REQUEST_HOOK.value, promotion_body(), board, 2),
+                                   board.apply_mutation,
+                                   park_mutation)
+    assert response["statusCode"] == 202
+    assert '"deferred_issues": 3' in response["body"]
+    assert len(production_iids(board)) == 2
+    assert len(parked) == 3
+    assert sorted(production_iids(board) + parked) == [1, 2, 3, 4, 5]
+    assert all(mutation.deferred for mutation in mutations if mutation.arguments["issue_iid"] in parked)
+
+
+def test_promotion_budget_counts_the_related_issues_of_an_epic():
+    board = InMemoryBoard({
+        "milestones": [{"id": 7, "state": "active"}],
+        "issues": [{
+            "iid": 1,
+            "title": "topic/release",
+            "description": "Related Issue URL: https://gitlab.com/project/-/issues/2",
+            "labels": [IssueLabel.PROJECT_A.value, IssueLabel.EPIC.value, IssueLabel.STAGING.value]
+        }, {
+            "iid": 2,
+            "title": "branch-2",
+            "labels": [IssueLabel.PROJECT_A.value, IssueLabel.FEATURE.value, IssueLabel.PRODUCTION.value]
+        }]
+    })
+    # the EPIC and its related issue take two calls
+    response, mutations = run_plan(plan_event(GitlabEvent.MERGE_REQUEST_HOOK.value, promotion_body(), board, 1),
+                                   board.apply_mutation,
+                                   lambda mutation, error: ("item", None))
+    assert response["statusCode"] == 202
+    assert [mutation.arguments["issue_iid"] for mutation in mutations] == [1, 2]
+    assert all(mutation.deferred for mutation in mutations)
+    assert production_iids(board) == [2]
+
+
+def test_issue_creation_keys_lock_the_epic_of_a_topic_branch():
+    body = {
+        "project": {"id": project_a_id},
+        "object_attributes": {"action": "merge", "source_branch": "kitty/feature/branch", "target_branch": "topic/release"}
+    }
+    assert issue_creation_keys(GitlabEvent.MERGE_REQUEST_HOOK.value, body) == [
+        "epic:{}:topic/release".format(project_a_id),
+        "issue:{}:feature:branch".format(project_a_id)
+    ]
+    body["object_attributes"]["target_branch"] = "dev"
+    assert issue_creation_keys(GitlabEvent.MERGE_REQUEST_HOOK.value, body) == [
+        "issue:{}:feature:branch".format(project_a_id)
+    ]
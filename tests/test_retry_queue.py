@@ -0,0 +1,135 @@
+import time
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+import pytest
+
+import retry_queue
+import retry_drainer
+import priority_lanes
+from circuit_breaker import CircuitOpenError
+from gitlab_lib import error_response_body
+from gitlab_enum import RetryItemStatus
+from retry_queue import (
+    SQLiteRetryQueue,
+    retry_delay,
+    new_retry_item,
+    next_retry_item
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteRetryQueue(str(tmp_path / "retry_queue.sqlite3"))
+
+
+def test_retry_delay_is_capped_exponential_backoff(monkeypatch):
+    monkeypatch.setattr(retry_queue, "retry_base_delay", 30)
+    monkeypatch.setattr(retry_queue, "retry_max_delay", 3600)
+    monkeypatch.setattr(retry_queue.random, "uniform", lambda low, high: high)
+    assert retry_delay(1) == 60
+    assert retry_delay(3) == 240
+    assert retry_delay(10) == 3600
+
+
+def test_retry_delay_has_full_jitter():
+    delays = [retry_delay(2) for _ in range(200)]
+    assert all(0 <= delay <= retry_queue.retry_base_delay * 4 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_failed_attempts_are_rescheduled_then_dead_lettered(monkeypatch):
+    monkeypatch.setattr(retry_queue, "retry_max_attempts", 3)
+    item = new_retry_item("update_project_issue", {"issue_iid": 1}, ValueError("first"))
+    assert item["status"] == RetryItemStatus.PENDING.value
+    assert item["attempts"] == 1
+
+    item = next_retry_item(item, ValueError("second"))
+    assert item["status"] == RetryItemStatus.PENDING.value
+    assert item["attempts"] == 2
+    assert item["next_attempt_at"] >= time.time()
+    assert item["last_error"] == "second"
+
+    item = next_retry_item(item, ValueError("third"))
+    assert item["status"] == RetryItemStatus.DEAD.value
+    assert item["last_error"] == "third"
+
+
+def test_sqlite_queue_returns_due_and_dead_items(queue):
+    due = dict(new_retry_item("update_project_issue", {"issue_iid": 1}), next_attempt_at=time.time() - 1)
+    later = dict(new_retry_item("update_project_issue", {"issue_iid": 2}), next_attempt_at=time.time() + 600)
+    dead = dict(new_retry_item("update_project_issue", {"issue_iid": 3}), status=RetryItemStatus.DEAD.value)
+    for item in (due, later, dead):
+        queue.put(item)
+
+    assert [item["item_id"] for item in queue.due_items(10)] == [due["item_id"]]
+    assert [item["item_id"] for item in queue.dead_items(10)] == [dead["item_id"]]
+    assert queue.get(due["item_id"])["arguments"] == {"issue_iid": 1}
+    queue.delete(due["item_id"])
+    assert queue.get(due["item_id"]) is None
+
+
+class StaleIndexQueue:
+    """A queue whose due items lag behind its writes, like a DynamoDB GSI."""
+
+    def __init__(self, items):
+        self.items = items
+        self.puts = []
+        self.deletes = []
+
+    def due_items(self, limit):
+        return [dict(item) for item in self.items[:limit]]
+
+    def put(self, item):
+        self.puts.append(item)
+
+    def delete(self, item_id):
+        self.deletes.append(item_id)
+
+
+def test_drain_handles_each_item_once_per_invocation(monkeypatch):
+    calls = []
+
+    def update_project_issue(**arguments):
+        calls.append(arguments["issue_iid"])
+        return None if arguments["issue_iid"] == 1 else ValueError("500 Server Error")
+
+    items = [dict(new_retry_item("update_project_issue", {"issue_iid": iid}), next_attempt_at=0) for iid in (1, 2)]
+    queue = StaleIndexQueue(items)
+    monkeypatch.setattr(retry_drainer, "get_retry_queue", lambda: queue)
+    monkeypatch.setitem(retry_drainer.retry_operations, "update_project_issue", update_project_issue)
+
+    response = retry_drainer.drain_retry_queue({}, None)
+
+    assert sorted(calls) == [1, 2]
+    assert queue.deletes == [items[0]["item_id"]]
+    assert [item["item_id"] for item in queue.puts] == [items[1]["item_id"]]
+    assert '"replayed": 1' in response["body"]
+    assert '"rescheduled": 1' in response["body"]
+
+
+def test_deferred_event_keeps_its_attempts_while_the_circuit_is_open(monkeypatch):
+    @contextmanager
+    def issue_lock(keys):
+        yield True
+
+    circuit_error = CircuitOpenError("PUT /projects/:id/issues/:iid")
+    monkeypatch.setattr(priority_lanes, "issue_lock", issue_lock)
+    monkeypatch.setattr(priority_lanes, "GitLabBoard", lambda: SimpleNamespace(apply_mutation=None))
+    monkeypatch.setattr(priority_lanes, "plan_event", lambda gitlab_event, body_json, board: None)
+    monkeypatch.setattr(priority_lanes, "run_plan",
+                        lambda plan, apply_mutation: (error_response_body("Update Issue Error", circuit_error), []))
+
+    error = priority_lanes.plan_webhook_event("Push Hook", {"object_kind": "push"})
+    assert isinstance(error, CircuitOpenError)
+    assert error.endpoint == circuit_error.endpoint
+
+    item = dict(new_retry_item("plan_webhook_event", {"gitlab_event": "Push Hook", "body_json": {}}), next_attempt_at=0)
+    queue = StaleIndexQueue([item])
+    monkeypatch.setattr(retry_drainer, "get_retry_queue", lambda: queue)
+    response = retry_drainer.drain_retry_queue({}, None)
+
+    # the item is neither rescheduled nor deleted, its attempts are left as they were
+    assert queue.puts == []
+    assert queue.deletes == []
+    assert '"circuit_open": true' in response["body"]
@@ -0,0 +1,54 @@
+import pytest
+
+import sprint_rollover
+from checkpoint_store import SQLiteCheckpointStore
+
+
+class FakeContext:
+    def __init__(self, remaining_millis):
+        self.remaining_millis = list(remaining_millis)
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis.pop(0) if len(self.remaining_millis) > 1 else self.remaining_millis[0]
+
+
+@pytest.fixture
+def issues(tmp_path, monkeypatch):
+    issues = {
+        iid: {"iid": iid, "state": "opened", "milestone": {"id": 6},
+              "created_at": "2026-10-0{}T00:00:00Z".format(iid)}
+        for iid in range(1, 6)
+    }
+
+    def search_project_issues(project_id, per_page=None, state=None, sort=None, order_by=None, created_after=None):
+        found = [issue for issue in issues.values()
+                 if issue["state"] == state and issue["created_at"] >= (created_after or "")]
+        found.sort(key=lambda issue: (issue["created_at"], issue["iid"]))
+        return found[:per_page], None
+
+    def update_project_issue(project_id, issue_iid, milestone_id):
+        issues[issue_iid]["milestone"] = {"id": milestone_id}
+        return None
+
+    monkeypatch.setattr(sprint_rollover, "search_active_milestones", lambda: ([{"id": 7, "state": "active"}], None))
+    monkeypatch.setattr(sprint_rollover, "search_project_issues", search_project_issues)
+    monkeypatch.setattr(sprint_rollover, "update_project_issue", update_project_issue)
+    monkeypatch.setattr(sprint_rollover, "get_checkpoint_store",
+                        lambda: SQLiteCheckpointStore(str(tmp_path / "checkpoints.sqlite3")))
+    monkeypatch.setattr(sprint_rollover, "rollover_per_page", 2)
+    monkeypatch.setattr(sprint_rollover, "rollover_rate", 1000)
+    return issues
+
+
+def test_rollover_resumes_after_the_last_issue_when_issues_close(issues):
+    # time runs out after the first page
+    paused = sprint_rollover.sprint_rollover({}, FakeContext([60000, 0]))
+    assert paused["statusCode"] == 202
+    assert [issue["milestone"]["id"] for issue in issues.values()] == [7, 7, 6, 6, 6]
+
+    # closing the issues already processed shifts the pages of open issues
+    issues[1]["state"] = "closed"
+    issues[2]["state"] = "closed"
+    response = sprint_rollover.sprint_rollover({}, FakeContext([60000]))
+    assert response["statusCode"] == 200
+    assert [issue["milestone"]["id"] for issue in issues.values()] == [7, 7, 7, 7, 7]